@@ -0,0 +1,173 @@
+"""Batched, asynchronous ActivityLog writer.
+
+log_activity() used to add an ActivityLog row and commit the caller's
+session on every call. Entries are now captured up front (IP, user agent,
+timestamp), handed to a background thread once the request has finished,
+and bulk-inserted with a single executemany INSERT per batch on a
+connection of their own.
+
+An entry describes work the request's session may still roll back, so
+entries logged since the session last committed are dropped when it rolls
+back, and a request that fails with an exception writes none at all.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from app import app, db
+from models import ActivityLog
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityWriter:
+    """Queue ActivityLog entries and insert them in batches"""
+
+    def __init__(self, app=None):
+        self.batch_size = 100
+        self.flush_interval = 2.0
+        self.max_queue = 10000
+        self.put_timeout = 0.05
+        self.sync = False
+        self.dropped = 0
+        self._app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.batch_size = app.config.get('ACTIVITY_LOG_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('ACTIVITY_LOG_FLUSH_INTERVAL', self.flush_interval)
+        self.max_queue = app.config.get('ACTIVITY_LOG_MAX_QUEUE', self.max_queue)
+        self.sync = app.config.get('ACTIVITY_LOG_SYNC', self.sync)
+        app.teardown_request(self._enqueue_request_entries)
+        event.listen(db.session, 'after_commit', self._confirm_request_entries)
+        event.listen(db.session, 'after_soft_rollback', self._drop_request_entries)
+        atexit.register(self.shutdown)
+
+    def log(self, user_id, action, description):
+        """Capture an entry now; it is written after the request finishes"""
+        entry = {
+            'user_id': user_id,
+            'action': action,
+            'description': description,
+            'ip_address': None,
+            'user_agent': None,
+            'created_at': datetime.utcnow()
+        }
+        if has_request_context():
+            entry['ip_address'] = request.remote_addr
+            entry['user_agent'] = (request.headers.get('User-Agent', '') or '')[:500]
+            # Hold entries until teardown so rows referencing objects the
+            # view has not committed yet are not inserted ahead of them
+            g.setdefault('_activity_pending', []).append(entry)
+        else:
+            self._enqueue([entry])
+
+    def flush(self):
+        """Block until everything queued so far has been written"""
+        if self._queue is not None and self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def shutdown(self):
+        """Stop the background thread after draining the queue"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+        self._thread = None
+
+    def _confirm_request_entries(self, session):
+        if has_request_context() and '_activity_pending' in g:
+            g.setdefault('_activity_entries', []).extend(g.pop('_activity_pending'))
+
+    def _drop_request_entries(self, session, previous_transaction):
+        if has_request_context() and g.get('_activity_pending'):
+            dropped = g.pop('_activity_pending')
+            logger.info("Dropped %d activity entries rolled back with their request's changes", len(dropped))
+
+    def _enqueue_request_entries(self, exc=None):
+        entries = g.pop('_activity_entries', []) + g.pop('_activity_pending', [])
+        if entries and exc is None:
+            self._enqueue(entries)
+        elif entries:
+            logger.info("Dropped %d activity entries of a failed request", len(entries))
+
+    def _enqueue(self, entries):
+        if self.sync:
+            self._write(entries)
+            return
+
+        self._ensure_thread()
+        for entry in entries:
+            try:
+                self._queue.put(entry, timeout=self.put_timeout)
+            except queue.Full:
+                # Backpressure: shed log entries rather than stall requests
+                self.dropped += 1
+                logger.warning("Activity log queue full; dropped %s entry", entry['action'])
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so gunicorn workers start their own
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            try:
+                if batch:
+                    self._write(batch)
+            finally:
+                for _ in range(len(batch) + (1 if stopping else 0)):
+                    self._queue.task_done()
+
+    def _write(self, entries):
+        table = ActivityLog.__table__
+        with self._app.app_context():
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(table.insert(), entries)
+            except Exception:
+                if len(entries) == 1:
+                    logger.exception("Error logging activity %s", entries[0]['action'])
+                    return
+                # One bad row (e.g. a user whose creation was rolled back)
+                # should not cost the rest of the batch
+                for entry in entries:
+                    self._write([entry])
+
+
+activity_writer = ActivityWriter(app)
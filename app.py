@@ -1,6 +1,8 @@
 import os
 import logging
+import stat
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
@@ -10,14 +12,49 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; LOG_LEVEL=DEBUG for development
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 
 class Base(DeclarativeBase):
     pass
 
 db = SQLAlchemy(model_class=Base)
 
+def private_directory(path):
+    """Create `path` (mode 0700) if needed and return it.
+
+    For directories whose files the app loads back as code or trusts as
+    its own state: raises RuntimeError if the directory belongs to another
+    user or others can write to or read it.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.geteuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"{path} must be a directory owned by this user with mode 0700")
+    return path
+
+class PrivateBytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache that creates its private directory on first use"""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self._checked = False
+
+    def _get_cache_filename(self, bucket):
+        if not self._checked:
+            private_directory(self.directory)
+            self._checked = True
+        return super()._get_cache_filename(bucket)
+
+def state_path(name):
+    """Path of state file `name` shared by this deployment's workers.
+
+    It lives in the private instance/state directory; nothing is created
+    here, so callers run private_directory() on its directory when they
+    first open it.
+    """
+    return os.path.join(app.instance_path, 'state', name)
+
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
@@ -33,6 +70,18 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+# Connections each process may hold: DB_POOL_SIZE kept open plus up to
+# DB_MAX_OVERFLOW more under load; a thread beyond that waits up to
+# DB_POOL_TIMEOUT seconds. This is deliberately not tied to the worker's
+# thread count, since most threads sit in SSE streams without a connection.
+# The database must accept workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW);
+# gunicorn.conf.py checks that against DB_MAX_CONNECTIONS.
+if not app.config["SQLALCHEMY_DATABASE_URI"].startswith('sqlite'):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update(
+        pool_size=int(os.environ.get('DB_POOL_SIZE', '5')),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', '5')),
+        pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', '10')),
+    )
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # File upload configuration
@@ -43,18 +92,110 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['STRIPE_PUBLISHABLE_KEY'] = os.environ.get('STRIPE_PUBLISHABLE_KEY', 'pk_test_default')
 app.config['STRIPE_SECRET_KEY'] = os.environ.get('STRIPE_SECRET_KEY', 'sk_test_default')
 
+# Thawani payment gateway client (see gateway.py); timeouts in seconds
+app.config['THAWANI_API_BASE_URL'] = os.environ.get('THAWANI_API_BASE_URL', 'https://uatcheckout.thawani.om/api/v1')
+app.config['THAWANI_API_KEY'] = os.environ.get('THAWANI_API_KEY')
+app.config['THAWANI_CONNECT_TIMEOUT'] = float(os.environ.get('THAWANI_CONNECT_TIMEOUT', '3'))
+app.config['THAWANI_READ_TIMEOUT'] = float(os.environ.get('THAWANI_READ_TIMEOUT', '10'))
+app.config['THAWANI_MAX_RETRIES'] = int(os.environ.get('THAWANI_MAX_RETRIES', '2'))
+app.config['THAWANI_RETRY_BACKOFF'] = float(os.environ.get('THAWANI_RETRY_BACKOFF', '0.2'))
+app.config['THAWANI_POOL_SIZE'] = int(os.environ.get('THAWANI_POOL_SIZE', '10'))
+app.config['THAWANI_BREAKER_THRESHOLD'] = int(os.environ.get('THAWANI_BREAKER_THRESHOLD', '5'))
+app.config['THAWANI_BREAKER_RESET'] = float(os.environ.get('THAWANI_BREAKER_RESET', '30'))
+
+# Background job queue (see jobs.py); run the worker with `flask jobs worker`
+app.config['JOBS_POLL_INTERVAL'] = float(os.environ.get('JOBS_POLL_INTERVAL', '1'))
+app.config['JOBS_MAX_ATTEMPTS'] = int(os.environ.get('JOBS_MAX_ATTEMPTS', '5'))
+app.config['JOBS_LEASE_SECONDS'] = int(os.environ.get('JOBS_LEASE_SECONDS', '300'))
+app.config['JOBS_RETRY_BACKOFF'] = float(os.environ.get('JOBS_RETRY_BACKOFF', '5'))
+app.config['JOBS_RETRY_MAX'] = float(os.environ.get('JOBS_RETRY_MAX', '600'))
+# SQLite only, and only for `flask jobs worker`'s own connections (see
+# jobs.configure_worker_connections): WAL keeps the worker's writes from
+# blocking readers, and JOBS_SQLITE_SYNCHRONOUS=NORMAL drops the fsync from
+# each queue commit. The web app keeps SQLite's default durability.
+JOBS_SQLITE_SYNCHRONOUS_LEVELS = {'OFF': 0, 'NORMAL': 1, 'FULL': 2, 'EXTRA': 3}
+app.config['JOBS_SQLITE_WAL'] = os.environ.get('JOBS_SQLITE_WAL', '1').lower() in ('1', 'true', 'yes')
+app.config['JOBS_SQLITE_SYNCHRONOUS'] = os.environ.get('JOBS_SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+if app.config['JOBS_SQLITE_SYNCHRONOUS'] not in JOBS_SQLITE_SYNCHRONOUS_LEVELS:
+    raise ValueError(f"JOBS_SQLITE_SYNCHRONOUS must be one of {', '.join(JOBS_SQLITE_SYNCHRONOUS_LEVELS)}")
+
+# Payment webhook processing (see webhooks.py); runs inside the job worker
+app.config['WEBHOOK_BATCH_SIZE'] = int(os.environ.get('WEBHOOK_BATCH_SIZE', '500'))
+app.config['WEBHOOK_POLL_INTERVAL'] = float(os.environ.get('WEBHOOK_POLL_INTERVAL', '0.5'))
+app.config['WEBHOOK_CLAIM_TIMEOUT'] = int(os.environ.get('WEBHOOK_CLAIM_TIMEOUT', '300'))
+
+# Pending payment reconciliation (see reconcile.py); ages in seconds
+app.config['RECONCILE_BATCH_SIZE'] = int(os.environ.get('RECONCILE_BATCH_SIZE', '200'))
+app.config['RECONCILE_WORKERS'] = int(os.environ.get('RECONCILE_WORKERS', '8'))
+app.config['RECONCILE_MIN_AGE'] = int(os.environ.get('RECONCILE_MIN_AGE', '3600'))
+app.config['RECONCILE_ABANDON_AFTER'] = int(os.environ.get('RECONCILE_ABANDON_AFTER', '86400'))
+app.config['RECONCILE_CHECKPOINT_PATH'] = os.environ.get('RECONCILE_CHECKPOINT_PATH')
+
+# Blog view/like counter buffering (see counters.py)
+app.config['COUNTER_FLUSH_INTERVAL'] = float(os.environ.get('COUNTER_FLUSH_INTERVAL', '10'))
+app.config['COUNTER_MAX_PENDING'] = int(os.environ.get('COUNTER_MAX_PENDING', '500'))
+app.config['COUNTER_SPOOL_PATH'] = os.environ.get('COUNTER_SPOOL_PATH')
+
+# Seconds a changed blog post waits before it is re-indexed for search (see search.py)
+app.config['SEARCH_REINDEX_DELAY'] = float(os.environ.get('SEARCH_REINDEX_DELAY', '5'))
+
+# Activity log writer (see activity.py); ACTIVITY_LOG_SYNC writes inline for tests
+app.config['ACTIVITY_LOG_BATCH_SIZE'] = int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', '100'))
+app.config['ACTIVITY_LOG_FLUSH_INTERVAL'] = float(os.environ.get('ACTIVITY_LOG_FLUSH_INTERVAL', '2'))
+app.config['ACTIVITY_LOG_MAX_QUEUE'] = int(os.environ.get('ACTIVITY_LOG_MAX_QUEUE', '10000'))
+app.config['ACTIVITY_LOG_SYNC'] = os.environ.get('ACTIVITY_LOG_SYNC', '').lower() in ('1', 'true', 'yes')
+
+# Admin dashboard counters cache lifetime in seconds (see stats.py)
+app.config['ADMIN_STATS_TTL'] = int(os.environ.get('ADMIN_STATS_TTL', '30'))
+
+# Shared file holding per-user notification versions (see notifications.py)
+app.config['NOTIFICATION_VERSION_PATH'] = os.environ.get('NOTIFICATION_VERSION_PATH')
+
+# Server-Sent Events (see events.py); EVENT_BACKEND is 'file' or 'local'
+app.config['EVENT_BACKEND'] = os.environ.get('EVENT_BACKEND', 'file')
+app.config['EVENT_SPOOL_PATH'] = os.environ.get('EVENT_SPOOL_PATH')
+app.config['SSE_MAX_CONNECTIONS'] = int(os.environ.get('SSE_MAX_CONNECTIONS', '50'))
+app.config['SSE_MAX_PENDING'] = int(os.environ.get('SSE_MAX_PENDING', '100'))
+app.config['SSE_HEARTBEAT_INTERVAL'] = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', '15'))
+app.config['SSE_MAX_DURATION'] = float(os.environ.get('SSE_MAX_DURATION', '300'))
+
+# Flask-Login user snapshot cache (see user_cache.py)
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', '1024'))
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', '300'))
+app.config['USER_CACHE_VERSION_PATH'] = os.environ.get('USER_CACHE_VERSION_PATH')
+
+# Anonymous public page cache (see page_cache.py); backend is memory, file or null
+app.config['PAGE_CACHE_BACKEND'] = os.environ.get('PAGE_CACHE_BACKEND', 'memory')
+app.config['PAGE_CACHE_DIR'] = os.environ.get('PAGE_CACHE_DIR')
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', '60'))
+app.config['PAGE_CACHE_STALE_TTL'] = int(os.environ.get('PAGE_CACHE_STALE_TTL', '300'))
+app.config['PAGE_CACHE_MAX_ENTRIES'] = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', '512'))
+
+# Compiled template cache shared by all workers on the host (see warmup.py).
+# Entries are keyed on template source checksums, so deploys never see stale code.
+# Jinja runs what it loads from here, so it must be private to this user.
+app.config['JINJA_BYTECODE_CACHE_DIR'] = os.environ.get(
+    'JINJA_BYTECODE_CACHE_DIR', os.path.join(app.instance_path, 'jinja'))
+if app.config['JINJA_BYTECODE_CACHE_DIR']:
+    app.jinja_options = {
+        **app.jinja_options,
+        'bytecode_cache': PrivateBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+    }
+
+# Per-request instrumentation (see metrics.py): Server-Timing headers and
+# Prometheus histograms at /metrics, summed across workers through METRICS_DIR
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+app.config['METRICS_SERVER_TIMING'] = os.environ.get('METRICS_SERVER_TIMING', '1').lower() in ('1', 'true', 'yes')
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', '1'))
+
 # Initialize extensions
 db.init_app(app)
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 login_manager.login_message_category = 'info'
 
 jwt = JWTManager(app)
-
-# Create upload directory
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-with app.app_context():
-    # Import models to ensure tables are created
-    import models  # noqa: F401
@@ -0,0 +1,200 @@
+"""Static asset pipeline.
+
+`flask assets build` copies the stylesheets, scripts and vendored third-party
+assets into static/dist/ under content-hashed names, minifying CSS/JS and
+writing .gz/.br siblings for nginx's gzip_static/brotli_static. It records
+the mapping in static/dist/manifest.json.
+
+At runtime the `url_for` used by templates looks static filenames up in the
+manifest. Without a build, local files are served under their plain names
+and vendored assets fall back to their CDN URLs, so development needs no
+build step.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+from flask import url_for
+
+from app import app
+
+logger = logging.getLogger(__name__)
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# Directories under static/ that are published through the pipeline
+SOURCE_DIRS = ('css', 'js', 'images', 'vendor')
+
+# Vendored files other than CSS/JS (fonts referenced by relative URLs inside
+# vendored stylesheets) keep their paths so those references still resolve
+HASHED_EXTENSIONS = ('.css', '.js')
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.svg', '.ttf')
+
+BOOTSTRAP_CDN = 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist'
+FONT_AWESOME_CDN = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0'
+
+# Local path under static/ -> upstream URL
+VENDOR_ASSETS = {
+    'vendor/bootstrap-5.3.0/css/bootstrap.min.css': f'{BOOTSTRAP_CDN}/css/bootstrap.min.css',
+    'vendor/bootstrap-5.3.0/js/bootstrap.bundle.min.js': f'{BOOTSTRAP_CDN}/js/bootstrap.bundle.min.js',
+    'vendor/fontawesome-6.4.0/css/all.min.css': f'{FONT_AWESOME_CDN}/css/all.min.css',
+}
+for _font in ('fa-brands-400', 'fa-regular-400', 'fa-solid-900', 'fa-v4compatibility'):
+    for _ext in ('woff2', 'ttf'):
+        VENDOR_ASSETS[f'vendor/fontawesome-6.4.0/webfonts/{_font}.{_ext}'] = \
+            f'{FONT_AWESOME_CDN}/webfonts/{_font}.{_ext}'
+
+
+class AssetManifest:
+    """Map logical static filenames to their built, hashed paths"""
+
+    def __init__(self, app=None):
+        self.static_folder = None
+        self.entries = {}
+        self._mtime = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.load()
+        app.jinja_env.globals['url_for'] = self.url_for
+
+    @property
+    def path(self):
+        return os.path.join(self.static_folder, DIST_DIR, MANIFEST_NAME)
+
+    def load(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return
+            with open(self.path) as handle:
+                self.entries = json.load(handle)
+            self._mtime = mtime
+        except FileNotFoundError:
+            self.entries = {}
+            self._mtime = None
+        except ValueError:
+            logger.error("Ignoring unreadable asset manifest %s", self.path)
+
+    def resolve(self, filename):
+        """Return the path under static/ to serve for `filename`, or None"""
+        if filename in self.entries:
+            return self.entries[filename]
+        if filename in VENDOR_ASSETS and not os.path.exists(os.path.join(self.static_folder, filename)):
+            return None
+        return filename
+
+    def url_for(self, endpoint, **values):
+        """url_for that emits hashed names for static files"""
+        if endpoint == 'static' and 'filename' in values:
+            if app.debug:
+                self.load()
+            filename = self.resolve(values['filename'])
+            if filename is None:
+                return VENDOR_ASSETS[values['filename']]
+            values['filename'] = filename
+        return url_for(endpoint, **values)
+
+
+asset_manifest = AssetManifest(app)
+
+
+def fetch_vendor_assets(static_folder, force=False):
+    """Download VENDOR_ASSETS into static/; returns the number fetched"""
+    import requests
+
+    fetched = 0
+    for filename, source in VENDOR_ASSETS.items():
+        target = os.path.join(static_folder, filename)
+        if os.path.exists(target) and not force:
+            continue
+        response = requests.get(source, timeout=30)
+        response.raise_for_status()
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as handle:
+            handle.write(response.content)
+        fetched += 1
+    return fetched
+
+
+def minify(filename, data):
+    """Minify CSS/JS source; already-minified files pass through unchanged"""
+    if filename.endswith('.min.css') or filename.endswith('.min.js'):
+        return data
+    if filename.endswith('.css'):
+        import rcssmin
+        return rcssmin.cssmin(data.decode('utf-8')).encode('utf-8')
+    if filename.endswith('.js'):
+        import rjsmin
+        return rjsmin.jsmin(data.decode('utf-8')).encode('utf-8')
+    return data
+
+
+def hashed_name(filename, data):
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def write_compressed(path, data):
+    """Write .gz (and .br when brotli is installed) next to `path`"""
+    with open(path + '.gz', 'wb') as handle:
+        handle.write(gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(path + '.br', 'wb') as handle:
+        handle.write(brotli.compress(data, quality=11))
+
+
+def build_assets(static_folder, clean=False):
+    """Rebuild static/dist/ and its manifest; returns the manifest.
+
+    Files from earlier builds stay in place (workers still running the old
+    manifest keep serving them) unless `clean` is set.
+    """
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    for source_dir in SOURCE_DIRS:
+        for root, _, files in os.walk(os.path.join(static_folder, source_dir)):
+            for name in sorted(files):
+                source = os.path.join(root, name)
+                filename = os.path.relpath(source, static_folder).replace(os.sep, '/')
+                with open(source, 'rb') as handle:
+                    data = handle.read()
+
+                if filename.endswith(HASHED_EXTENSIONS) or not filename.startswith('vendor/'):
+                    data = minify(filename, data)
+                    built = hashed_name(filename, data)
+                else:
+                    built = filename
+                target = os.path.join(dist, built)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'wb') as handle:
+                    handle.write(data)
+                if filename.endswith(COMPRESSED_EXTENSIONS):
+                    write_compressed(target, data)
+                manifest[filename] = f"{DIST_DIR}/{built}"
+
+    if clean:
+        keep = {path[len(DIST_DIR) + 1:] for path in manifest.values()}
+        for root, _, files in os.walk(dist):
+            for name in files:
+                built = os.path.relpath(os.path.join(root, name), dist).replace(os.sep, '/')
+                for suffix in ('.gz', '.br'):
+                    if built.endswith(suffix):
+                        built = built[:-len(suffix)]
+                if built not in keep and built != MANIFEST_NAME:
+                    os.unlink(os.path.join(root, name))
+
+    # Publish the manifest last, atomically, once every file it names exists
+    manifest_path = os.path.join(dist, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
@@ -5,13 +5,16 @@ from werkzeug.utils import secure_filename
 import os
 from app import db, login_manager
 from models import User, UserRole, ActivityLog
+from user_cache import user_cache
 from utils import log_activity, allowed_file
 
 auth_bp = Blueprint('auth', __name__)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # current_user is a cached read-only snapshot; views that change the
+    # user load the User row themselves
+    return user_cache.get(int(user_id))
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -121,20 +124,22 @@ def logout():
 @auth_bp.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
+    user = User.query.get_or_404(current_user.id)
+    
     if request.method == 'POST':
-        current_user.first_name = request.form.get('first_name', current_user.first_name)
-        current_user.last_name = request.form.get('last_name', current_user.last_name)
-        current_user.phone = request.form.get('phone', current_user.phone)
+        user.first_name = request.form.get('first_name', user.first_name)
+        user.last_name = request.form.get('last_name', user.last_name)
+        user.phone = request.form.get('phone', user.phone)
         
         # Handle profile image upload
         if 'profile_image' in request.files:
             profile_image = request.files['profile_image']
             if profile_image and allowed_file(profile_image.filename):
-                filename = secure_filename(f"{current_user.username}_profile_{profile_image.filename}")
+                filename = secure_filename(f"{user.username}_profile_{profile_image.filename}")
                 profile_path = os.path.join('uploads', 'profiles', filename)
                 os.makedirs(os.path.dirname(profile_path), exist_ok=True)
                 profile_image.save(profile_path)
-                current_user.profile_image = profile_path
+                user.profile_image = profile_path
         
         # Handle password change
         current_password = request.form.get('current_password')
@@ -142,22 +147,23 @@ def profile():
         confirm_password = request.form.get('confirm_password')
         
         if current_password and new_password:
-            if not current_user.check_password(current_password):
+            if not user.check_password(current_password):
                 flash('Current password is incorrect', 'error')
-                return render_template('profile.html')
+                return render_template('profile.html', user=user)
             
             if new_password != confirm_password:
                 flash('New passwords do not match', 'error')
-                return render_template('profile.html')
+                return render_template('profile.html', user=user)
             
-            current_user.set_password(new_password)
-            log_activity(current_user.id, 'PASSWORD_CHANGE', 'User changed password')
+            user.set_password(new_password)
+            log_activity(user.id, 'PASSWORD_CHANGE', 'User changed password')
         
+        # Committing a User change also invalidates its cached snapshot
         db.session.commit()
-        log_activity(current_user.id, 'PROFILE_UPDATE', 'User updated profile')
+        log_activity(user.id, 'PROFILE_UPDATE', 'User updated profile')
         flash('Profile updated successfully', 'success')
     
-    return render_template('profile.html')
+    return render_template('profile.html', user=user)
 
 @auth_bp.route('/reset-password', methods=['GET', 'POST'])
 def reset_password():
@@ -0,0 +1,100 @@
+"""Gateway checkout sessions, created by the job worker.
+
+Creating a Stripe or Thawani checkout session is a round trip to the
+gateway that can take seconds, or much longer while it is struggling. The
+checkout views only record a job (see jobs.py) next to the payment and hand
+the client a job id; the worker makes the gateway call and stores the
+session id on the payment, and the client redirects to the checkout URL
+once the job succeeds.
+"""
+from app import app, db
+from gateway import GatewayError, GatewayUnavailable, thawani
+from jobs import PermanentJobError, RetryJobLater, enqueue, job_handler
+from models import Payment
+
+STRIPE_CHECKOUT = 'stripe_checkout'
+THAWANI_CHECKOUT = 'thawani_checkout'
+
+
+def stripe_sdk():
+    """The Stripe SDK, configured; imported on first use as it is slow to load"""
+    import stripe
+    stripe.api_key = app.config['STRIPE_SECRET_KEY']
+    return stripe
+
+
+def queue_stripe_checkout(payment, user_id, success_url, cancel_url):
+    """Queue a Stripe checkout session for `payment`; returns the job"""
+    return enqueue(STRIPE_CHECKOUT, {
+        'payment_id': payment.id,
+        'user_id': user_id,
+        'success_url': success_url,
+        'cancel_url': cancel_url,
+    }, user_id=user_id, payment_id=payment.id)
+
+
+def queue_thawani_checkout(payment, payload):
+    """Queue a Thawani checkout session with the API `payload`; returns the job"""
+    return enqueue(THAWANI_CHECKOUT, {'payment_id': payment.id, 'request': payload},
+                   user_id=payment.user_id, payment_id=payment.id)
+
+
+def _payment(payload):
+    payment = db.session.get(Payment, payload['payment_id'])
+    if payment is None:
+        raise PermanentJobError("The payment no longer exists")
+    return payment
+
+
+@job_handler(STRIPE_CHECKOUT)
+def create_stripe_session(payload, job):
+    payment = _payment(payload)
+    stripe = stripe_sdk()
+    try:
+        checkout_session = stripe.checkout.Session.create(
+            line_items=[
+                {
+                    'price_data': {
+                        'currency': payment.currency.lower(),
+                        'product_data': {
+                            'name': payment.description or f'Payment #{payment.id}',
+                        },
+                        'unit_amount': int(payment.amount * 100),  # Convert to cents
+                    },
+                    'quantity': 1,
+                },
+            ],
+            mode='payment',
+            success_url=payload['success_url'],
+            cancel_url=payload['cancel_url'],
+            metadata={
+                'payment_id': payment.id,
+                'user_id': payload['user_id']
+            },
+            # A retry after a lost response returns the session already created
+            idempotency_key=f"checkout-job-{job.id}"
+        )
+    except (stripe.InvalidRequestError, stripe.AuthenticationError, stripe.PermissionError) as e:
+        raise PermanentJobError(e.user_message or "Stripe rejected the checkout request")
+
+    payment.stripe_session_id = checkout_session.id
+    return {'session_id': checkout_session.id, 'checkout_url': checkout_session.url}
+
+
+@job_handler(THAWANI_CHECKOUT)
+def create_thawani_session(payload, job):
+    payment = _payment(payload)
+    try:
+        checkout_data = thawani.create_checkout_session(payload['request'])
+    except GatewayUnavailable as e:
+        raise RetryJobLater(str(e), thawani.breaker.reset_timeout)
+    except GatewayError as e:
+        if e.status is not None and 400 <= e.status < 500 and e.status != 429:
+            # A rejection carries the gateway's own description
+            raise PermanentJobError(str(e))
+        raise
+
+    if not checkout_data.get('session_id'):
+        raise GatewayError("Thawani checkout session creation returned no session id")
+    payment.stripe_session_id = checkout_data['session_id']  # Reusing stripe_session_id for Thawani session_id
+    return {'session_id': checkout_data['session_id'], 'checkout_url': checkout_data.get('checkout_url')}
@@ -0,0 +1,115 @@
+"""Comment tree loading for blog posts.
+
+load_comment_tree() fetches a page of top-level threads and all of their
+replies, down to a depth limit, in one recursive-CTE query with authors
+joined in, then links the rows into a tree in a single pass. Rendering no
+longer walks Comment.replies, which lazy-loaded one query per comment.
+"""
+from sqlalchemy import and_, case, func, literal, select
+from sqlalchemy.orm import aliased, joinedload
+
+from app import db
+from models import Comment
+
+DEFAULT_MAX_DEPTH = 5
+
+
+class CommentNode:
+    """A comment with its loaded replies"""
+
+    __slots__ = ('comment', 'depth', 'replies', 'hidden_replies')
+
+    def __init__(self, comment, depth, hidden_replies=0):
+        self.comment = comment
+        self.depth = depth
+        self.replies = []
+        # Direct replies not loaded because of the depth limit
+        self.hidden_replies = hidden_replies or 0
+
+
+class CommentTree:
+    """One page of top-level threads, with the pagination attributes templates use"""
+
+    def __init__(self, threads, total, thread_count, page, per_page):
+        self.threads = threads
+        self.total = total
+        self.thread_count = thread_count
+        self.page = page
+        self.per_page = per_page
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def has_next(self):
+        return self.page * self.per_page < self.thread_count
+
+    @property
+    def prev_num(self):
+        return self.page - 1
+
+    @property
+    def next_num(self):
+        return self.page + 1
+
+
+def load_comment_tree(post_id, page=1, per_page=20, max_depth=DEFAULT_MAX_DEPTH, root_id=None, session=None):
+    """Load a post's comments as a tree.
+
+    Top-level threads are newest first and paged by `per_page`; replies are
+    oldest first. Replies deeper than `max_depth` levels below a thread are
+    not loaded; their parent's `hidden_replies` says how many were cut off.
+    With `root_id` only that comment's subtree is loaded, as a single thread.
+    """
+    session = session or db.session
+    page = max(page, 1)
+    comment = Comment.__table__
+
+    total, top_level = session.execute(select(
+        func.count(comment.c.id),
+        func.count(case((comment.c.parent_id.is_(None), 1)))
+    ).where(comment.c.post_id == post_id)).one()
+
+    if root_id is not None:
+        roots = select(comment.c.id).where(comment.c.post_id == post_id, comment.c.id == root_id)
+        thread_count = 1
+    else:
+        roots = (select(comment.c.id)
+                 .where(comment.c.post_id == post_id, comment.c.parent_id.is_(None))
+                 .order_by(comment.c.created_at.desc(), comment.c.id.desc())
+                 .limit(per_page).offset((page - 1) * per_page))
+        thread_count = top_level
+    roots = roots.cte('comment_roots')
+
+    tree = (select(comment.c.id, literal(0).label('depth'))
+            .where(comment.c.id.in_(select(roots.c.id)))
+            .cte('comment_tree', recursive=True))
+    # post_id keeps each step on the (post_id, parent_id, created_at) index
+    tree = tree.union_all(
+        select(comment.c.id, tree.c.depth + 1)
+        .join(tree, comment.c.parent_id == tree.c.id)
+        .where(comment.c.post_id == post_id, tree.c.depth < max_depth)
+    )
+
+    child = aliased(Comment)
+    hidden = case((tree.c.depth == max_depth, select(func.count(child.id)).where(
+        and_(child.post_id == post_id, child.parent_id == tree.c.id)).scalar_subquery()))
+    rows = session.execute(
+        select(Comment, tree.c.depth, hidden)
+        .join(tree, Comment.id == tree.c.id)
+        .options(joinedload(Comment.author))
+        .order_by(Comment.created_at, Comment.id)
+    ).unique().all()
+
+    nodes = {}
+    for comment_row, depth, hidden_replies in rows:
+        nodes[comment_row.id] = CommentNode(comment_row, depth, hidden_replies)
+    threads = []
+    for node in nodes.values():
+        if node.depth == 0:
+            threads.append(node)
+        else:
+            nodes[node.comment.parent_id].replies.append(node)
+    threads.reverse()
+    return CommentTree(threads, total, thread_count, page, per_page)
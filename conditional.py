@@ -0,0 +1,99 @@
+"""Conditional GET for views whose content is tracked by updated_at.
+
+A view decorated with @conditional(validators) first calls `validators` with
+the view arguments. That function runs one cheap aggregate query and returns
+`(last_modified, extra)`: the newest updated_at behind the page and any
+other state it renders that the timestamp does not cover (row counts
+catch deletions, related rows have their own). The ETag hashes those
+values together with the URL, the viewer and the viewer's user-cache
+version, so a matching If-None-Match answers 304 before any rows are
+loaded or templates rendered. Last-Modified (and If-Modified-Since) is
+only used when `extra` is None, since the date alone cannot tell when
+that other state changed.
+
+Returning None from `validators` skips the check, e.g. for a missing row the
+view will 404 on.
+"""
+import hashlib
+import os
+from datetime import timezone
+from functools import wraps
+
+from flask import make_response, request, session
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+from app import app
+from user_cache import user_cache
+
+
+def _release_salt():
+    """Changes whenever a deploy may change how pages render"""
+    release = os.environ.get('RELEASE_ID')
+    if release:
+        return release
+    latest = 0.0
+    for folder in (app.template_folder, os.path.join(app.static_folder, 'dist')):
+        folder = os.path.join(app.root_path, folder)
+        for root, _, files in os.walk(folder):
+            for name in files:
+                latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+    return repr(latest)
+
+
+RELEASE_SALT = _release_salt()
+
+
+def conditional(validators, on_not_modified=None):
+    """Answer repeat GETs with 304 when the page's validators still match.
+
+    `on_not_modified` is called with the view arguments before a 304 goes
+    out, for side effects that must happen on every visit.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pending flash messages have to be rendered into a fresh body
+            if request.method != 'GET' or '_flashes' in session:
+                return view(*args, **kwargs)
+
+            values = validators(*args, **kwargs)
+            if values is None:
+                return view(*args, **kwargs)
+            last_modified, extra = values
+            if last_modified is not None:
+                last_modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+
+            if current_user.is_authenticated:
+                viewer = f"{current_user.id}:{user_cache.versions.get(current_user.id)}"
+            else:
+                viewer = 'anon'
+            etag = hashlib.sha1('|'.join((
+                RELEASE_SALT, request.full_path, viewer,
+                last_modified.isoformat() if last_modified else '', str(extra)
+            )).encode()).hexdigest()
+            # A date alone does not cover `extra` or identify the viewer, so
+            # those pages are validated by ETag only
+            if extra is not None or current_user.is_authenticated:
+                last_modified = None
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                if on_not_modified is not None:
+                    on_not_modified(*args, **kwargs)
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                # Assigning None would stamp the current time
+                if last_modified is not None:
+                    response.last_modified = last_modified
+
+            response.set_etag(etag, weak=True)
+            # Always revalidate; signed-in pages must not sit in shared caches
+            response.cache_control.no_cache = True
+            if current_user.is_authenticated:
+                response.cache_control.private = True
+            return response
+        return wrapper
+    return decorator
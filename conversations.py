@@ -0,0 +1,152 @@
+"""Conversation summaries for the message inbox.
+
+Every message belongs to a Conversation: the thread started by a message
+with no parent, grown through Message.parent_id. record_message() keeps the
+summary current as messages are sent (last message, last activity, message
+count) along with one ConversationParticipant row per user holding their
+unread count, so the inbox reads one page of participant rows instead of
+every message the user ever sent or received. load_thread() fetches one
+conversation with a single recursive query down the reply chain.
+"""
+from sqlalchemy import case, insert, literal, select, update
+from sqlalchemy.orm import joinedload
+
+from app import db
+from models import Conversation, ConversationParticipant, Message
+from utils import keyset_paginate
+
+PREVIEW_LENGTH = 120
+
+
+def record_message(message):
+    """Add a new message to its conversation in the current transaction.
+
+    Replies join their parent's conversation; anything else starts a new
+    one. The message is flushed so it has an id.
+    """
+    db.session.add(message)
+    db.session.flush()
+    parent = db.session.get(Message, message.parent_id) if message.parent_id else None
+    if parent is not None and parent.conversation_id is not None:
+        message.conversation_id = parent.conversation_id
+    else:
+        conversation = Conversation(subject=message.subject, root_message_id=message.id,
+                                    last_activity_at=message.sent_at, message_count=0)
+        db.session.add(conversation)
+        db.session.flush()
+        message.conversation_id = conversation.id
+
+    table = Conversation.__table__
+    db.session.execute(
+        update(table).where(table.c.id == message.conversation_id)
+        .values(message_count=table.c.message_count + 1)
+    )
+    # Concurrent sends may commit out of order; only a newer message moves "last"
+    db.session.execute(
+        update(table)
+        .where(table.c.id == message.conversation_id,
+               (table.c.last_message_id.is_(None)) | (table.c.last_activity_at <= message.sent_at))
+        .values(last_message_id=message.id, last_sender_id=message.sender_id,
+                last_preview=message.content[:PREVIEW_LENGTH], last_activity_at=message.sent_at)
+    )
+    _touch_participant(message.conversation_id, message.sender_id, message.recipient_id, message.sent_at, 0)
+    if message.recipient_id != message.sender_id:
+        _touch_participant(message.conversation_id, message.recipient_id, message.sender_id,
+                           message.sent_at, 1)
+    return message.conversation_id
+
+
+def _touch_participant(conversation_id, user_id, other_user_id, activity_at, unread_delta):
+    table = ConversationParticipant.__table__
+    latest = case((table.c.last_activity_at < activity_at, activity_at), else_=table.c.last_activity_at)
+    values = {'last_activity_at': latest, 'unread_count': table.c.unread_count + unread_delta}
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        # Imported here: the PostgreSQL dialect package is slow to load
+        from sqlalchemy.dialects import postgresql, sqlite
+        dialect_insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = dialect_insert(table).values(
+            conversation_id=conversation_id, user_id=user_id, other_user_id=other_user_id,
+            unread_count=unread_delta, last_activity_at=activity_at
+        ).on_conflict_do_update(index_elements=[table.c.conversation_id, table.c.user_id], set_=values)
+        db.session.execute(statement)
+        return
+
+    result = db.session.execute(
+        update(table).where(table.c.conversation_id == conversation_id, table.c.user_id == user_id)
+        .values(**values)
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(table).values(
+            conversation_id=conversation_id, user_id=user_id, other_user_id=other_user_id,
+            unread_count=unread_delta, last_activity_at=activity_at
+        ))
+
+
+def adjust_conversation_unread(conversation_id, user_id, delta):
+    """Add `delta` to a participant's unread count, never going below zero"""
+    if conversation_id is None:
+        return
+    table = ConversationParticipant.__table__
+    new_value = table.c.unread_count + delta
+    db.session.execute(
+        update(table).where(table.c.conversation_id == conversation_id, table.c.user_id == user_id)
+        .values(unread_count=case((new_value < 0, 0), else_=new_value))
+    )
+
+
+def mark_conversation_read(conversation_id, user_id):
+    """Flag every message the user received in a conversation as read;
+    returns how many were unread until now"""
+    message = Message.__table__
+    result = db.session.execute(
+        update(message)
+        .where(message.c.conversation_id == conversation_id, message.c.recipient_id == user_id,
+               message.c.is_read.isnot(True))
+        .values(is_read=True)
+    )
+    table = ConversationParticipant.__table__
+    db.session.execute(
+        update(table).where(table.c.conversation_id == conversation_id, table.c.user_id == user_id)
+        .values(unread_count=0)
+    )
+    return result.rowcount
+
+
+def list_conversations(user_id, cursor=None, per_page=20):
+    """One keyset page of a user's conversations, most recently active first"""
+    query = ConversationParticipant.query.filter_by(user_id=user_id).options(
+        joinedload(ConversationParticipant.conversation).joinedload(Conversation.last_sender),
+        joinedload(ConversationParticipant.other_user)
+    )
+    return keyset_paginate(query, ConversationParticipant.last_activity_at,
+                           ConversationParticipant.conversation_id, cursor=cursor, per_page=per_page)
+
+
+def get_participant(conversation_id, user_id):
+    """The user's participant row, or None if the conversation is not theirs"""
+    return db.session.get(ConversationParticipant, (conversation_id, user_id))
+
+
+def load_thread(conversation):
+    """Return [(message, depth)] for a conversation in the order sent.
+
+    The thread is walked from its root message down Message.parent_id in
+    one recursive query, with senders and recipients joined in.
+    """
+    message = Message.__table__
+    tree = (select(message.c.id, literal(0).label('depth'))
+            .where(message.c.id == conversation.root_message_id)
+            .cte('message_thread', recursive=True))
+    tree = tree.union_all(
+        select(message.c.id, tree.c.depth + 1)
+        .join(tree, message.c.parent_id == tree.c.id)
+        .where(message.c.conversation_id == conversation.id)
+    )
+    rows = db.session.execute(
+        select(Message, tree.c.depth)
+        .join(tree, Message.id == tree.c.id)
+        .options(joinedload(Message.sender), joinedload(Message.recipient))
+        .order_by(Message.sent_at, Message.id)
+    ).unique().all()
+    return [(row[0], row[1]) for row in rows]
@@ -0,0 +1,246 @@
+"""Write-behind buffer for BlogPost view and like counters.
+
+Increments are merged in memory and written in batches with atomic
+``UPDATE blog_post SET views = views + :delta`` statements, once
+COUNTER_MAX_PENDING increments are waiting or COUNTER_FLUSH_INTERVAL has
+passed (a background thread per worker flushes quiet buffers). When
+COUNTER_SPOOL_PATH is set, workers merge their deltas into a shared,
+flock-guarded spool file (mode 0600, in a private directory) and only one
+of them writes to the database.
+The spool is emptied before its deltas are written, so a crash can lose a
+batch but never apply one twice.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+from sqlalchemy import bindparam, func
+
+from app import app, db, private_directory
+from models import BlogPost
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ('views', 'likes')
+
+# How long pending() may reuse a spool snapshot before re-reading the file
+SPOOL_READ_TTL = 1.0
+
+# Every buffer of this process, flushed by one exit handler
+_buffers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_buffers():
+    for buffer in list(_buffers):
+        buffer.flush(force=True)
+
+
+def _spool_opener(path, flags):
+    # Never follow a symlink planted in place of the spool
+    return os.open(path, flags | os.O_NOFOLLOW, 0o600)
+
+
+def _creating_spool_opener(path, flags):
+    return _spool_opener(path, flags | os.O_CREAT)
+
+
+class CounterBuffer:
+    """Merge counter increments in memory and flush them in batches"""
+
+    def __init__(self, app=None):
+        self.flush_interval = 10.0
+        self.max_pending = 500
+        self.spool_path = None
+        self._app = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_total = 0
+        self._last_flush = time.monotonic()
+        self._spool_snapshot = {}
+        self._spool_read_at = 0.0
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._spool_checked = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.flush_interval = app.config.get('COUNTER_FLUSH_INTERVAL', self.flush_interval)
+        self.max_pending = app.config.get('COUNTER_MAX_PENDING', self.max_pending)
+        self.spool_path = app.config.get('COUNTER_SPOOL_PATH')
+        _buffers.add(self)
+
+    def increment(self, post_id, field, amount=1):
+        """Buffer `amount` more views/likes for a post, flushing if due"""
+        if field not in COUNTER_FIELDS:
+            raise ValueError(f"Unknown counter field: {field}")
+
+        key = (field, int(post_id))
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + amount
+            self._pending_total += amount
+            due = (self._pending_total >= self.max_pending or
+                   time.monotonic() - self._last_flush >= self.flush_interval)
+        self._ensure_thread()
+        if due:
+            self.flush()
+
+    def pending(self, post_id, field):
+        """Return increments for a post that are not yet in the database"""
+        key = (field, int(post_id))
+        with self._lock:
+            local = self._pending.get(key, 0)
+        if not self.spool_path:
+            return local
+        return local + self._read_spool_snapshot().get(key, 0)
+
+    def flush(self, force=False):
+        """Write buffered increments out (to the spool or the database)"""
+        with self._lock:
+            deltas = self._pending
+            self._pending = {}
+            self._pending_total = 0
+            self._last_flush = time.monotonic()
+
+        if self.spool_path:
+            self._flush_through_spool(deltas, force)
+        elif deltas:
+            try:
+                self._write(deltas)
+            except Exception:
+                logger.exception("Failed to flush blog counters; keeping them buffered")
+                self._restore(deltas)
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so gunicorn workers start their own
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='counter-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        # Writes out buffers (and the spool) that no further increment flushes
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Timed blog counter flush failed")
+
+    def _check_spool_directory(self):
+        # Whoever can write the spool decides what gets added to the counters
+        if not self._spool_checked:
+            private_directory(os.path.dirname(os.path.abspath(self.spool_path)))
+            self._spool_checked = True
+
+    def _flush_through_spool(self, deltas, force):
+        self._check_spool_directory()
+        with open(self.spool_path, 'r+', opener=_creating_spool_opener) as spool:
+            fcntl.flock(spool, fcntl.LOCK_EX)
+            try:
+                state = self._load_spool(spool)
+                merged = state['deltas']
+                for key, amount in deltas.items():
+                    merged[key] = merged.get(key, 0) + amount
+
+                due = (force or
+                       sum(merged.values()) >= self.max_pending or
+                       time.time() - state['flushed_at'] >= self.flush_interval)
+                if due and merged:
+                    # Empty the spool first: a crash during the write then
+                    # loses this batch instead of applying it again later
+                    self._save_spool(spool, {}, state['flushed_at'], sync=True)
+                    try:
+                        self._write(merged)
+                        merged = {}
+                        state['flushed_at'] = time.time()
+                    except Exception:
+                        logger.exception("Failed to flush blog counters; keeping them spooled")
+
+                self._save_spool(spool, merged, state['flushed_at'])
+                self._spool_snapshot = merged
+                self._spool_read_at = time.monotonic()
+            finally:
+                fcntl.flock(spool, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _save_spool(spool, deltas, flushed_at, sync=False):
+        spool.seek(0)
+        spool.truncate()
+        json.dump({
+            'flushed_at': flushed_at,
+            'deltas': [[field, post_id, amount] for (field, post_id), amount in deltas.items()]
+        }, spool)
+        spool.flush()
+        if sync:
+            os.fsync(spool.fileno())
+
+    def _read_spool_snapshot(self):
+        if time.monotonic() - self._spool_read_at < SPOOL_READ_TTL:
+            return self._spool_snapshot
+        self._check_spool_directory()
+        try:
+            with open(self.spool_path, 'r', opener=_spool_opener) as spool:
+                fcntl.flock(spool, fcntl.LOCK_SH)
+                try:
+                    self._spool_snapshot = self._load_spool(spool)['deltas']
+                finally:
+                    fcntl.flock(spool, fcntl.LOCK_UN)
+        except FileNotFoundError:
+            self._spool_snapshot = {}
+        self._spool_read_at = time.monotonic()
+        return self._spool_snapshot
+
+    @staticmethod
+    def _load_spool(spool):
+        spool.seek(0)
+        raw = spool.read()
+        if not raw:
+            return {'flushed_at': time.time(), 'deltas': {}}
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            logger.error("Discarding unreadable counter spool %s", spool.name)
+            return {'flushed_at': time.time(), 'deltas': {}}
+        return {
+            'flushed_at': data.get('flushed_at', 0),
+            'deltas': {(field, post_id): amount for field, post_id, amount in data.get('deltas', [])}
+        }
+
+    def _restore(self, deltas):
+        with self._lock:
+            for key, amount in deltas.items():
+                self._pending[key] = self._pending.get(key, 0) + amount
+                self._pending_total += amount
+
+    def _write(self, deltas):
+        """Apply deltas with one executemany UPDATE per counter column"""
+        table = BlogPost.__table__
+        by_field = {}
+        for (field, post_id), amount in deltas.items():
+            if amount:
+                by_field.setdefault(field, []).append({'post_id': post_id, 'delta': amount})
+
+        with self._app.app_context():
+            with db.engine.begin() as connection:
+                for field, rows in by_field.items():
+                    column = table.c[field]
+                    statement = table.update() \
+                        .where(table.c.id == bindparam('post_id')) \
+                        .values({field: func.coalesce(column, 0) + bindparam('delta')})
+                    connection.execute(statement, rows)
+
+
+counter_buffer = CounterBuffer(app)
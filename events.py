@@ -0,0 +1,244 @@
+"""In-process pub/sub broker for pushing events to connected browsers.
+
+Views publish per-user events (new message, message read, project status
+change) and /api/stream relays them as Server-Sent Events. Each worker
+keeps its own subscriber registry; the backend decides how events reach the
+other workers:
+
+* ``local`` delivers only to subscribers in the publishing process.
+* ``file`` appends events to a spool file shared by every worker on the
+  host (in a private instance directory), and one tail thread per worker
+  fans them out locally.
+"""
+import fcntl
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from app import app, private_directory
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """A subscriber's queue of pending events"""
+
+    def __init__(self, user_id, max_pending):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A stalled client just loses events; it resyncs on reconnect
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LocalBackend:
+    """Deliver events only within the current process"""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, event):
+        self.broker.dispatch(event)
+
+
+class FileBackend:
+    """Fan events out to every worker on the host through a shared spool file.
+
+    A full spool is renamed to `<path>.<generation>` and a new one started;
+    the generation of the live spool is kept in `<path>.lock`, whose flock
+    serialises appends and rotation. A tail thread that falls behind reads
+    the rotated spools in order, as long as the last `segments` are kept.
+    """
+
+    def __init__(self, broker, path, max_size=4 * 1024 * 1024, poll_interval=0.25, segments=4):
+        self.broker = broker
+        self.path = path
+        self.max_size = max_size
+        self.poll_interval = poll_interval
+        self.segments = segments
+        self._directory_pid = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        line = (json.dumps(event, separators=(',', ':')) + '\n').encode()
+        lock = self._open_lock()
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                size = os.stat(self.path).st_size
+            except FileNotFoundError:
+                size = 0
+            if size and size + len(line) > self.max_size:
+                self._rotate(lock)
+            spool = os.open(self.path, os.O_APPEND | os.O_CREAT | os.O_WRONLY, 0o600)
+            try:
+                os.write(spool, line)
+            finally:
+                os.close(spool)
+        finally:
+            os.close(lock)  # releases the flock
+
+    def _rotate(self, lock):
+        generation = self._generation(lock)
+        os.replace(self.path, f"{self.path}.{generation}")
+        # Generations only grow, so the new number never leaves digits behind
+        os.pwrite(lock, str(generation + 1).encode(), 0)
+        try:
+            os.unlink(f"{self.path}.{generation - self.segments}")
+        except FileNotFoundError:
+            pass
+
+    def _open_lock(self):
+        # Every spool access starts here; the directory is made on first use
+        if self._directory_pid != os.getpid():
+            private_directory(os.path.dirname(os.path.abspath(self.path)))
+            self._directory_pid = os.getpid()
+        return os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+
+    @staticmethod
+    def _generation(lock):
+        return int(os.pread(lock, 20, 0) or 0)
+
+    def start(self):
+        """Start this process's tail thread if it is not running yet"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._tail, name='event-spool-tail', daemon=True)
+            self._thread.start()
+
+    def _open(self, generation=None):
+        """Open spool `generation` (the live one by default); returns (file, generation)"""
+        lock = self._open_lock()
+        try:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            live = self._generation(lock)
+            if generation is not None and generation < live:
+                try:
+                    return open(f"{self.path}.{generation}", 'rb'), generation
+                except FileNotFoundError:
+                    logger.warning("Event spool tail fell behind; skipped to the live spool")
+            spool = os.fdopen(os.open(self.path, os.O_RDONLY | os.O_CREAT, 0o600), 'rb')
+            return spool, live
+        finally:
+            os.close(lock)
+
+    def _tail(self):
+        spool, generation = self._open()
+        spool.seek(0, os.SEEK_END)
+        buffer = b''
+        while True:
+            chunk = spool.read()
+            if chunk:
+                buffer = self._dispatch(buffer + chunk)
+                continue
+
+            try:
+                rotated = os.stat(self.path).st_ino != os.fstat(spool.fileno()).st_ino
+            except FileNotFoundError:
+                rotated = False
+            if rotated:
+                # Nothing is appended to a spool once it is rotated, so
+                # finish it and carry on with the next generation
+                self._dispatch(buffer + spool.read())
+                spool.close()
+                spool, generation = self._open(generation + 1)
+                buffer = b''
+                continue
+            time.sleep(self.poll_interval)
+
+    def _dispatch(self, data):
+        """Dispatch each complete line of `data`; returns the incomplete rest"""
+        *lines, rest = data.split(b'\n')
+        for line in lines:
+            try:
+                self.broker.dispatch(json.loads(line))
+            except ValueError:
+                logger.warning("Skipping malformed event spool line")
+        return rest
+
+
+class EventBroker:
+    """Route published events to the subscribers of each user"""
+
+    def __init__(self, app=None):
+        self.max_pending = 100
+        self.max_subscribers = 50
+        self.backend = LocalBackend(self)
+        self._subscribers = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_pending = app.config.get('SSE_MAX_PENDING', self.max_pending)
+        self.max_subscribers = app.config.get('SSE_MAX_CONNECTIONS', self.max_subscribers)
+        if app.config.get('EVENT_BACKEND', 'file') == 'file':
+            path = app.config.get('EVENT_SPOOL_PATH') or os.path.join(app.instance_path, 'events', 'events.log')
+            self.backend = FileBackend(self, path)
+        else:
+            self.backend = LocalBackend(self)
+
+    def publish(self, user_id, event_type, data=None):
+        """Send an event to every open stream of `user_id`"""
+        if user_id is None:
+            return
+        try:
+            self.backend.publish({'user_id': int(user_id), 'type': event_type, 'data': data or {}})
+        except OSError:
+            logger.exception("Failed to publish %s event", event_type)
+
+    def subscribe(self, user_id):
+        """Register a stream; returns None when this worker is at capacity"""
+        if hasattr(self.backend, 'start'):
+            self.backend.start()
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscription = Subscription(int(user_id), self.max_pending)
+            self._subscribers.setdefault(subscription.user_id, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions and subscription in subscriptions:
+                subscriptions.discard(subscription)
+                self._count -= 1
+                if not subscriptions:
+                    del self._subscribers[subscription.user_id]
+
+    def dispatch(self, event):
+        """Hand an event to local subscribers (called by the backend)"""
+        with self._lock:
+            subscriptions = list(self._subscribers.get(event.get('user_id'), ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    @property
+    def subscriber_count(self):
+        return self._count
+
+
+broker = EventBroker(app)
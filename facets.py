@@ -0,0 +1,126 @@
+"""Blog tag and category facets.
+
+BlogPost.tags stays the editable comma-separated string; a before_flush hook
+mirrors it into the Tag / blog_post_tags tables so tag filters use indexed
+joins. The same hook keeps Tag.post_count and BlogCategory.post_count (the
+number of published posts per facet) up to date incrementally, comparing
+each written post's old and new (is_published, category, tags), so the
+blog sidebar reads two small tables instead of scanning blog_post.
+"""
+from collections import Counter
+
+from sqlalchemy import delete, event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from app import db
+from models import BlogCategory, BlogPost, Tag, blog_post_tags
+
+
+def get_blog_facets(tag_limit=30):
+    """Return (categories, tags) as lists of (name, published post count)"""
+    categories = db.session.execute(
+        select(BlogCategory.name, BlogCategory.post_count)
+        .where(BlogCategory.post_count > 0).order_by(BlogCategory.name)
+    ).all()
+    tags = db.session.execute(
+        select(Tag.name, Tag.post_count)
+        .where(Tag.post_count > 0).order_by(Tag.post_count.desc(), Tag.name).limit(tag_limit)
+    ).all()
+    return [tuple(row) for row in categories], [tuple(row) for row in tags]
+
+
+def rebuild_blog_facets():
+    """Re-sync every post's tag links and recount all facets; returns posts seen"""
+    posts = 0
+    for post in BlogPost.query.order_by(BlogPost.id).yield_per(500):
+        post.tag_list = _get_or_create_tags(db.session, Tag.split(post.tags))
+        posts += 1
+    db.session.flush()
+
+    published_links = select(func.count()).select_from(
+        blog_post_tags.join(BlogPost, BlogPost.id == blog_post_tags.c.post_id)
+    ).where(blog_post_tags.c.tag_id == Tag.id, BlogPost.is_published.is_(True))
+    db.session.execute(update(Tag).values(post_count=published_links.scalar_subquery()))
+
+    db.session.execute(delete(BlogCategory))
+    counts = db.session.execute(
+        select(BlogPost.category, func.count(BlogPost.id))
+        .where(BlogPost.is_published.is_(True)).group_by(BlogPost.category)
+    ).all()
+    db.session.add_all(BlogCategory(name=name, post_count=count) for name, count in counts)
+    db.session.commit()
+    return posts
+
+
+def _get_or_create_tags(session, names):
+    if not names:
+        return []
+    with session.no_autoflush:
+        existing = {tag.name: tag for tag in session.scalars(select(Tag).where(Tag.name.in_(names)))}
+    # Tags created earlier in this flush are pending, not yet queryable
+    for obj in session.new:
+        if isinstance(obj, Tag) and obj.name in names:
+            existing.setdefault(obj.name, obj)
+    tags = []
+    for name in names:
+        if name not in existing:
+            existing[name] = Tag(name=name, post_count=0)
+            session.add(existing[name])
+        tags.append(existing[name])
+    return tags
+
+
+def _value(post, attribute, previous):
+    """Current value of `attribute`, or the value loaded from the database"""
+    if previous:
+        history = inspect(post).attrs[attribute].history
+        if history.deleted:
+            return history.deleted[0]
+    return getattr(post, attribute)
+
+
+def _facets(post, previous):
+    if not _value(post, 'is_published', previous):
+        return set()
+    return {('category', _value(post, 'category', previous))} | \
+        {('tag', name) for name in Tag.split(_value(post, 'tags', previous))}
+
+
+@event.listens_for(Session, 'before_flush')
+def _sync_blog_facets(session, flush_context, instances):
+    deltas = Counter()
+    for post in session.new:
+        if isinstance(post, BlogPost):
+            post.tag_list = _get_or_create_tags(session, Tag.split(post.tags))
+            deltas.update(dict.fromkeys(_facets(post, previous=False), 1))
+    for post in session.dirty:
+        if isinstance(post, BlogPost) and session.is_modified(post):
+            if inspect(post).attrs.tags.history.has_changes():
+                post.tag_list = _get_or_create_tags(session, Tag.split(post.tags))
+            deltas.update(dict.fromkeys(_facets(post, previous=False), 1))
+            deltas.subtract(dict.fromkeys(_facets(post, previous=True), 1))
+    for post in session.deleted:
+        if isinstance(post, BlogPost):
+            deltas.subtract(dict.fromkeys(_facets(post, previous=True), 1))
+
+    changed = {key: delta for key, delta in deltas.items() if delta}
+    if not changed:
+        return
+    tags = {tag.name: tag for tag in _get_or_create_tags(
+        session, [name for kind, name in changed if kind == 'tag'])}
+    for (kind, name), delta in changed.items():
+        if kind == 'tag':
+            facet = tags[name]
+            count_column = Tag.post_count
+        else:
+            with session.no_autoflush:
+                facet = session.get(BlogCategory, name)
+            if facet is None:
+                facet = BlogCategory(name=name, post_count=0)
+                session.add(facet)
+            count_column = BlogCategory.post_count
+        if inspect(facet).persistent:
+            # Relative SQL update, so concurrent writers do not lose counts
+            facet.post_count = count_column + delta
+        else:
+            facet.post_count = (facet.post_count or 0) + delta
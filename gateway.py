@@ -0,0 +1,238 @@
+"""HTTP client for the Thawani checkout API.
+
+payment.py used to call requests.post() per checkout: a new TCP and TLS
+connection every time, no timeout (a slow gateway held the worker until
+gunicorn killed it) and no retries. ThawaniClient instead keeps one pooled
+keep-alive session per worker process and sets connect/read timeouts on
+every call. It retries with jittered backoff: idempotent calls on any
+transient failure, others only when the request never reached the
+gateway. A per-worker circuit breaker fails fast while the gateway keeps
+failing. Every call's latency is recorded in the
+platform_gateway_request_seconds histogram (see metrics.py).
+
+`python thawani_stub.py` runs a local stand-in for the gateway, and
+`flask gateway-benchmark` measures the client against it.
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+from app import app
+from metrics import request_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayError(Exception):
+    """A gateway call failed; `status` is the HTTP status if one was received"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class GatewayUnavailable(GatewayError):
+    """The circuit breaker is open: the gateway was not called"""
+
+
+class CircuitBreaker:
+    """Open after `failure_threshold` consecutive failures; after
+    `reset_timeout` seconds let one trial call through (half-open) and
+    close again if it succeeds"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        """Return True if a call may go ahead"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Payment gateway circuit opened after %d failures", self._failures)
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class ThawaniClient:
+    """Pooled, retrying, circuit-broken client for the Thawani API"""
+
+    # Responses worth retrying: the gateway or a proxy in front of it is struggling
+    RETRY_STATUSES = frozenset((429, 502, 503, 504))
+
+    def __init__(self, app=None):
+        self.base_url = None
+        self.api_key = None
+        self.connect_timeout = 3.0
+        self.read_timeout = 10.0
+        self.max_retries = 2
+        self.backoff = 0.2
+        self.pool_size = 10
+        self.breaker = CircuitBreaker()
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.base_url = app.config['THAWANI_API_BASE_URL'].rstrip('/')
+        self.api_key = app.config.get('THAWANI_API_KEY')
+        self.connect_timeout = app.config.get('THAWANI_CONNECT_TIMEOUT', self.connect_timeout)
+        self.read_timeout = app.config.get('THAWANI_READ_TIMEOUT', self.read_timeout)
+        self.max_retries = app.config.get('THAWANI_MAX_RETRIES', self.max_retries)
+        self.backoff = app.config.get('THAWANI_RETRY_BACKOFF', self.backoff)
+        self.pool_size = app.config.get('THAWANI_POOL_SIZE', self.pool_size)
+        self.breaker = CircuitBreaker(app.config.get('THAWANI_BREAKER_THRESHOLD', 5),
+                                      app.config.get('THAWANI_BREAKER_RESET', 30.0))
+
+    def create_checkout_session(self, payload):
+        """Create a checkout session; returns the response's `data` object"""
+        return self.request('POST', '/checkout/session', 'create_session', json=payload)
+
+    def get_checkout_session(self, session_id):
+        """Fetch a checkout session by id; returns the response's `data` object"""
+        return self.request('GET', f'/checkout/session/{session_id}', 'get_session', idempotent=True)
+
+    def request(self, method, path, operation, json=None, idempotent=False):
+        """Call the gateway and return the `data` of a successful response.
+
+        Raises GatewayUnavailable without calling out while the circuit is
+        open, and GatewayError once retries are used up.
+        """
+        import requests  # on first use; see startup.LAZY_PACKAGES
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._observe(operation, 0.0, 'circuit_open')
+                raise GatewayUnavailable("Payment gateway temporarily unavailable")
+            started = time.perf_counter()
+            retryable = False
+            try:
+                response = self._get_session().request(
+                    method, f"{self.base_url}{path}", json=json,
+                    headers={'thawani-api-key': self.api_key or ''},
+                    timeout=(self.connect_timeout, self.read_timeout)
+                )
+            except requests.exceptions.ConnectTimeout as e:
+                # A request that never connected never reached the gateway,
+                # so even a non-idempotent call is safe to repeat
+                error = GatewayError(f"Could not reach the payment gateway: {e}")
+                retryable = True
+                outcome = 'connect_timeout'
+            except requests.exceptions.ConnectionError as e:
+                error = GatewayError(f"Could not reach the payment gateway: {e}")
+                retryable = idempotent or _never_sent(e)
+                outcome = 'connect_error'
+            except requests.exceptions.Timeout as e:
+                error = GatewayError(f"Payment gateway timed out: {e}")
+                retryable = idempotent
+                outcome = 'timeout'
+            except requests.exceptions.RequestException as e:
+                error = GatewayError(f"Payment gateway request failed: {e}")
+                outcome = 'error'
+            else:
+                elapsed = time.perf_counter() - started
+                if response.status_code < 400:
+                    self.breaker.record_success()
+                    self._observe(operation, elapsed, 'ok')
+                    try:
+                        body = response.json()
+                    except ValueError:
+                        raise GatewayError("Payment gateway returned invalid JSON", response.status_code)
+                    if not body.get('success'):
+                        raise GatewayError(body.get('description') or "Payment gateway rejected the request",
+                                           response.status_code)
+                    return body.get('data') or {}
+                if response.status_code < 500 and response.status_code != 429:
+                    # The request itself was rejected; the gateway is healthy
+                    self.breaker.record_success()
+                    self._observe(operation, elapsed, 'rejected')
+                    raise GatewayError(_description(response), response.status_code)
+                error = GatewayError(_description(response), response.status_code)
+                retryable = idempotent and response.status_code in self.RETRY_STATUSES
+                outcome = f"http_{response.status_code}"
+
+            self.breaker.record_failure()
+            self._observe(operation, time.perf_counter() - started, outcome)
+            if not retryable or attempt >= self.max_retries:
+                raise error
+            attempt += 1
+            # Full jitter keeps workers that failed together from retrying together
+            delay = random.uniform(0, self.backoff * 2 ** (attempt - 1))
+            logger.info("Retrying %s %s in %.2fs after %s (attempt %d)", method, path, delay, outcome, attempt)
+            time.sleep(delay)
+
+    def _get_session(self):
+        # One session per process: pooled sockets must not be shared over fork
+        if self._session is not None and self._pid == os.getpid():
+            return self._session
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['Content-Type'] = 'application/json'
+                self._session = session
+                self._pid = os.getpid()
+        return self._session
+
+    @staticmethod
+    def _observe(operation, seconds, outcome):
+        request_metrics.observe('platform_gateway_request_seconds', seconds,
+                                operation=operation, outcome=outcome)
+
+
+def _never_sent(error):
+    """True if a ConnectionError happened while connecting, before the request was written"""
+    text = str(error)
+    return any(marker in text for marker in (
+        'NewConnectionError', 'Failed to establish a new connection', 'Connection refused',
+        'Name or service not known', 'nodename nor servname'
+    ))
+
+
+def _description(response):
+    try:
+        return response.json().get('description') or f"Payment gateway returned HTTP {response.status_code}"
+    except ValueError:
+        return f"Payment gateway returned HTTP {response.status_code}"
+
+
+thawani = ThawaniClient(app)
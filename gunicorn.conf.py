@@ -1,13 +1,36 @@
 # Gunicorn configuration file
 import multiprocessing
+import os
 
 # Server socket
 bind = "0.0.0.0:5000"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# Threaded workers keep idle /api/stream (SSE) connections cheap; for
+# thousands of streams per worker use GUNICORN_WORKER_CLASS=gevent
+# (requires `pip install gevent`). Keep SSE_MAX_CONNECTIONS below `threads`
+# so streams never starve regular requests.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "64"))
+
+# Every worker has its own database pool (DB_POOL_SIZE + DB_MAX_OVERFLOW,
+# see app.py), sized independently of `threads`. All workers together must
+# stay within DB_MAX_CONNECTIONS (PostgreSQL's max_connections, less what
+# `flask` commands and the job worker need): the defaults (5 + 5) shrink to
+# fit, explicit settings that do not fit refuse to start.
+if not os.environ.get("DATABASE_URL", "sqlite").startswith("sqlite"):
+    max_connections = int(os.environ.get("DB_MAX_CONNECTIONS", "90"))
+    budget = max_connections // workers
+    os.environ.setdefault("DB_POOL_SIZE", str(max(1, min(5, budget))))
+    os.environ.setdefault("DB_MAX_OVERFLOW", str(max(0, min(5, budget - int(os.environ["DB_POOL_SIZE"])))))
+    per_worker = int(os.environ["DB_POOL_SIZE"]) + int(os.environ["DB_MAX_OVERFLOW"])
+    if workers * per_worker > max_connections:
+        raise RuntimeError(
+            f"{workers} workers x {per_worker} database connections exceeds DB_MAX_CONNECTIONS "
+            f"({max_connections}); lower GUNICORN_WORKERS, DB_POOL_SIZE or DB_MAX_OVERFLOW"
+        )
 worker_connections = 1000
 timeout = 30
 keepalive = 2
@@ -16,6 +39,10 @@ keepalive = 2
 max_requests = 1000
 max_requests_jitter = 50
 
+# GUNICORN_PRELOAD=1 imports the app (and compiles templates) once in the
+# master; workers inherit it on fork instead of each loading it again
+preload_app = os.environ.get("GUNICORN_PRELOAD", "").lower() in ("1", "true", "yes")
+
 # Logging
 accesslog = "-"
 errorlog = "-"
@@ -36,3 +63,33 @@ tmp_upload_dir = None
 keyfile = None
 certfile = None
 
+
+# Server hooks
+def when_ready(server):
+    # With preload_app the master owns the app: compile templates once there
+    # and drop DB connections so forked workers do not share sockets
+    if preload_app:
+        from app import app, db
+        from warmup import warm_templates
+        warm_templates()
+        with app.app_context():
+            db.engine.dispose()
+
+
+def post_worker_init(worker):
+    # Load templates before the first request instead of during it; this
+    # reads the shared bytecode cache (or is a no-op after preloading)
+    from warmup import warm_templates
+    timings = warm_templates()
+    worker.log.info("Warmed %d templates in %.1f ms", len(timings), sum(timings.values()) * 1000)
+
+
+def worker_exit(server, worker):
+    # Write out buffered blog view/like counters, activity log entries and
+    # request metrics before the worker goes away
+    from activity import activity_writer
+    from counters import counter_buffer
+    from metrics import request_metrics
+    counter_buffer.flush(force=True)
+    activity_writer.shutdown()
+    request_metrics.flush(force=True)
@@ -0,0 +1,307 @@
+"""Durable background jobs stored in the database.
+
+Views that would otherwise wait on a slow external service (payment
+gateways, see checkout.py) enqueue() a Job in the same transaction as the
+rows it belongs to and answer straight away; `flask jobs worker` runs the
+jobs in a separate process. The job row is the handle the client polls
+(/api/jobs/<id>), and finishing a job also publishes a `job_status` event
+to its owner's /api/stream.
+
+A worker claims a job with a conditional UPDATE, so two workers never run
+the same job, and holds it for JOBS_LEASE_SECONDS; a job whose worker died
+is picked up again once its lease runs out. Failed jobs are retried with
+exponential backoff until max_attempts, then marked DEAD and kept for
+admins to inspect and requeue. No broker is involved: the only shared
+state is the job table.
+"""
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, event, func, or_, select, update
+from sqlalchemy.exc import OperationalError
+
+from app import JOBS_SQLITE_SYNCHRONOUS_LEVELS, app, db
+from events import broker
+from metrics import request_metrics
+from models import Job, JobStatus
+
+logger = logging.getLogger(__name__)
+
+ERROR_LENGTH = 2000
+
+_handlers = {}
+
+
+class PermanentJobError(Exception):
+    """Retrying cannot help: the job goes straight to DEAD.
+
+    The message is shown to the job's owner, so keep it user-facing.
+    """
+
+
+class RetryJobLater(Exception):
+    """A transient failure with a known wait (e.g. a circuit breaker)"""
+
+    def __init__(self, message, delay):
+        super().__init__(message)
+        self.delay = delay
+
+
+def job_handler(kind):
+    """Register `func(payload, job)` to run jobs of `kind`.
+
+    The handler runs inside the worker's transaction: its database changes
+    are committed together with the job's result (the dict it returns), or
+    rolled back if it raises.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload, user_id=None, payment_id=None, max_attempts=None):
+    """Add a job to the current session; it becomes visible to workers on commit"""
+    job = Job(kind=kind, payload=json.dumps(payload), user_id=user_id, payment_id=payment_id,
+              max_attempts=max_attempts or app.config['JOBS_MAX_ATTEMPTS'],
+              status=JobStatus.QUEUED, run_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def job_state(job, include_error=False):
+    """JSON-ready view of a job for its owner (admins also get the error)"""
+    state = {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status.value,
+        'attempts': job.attempts,
+        'result': json.loads(job.result) if job.result else None,
+        'run_at': job.run_at.isoformat() if job.status == JobStatus.QUEUED else None,
+    }
+    if include_error:
+        state['last_error'] = job.last_error
+    return state
+
+
+def _claimable(now):
+    table = Job.__table__
+    return or_(
+        and_(table.c.status == JobStatus.QUEUED, table.c.run_at <= now),
+        # The worker holding it died or hung; its lease has run out
+        and_(table.c.status == JobStatus.RUNNING, table.c.locked_until < now),
+    )
+
+
+def claim_jobs(worker_id, limit=1):
+    """Lease up to `limit` due jobs to `worker_id` and return them"""
+    table = Job.__table__
+    now = datetime.utcnow()
+    lease_until = now + timedelta(seconds=app.config['JOBS_LEASE_SECONDS'])
+    candidates = db.session.execute(
+        select(table.c.id).where(_claimable(now)).order_by(table.c.run_at, table.c.id).limit(limit * 2)
+    ).scalars().all()
+    claimed = []
+    for job_id in candidates:
+        # Re-checking the condition in the UPDATE makes the claim atomic:
+        # a worker that lost the race updates no row
+        result = db.session.execute(
+            update(table).where(table.c.id == job_id, _claimable(now))
+            .values(status=JobStatus.RUNNING, locked_by=worker_id, locked_until=lease_until,
+                    attempts=table.c.attempts + 1, updated_at=now)
+        )
+        if result.rowcount:
+            claimed.append(job_id)
+            if len(claimed) >= limit:
+                break
+    db.session.commit()
+    return [db.session.get(Job, job_id) for job_id in claimed]
+
+
+def run_job(job, worker_id):
+    """Run one claimed job and record its outcome"""
+    job_id, kind = job.id, job.kind
+    wait = (datetime.utcnow() - job.run_at).total_seconds()
+    request_metrics.observe('platform_job_wait_seconds', max(wait, 0.0), kind=kind)
+    started = time.perf_counter()
+    try:
+        handler = _handlers.get(kind)
+        if handler is None:
+            raise PermanentJobError(f"No handler for job kind {kind!r}")
+        if job.attempts > job.max_attempts:
+            raise PermanentJobError("Job was abandoned by its worker too many times")
+        result = handler(json.loads(job.payload), job)
+    except Exception as e:
+        db.session.rollback()
+        outcome = _record_failure(job_id, worker_id, e)
+    else:
+        outcome = _record_success(job, worker_id, result)
+    request_metrics.observe('platform_job_seconds', time.perf_counter() - started, kind=kind, outcome=outcome)
+    return outcome
+
+
+def _finish(job_id, worker_id, **values):
+    """Update a job this worker still holds; False if the lease was lost"""
+    table = Job.__table__
+    result = db.session.execute(
+        update(table)
+        .where(table.c.id == job_id, table.c.status == JobStatus.RUNNING, table.c.locked_by == worker_id)
+        .values(locked_by=None, locked_until=None, updated_at=datetime.utcnow(), **values)
+    )
+    return result.rowcount == 1
+
+
+def _record_success(job, worker_id, result):
+    now = datetime.utcnow()
+    job_id, user_id = job.id, job.user_id
+    if not _finish(job_id, worker_id, status=JobStatus.SUCCEEDED, finished_at=now,
+                   result=json.dumps(result) if result is not None else None, last_error=None):
+        # Another worker took the job over; its run will be the one recorded
+        db.session.rollback()
+        logger.warning("Job %s finished after its lease expired; discarding the result", job_id)
+        return 'lease_lost'
+    db.session.commit()
+    _notify(user_id, job_id)
+    return 'succeeded'
+
+
+def _record_failure(job_id, worker_id, error):
+    job = db.session.get(Job, job_id)
+    message = f"{type(error).__name__}: {error}"[:ERROR_LENGTH]
+    now = datetime.utcnow()
+    if isinstance(error, PermanentJobError) or job.attempts >= job.max_attempts:
+        public = str(error) if isinstance(error, PermanentJobError) else \
+            f"Gave up after {job.attempts} attempts"
+        finished = _finish(job_id, worker_id, status=JobStatus.DEAD, finished_at=now, last_error=message,
+                           result=json.dumps({'error': public}))
+        outcome = 'dead'
+        logger.error("Job %s (%s) is dead: %s", job_id, job.kind, message)
+    else:
+        delay = retry_delay(job.attempts)
+        if isinstance(error, RetryJobLater):
+            delay = max(delay, error.delay)
+        finished = _finish(job_id, worker_id, status=JobStatus.QUEUED, last_error=message,
+                           run_at=now + timedelta(seconds=delay))
+        outcome = 'retry'
+        logger.warning("Job %s (%s) failed, retrying in %.0fs: %s", job_id, job.kind, delay, message)
+    if not finished:
+        db.session.rollback()
+        return 'lease_lost'
+    db.session.commit()
+    if outcome == 'dead':
+        _notify(job.user_id, job_id)
+    return outcome
+
+
+def retry_delay(attempts):
+    """Seconds to wait before attempt `attempts + 1`: exponential, jittered, capped"""
+    delay = min(app.config['JOBS_RETRY_BACKOFF'] * 2 ** (attempts - 1), app.config['JOBS_RETRY_MAX'])
+    return random.uniform(delay / 2, delay)
+
+
+def _notify(user_id, job_id):
+    job = db.session.get(Job, job_id)
+    broker.publish(user_id, 'job_status', job_state(job))
+
+
+def requeue_job(job):
+    """Give a DEAD job a fresh set of attempts (admin action)"""
+    job.status = JobStatus.QUEUED
+    job.attempts = 0
+    job.run_at = datetime.utcnow()
+    job.finished_at = None
+    job.result = None
+
+
+def queue_summary():
+    """Job counts by status plus the age in seconds of the oldest due job"""
+    counts = {status.value: 0 for status in JobStatus}
+    for status, count in db.session.execute(
+        select(Job.status, func.count(Job.id)).group_by(Job.status)
+    ):
+        counts[status.value] = count
+    oldest = db.session.execute(
+        select(func.min(Job.run_at)).where(Job.status == JobStatus.QUEUED, Job.run_at <= datetime.utcnow())
+    ).scalar()
+    counts['oldest_due_seconds'] = (datetime.utcnow() - oldest).total_seconds() if oldest else 0
+    return counts
+
+
+def prune_jobs(older_than_days):
+    """Delete SUCCEEDED jobs finished more than `older_than_days` ago"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    result = db.session.execute(
+        Job.__table__.delete().where(Job.status == JobStatus.SUCCEEDED, Job.finished_at < cutoff)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def configure_worker_connections():
+    """Apply the JOBS_SQLITE_* journal settings to this process's connections.
+
+    Only `flask jobs worker` calls this, so the relaxed synchronous level
+    covers the queue's commits and never the web app's. journal_mode=WAL
+    is stored in the database file, so other processes read and write in
+    WAL mode too, at their own (default, full) synchronous level.
+    """
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name != 'sqlite' or not app.config['JOBS_SQLITE_WAL']:
+            return
+        level = JOBS_SQLITE_SYNCHRONOUS_LEVELS[app.config['JOBS_SQLITE_SYNCHRONOUS']]
+
+        @event.listens_for(engine, 'connect')
+        def _configure(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute(f'PRAGMA synchronous={level:d}')
+            cursor.close()
+
+        # Connections opened before the listener reconnect with it
+        engine.dispose()
+
+
+class JobWorker:
+    """Poll for due jobs and run them until stop() is called"""
+
+    def __init__(self, name=None, poll_interval=None, batch_size=1):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.poll_interval = poll_interval or app.config['JOBS_POLL_INTERVAL']
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """Finish the current job, then return from run()"""
+        self._stopped.set()
+
+    def run(self, max_jobs=None, exit_when_idle=False):
+        """Process jobs; returns how many ran"""
+        processed = 0
+        with app.app_context():
+            while not self._stopped.is_set():
+                try:
+                    jobs = claim_jobs(self.name, self.batch_size)
+                except OperationalError as e:
+                    # e.g. SQLite busy while another worker claims; try again shortly
+                    db.session.rollback()
+                    logger.debug("Job claim failed: %s", e)
+                    jobs = []
+                for job in jobs:
+                    run_job(job, self.name)
+                    processed += 1
+                db.session.remove()
+                if max_jobs is not None and processed >= max_jobs:
+                    break
+                if not jobs:
+                    if exit_when_idle:
+                        break
+                    self._stopped.wait(self.poll_interval)
+        return processed
@@ -1,16 +1,34 @@
+"""WSGI entry point (`gunicorn main:app`).
+
+app.py only configures the application. create_app() finishes it for
+serving: it imports the views (and, through them, everything they use),
+and registers the blueprints. Directories the app writes to are created
+on first use, not here. `flask` CLI commands load manage.py instead and
+skip all of that.
+"""
 from app import app
 
-# Import and register blueprints
-from routes import main_bp
-from auth import auth_bp
+_initialized = False
 
-app.register_blueprint(main_bp)
-app.register_blueprint(auth_bp, url_prefix='/auth')
 
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+def create_app():
+    """Register the blueprints; returns the app"""
+    global _initialized
+    if not _initialized:
+        from assets import asset_manifest  # noqa: F401  (hashed static URLs in templates)
+        from metrics import request_metrics  # noqa: F401  (no-op unless METRICS_ENABLED)
+        from auth import auth_bp
+        from payment import payment_bp
+        from routes import main_bp
 
-from payment import payment_bp
-app.register_blueprint(payment_bp)
+        app.register_blueprint(main_bp)
+        app.register_blueprint(auth_bp, url_prefix='/auth')
+        app.register_blueprint(payment_bp)
+        _initialized = True
+    return app
 
 
+app = create_app()
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5000, debug=True)
@@ -1,11 +1,792 @@
+import os
+
+import click
 from flask import Flask
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from app import app, db
+import models  # noqa: F401  (registers the tables for migrations)
 
 
 migrate = Migrate(app, db)
 
+
+@app.cli.command('reconcile-unread')
+def reconcile_unread():
+    """Recompute every user's unread message counter."""
+    from unread import reconcile_unread_counts
+    rows = reconcile_unread_counts()
+    print(f"Reconciled unread counters for {rows} users.")
+
+
+@app.cli.command('rebuild-blog-facets')
+def rebuild_blog_facets_command():
+    """Re-sync blog tag links and recount tag/category facets."""
+    from facets import rebuild_blog_facets
+    posts = rebuild_blog_facets()
+    print(f"Rebuilt blog facets from {posts} posts.")
+
+
+@app.cli.command('search-reindex')
+@click.option('--batch-size', default=1000, show_default=True)
+def search_reindex(batch_size):
+    """Rebuild the blog full-text search index."""
+    from search import rebuild_index
+    with db.engine.begin() as connection:
+        posts = rebuild_index(connection, batch_size=batch_size)
+    print(f"Re-indexed {posts} blog posts.")
+
+
+@app.cli.command('search-benchmark')
+@click.option('--posts', default=100000, show_default=True, help='Size of the generated corpus.')
+@click.option('--runs', default=20, show_default=True, help='Timed runs per query.')
+def search_benchmark(posts, runs):
+    """Compare full-text search with LIKE on a generated SQLite corpus."""
+    import random
+    import tempfile
+    import time
+    from sqlalchemy import create_engine, insert
+    from models import BlogPost, Comment
+    from search import LikeSearch, SqliteSearch, get_backend, rebuild_index
+
+    rng = random.Random(42)
+    vocabulary = [''.join(rng.choice('bcdfghklmnprstvz') + rng.choice('aeiou') for _ in range(rng.randint(2, 4)))
+                  for _ in range(5000)]
+    words = lambda count: ' '.join(rng.choices(vocabulary, k=count))
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{directory}/bench.db")
+        BlogPost.__table__.create(engine)
+        Comment.__table__.create(engine)
+        with engine.begin() as connection:
+            for start in range(0, posts, 5000):
+                batch = range(start + 1, min(start + 5000, posts) + 1)
+                connection.execute(insert(BlogPost.__table__), [{
+                    'id': post_id, 'title': words(6), 'content': words(300), 'excerpt': words(20),
+                    'category': 'general', 'tags': ', '.join(rng.choices(vocabulary, k=3)),
+                    'is_published': True, 'author_id': 1
+                } for post_id in batch])
+                connection.execute(insert(Comment.__table__), [{
+                    'content': words(30), 'author_id': 1, 'post_id': post_id
+                } for post_id in batch for _ in range(2)])
+        print(f"Generated {posts} posts with {posts * 2} comments.")
+
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            SqliteSearch().create(connection)
+            rebuild_index(connection)
+        print(f"Built the index in {time.perf_counter() - started:.1f} s.")
+
+        queries = [' '.join(rng.choices(vocabulary, k=count)) for count in (1, 1, 2, 2, 3)]
+        print(f"{'query':<30} {'hits':>7} {'fts ms':>9} {'like ms':>9}")
+        with engine.connect() as connection:
+            backends = (get_backend(connection), LikeSearch())
+            for query in queries:
+                hits, _ = backends[0].search(connection, query, 10, 0)
+                timings = []
+                # LIKE scans the whole table, so it gets fewer runs
+                for backend, backend_runs in zip(backends, (runs, max(1, runs // 10))):
+                    started = time.perf_counter()
+                    for _ in range(backend_runs):
+                        backend.search(connection, query, 10, 0)
+                    timings.append((time.perf_counter() - started) / backend_runs * 1000)
+                print(f"{query:<30} {hits:>7} {timings[0]:>9.2f} {timings[1]:>9.2f}")
+        engine.dispose()
+
+
+@app.cli.command('comments-benchmark')
+@click.option('--comments', default=5000, show_default=True, help='Comments on the generated post.')
+@click.option('--threads', default=20, show_default=True, help='Top-level threads per page.')
+@click.option('--max-depth', default=8, show_default=True, help='Depth limit for the tree query.')
+def comments_benchmark(comments, threads, max_depth):
+    """Compare lazy reply loading with the recursive comment tree query."""
+    import random
+    import tempfile
+    import time
+    from sqlalchemy import create_engine, event, insert
+    from sqlalchemy.orm import Session
+    from comments import load_comment_tree
+    from models import BlogPost, Comment, User
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{directory}/bench.db")
+        for model in (User, BlogPost, Comment):
+            model.__table__.create(engine)
+        with engine.begin() as connection:
+            connection.execute(insert(User.__table__), [{
+                'id': user_id, 'username': f"user{user_id}", 'email': f"user{user_id}@example.com",
+                'password_hash': '', 'first_name': 'User', 'last_name': str(user_id)
+            } for user_id in range(1, 201)])
+            connection.execute(insert(BlogPost.__table__), [{
+                'id': 1, 'title': 'Benchmark', 'content': '', 'category': 'general',
+                'is_published': True, 'author_id': 1
+            }])
+            # A tenth of the comments start threads; the rest reply to a
+            # recent comment, which gives long, deeply nested chains
+            rows = []
+            for comment_id in range(1, comments + 1):
+                parent_id = None
+                if comment_id > 1 and rng.random() > 0.1:
+                    parent_id = rng.randint(max(1, comment_id - 20), comment_id - 1)
+                rows.append({'id': comment_id, 'content': f"Comment {comment_id}", 'post_id': 1,
+                             'author_id': rng.randint(1, 200), 'parent_id': parent_id})
+            connection.execute(insert(Comment.__table__), rows)
+
+        statements = []
+        event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(1))
+
+        def lazy_tree(session):
+            def walk(comment, depth):
+                comment.author.username
+                return 1 + sum(walk(reply, depth + 1) for reply in comment.replies if depth < max_depth)
+            top_level = (session.query(Comment).filter_by(post_id=1, parent_id=None)
+                         .order_by(Comment.created_at.desc()).limit(threads).all())
+            return sum(walk(comment, 0) for comment in top_level)
+
+        def cte_tree(session):
+            def walk(node):
+                return 1 + sum(walk(reply) for reply in node.replies)
+            tree = load_comment_tree(1, per_page=threads, max_depth=max_depth, session=session)
+            return sum(walk(node) for node in tree.threads)
+
+        print(f"Generated 1 post with {comments} comments.")
+        print(f"{'loader':<12} {'comments':>9} {'queries':>8} {'ms':>9}")
+        for name, loader in (('lazy', lazy_tree), ('recursive', cte_tree)):
+            with Session(engine) as session:
+                statements.clear()
+                started = time.perf_counter()
+                loaded = loader(session)
+                elapsed = (time.perf_counter() - started) * 1000
+            print(f"{name:<12} {loaded:>9} {len(statements):>8} {elapsed:>9.1f}")
+        engine.dispose()
+
+
+@app.cli.command('gateway-benchmark')
+@click.option('--calls', default=200, show_default=True, help='Checkout sessions to create per client.')
+@click.option('--latency', default=0.005, show_default=True, help='Stub gateway response delay in seconds.')
+def gateway_benchmark(calls, latency):
+    """Compare per-call connections with the pooled gateway client on a local stub."""
+    import time
+    import requests
+    from gateway import GatewayUnavailable, ThawaniClient
+    from thawani_stub import start_stub
+
+    stub = start_stub(latency=latency)
+    base_url = f"http://127.0.0.1:{stub.server_port}/api/v1"
+    payload = {'client_reference_id': '1', 'products': [{'name': 'Benchmark', 'quantity': 1, 'unit_amount': 100}]}
+    state = stub.state
+
+    print(f"{'client':<12} {'calls':>6} {'connections':>12} {'ms/call':>9}")
+    started = time.perf_counter()
+    for _ in range(calls):
+        requests.post(f"{base_url}/checkout/session", json=payload, timeout=10).raise_for_status()
+    elapsed = time.perf_counter() - started
+    print(f"{'per-call':<12} {calls:>6} {state.connections:>12} {elapsed / calls * 1000:>9.2f}")
+
+    client = ThawaniClient()
+    client.base_url = base_url
+    state.connections = 0
+    started = time.perf_counter()
+    for _ in range(calls):
+        client.create_checkout_session(payload)
+    elapsed = time.perf_counter() - started
+    print(f"{'pooled':<12} {calls:>6} {state.connections:>12} {elapsed / calls * 1000:>9.2f}")
+
+    # With the gateway failing every call, the breaker should stop calling out
+    state.fail_rate = 1.0
+    state.requests = 0
+    failed_fast = 0
+    started = time.perf_counter()
+    for _ in range(50):
+        try:
+            client.get_checkout_session('missing')
+        except GatewayUnavailable:
+            failed_fast += 1
+        except Exception:
+            pass
+    elapsed = time.perf_counter() - started
+    print(f"Failing gateway: 50 calls reached it {state.requests} times, "
+          f"{failed_fast} failed fast, {elapsed / 50 * 1000:.2f} ms/call, breaker {client.breaker.state}.")
+    stub.shutdown()
+
+
+@app.cli.command('sse-benchmark')
+@click.option('--events', default=5000, show_default=True, help='Events to publish.')
+@click.option('--workers', default=4, show_default=True, help='Simulated workers, each with a broker and tail thread.')
+@click.option('--publishers', default=4, show_default=True, help='Threads publishing at once.')
+@click.option('--max-size', default=64 * 1024, show_default=True,
+              help='Spool size in bytes that triggers rotation; small so the run rotates several times.')
+@click.option('--streams', default='50,200,1000', show_default=True,
+              help='Open streams to hold on a single worker, comma-separated levels.')
+def sse_benchmark(events, workers, publishers, max_size, streams):
+    """Measure event fan-out through the file spool to several workers, and
+    how many concurrent streams a single worker sustains."""
+    import json
+    import resource
+    import statistics
+    import tempfile
+    import threading
+    import time
+    from events import EventBroker, FileBackend
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.log')
+        brokers, subscriptions = [], []
+        for _ in range(workers):
+            broker = EventBroker()
+            broker.max_pending = events + 1
+            broker.backend = FileBackend(broker, path, max_size=max_size, poll_interval=0.01)
+            brokers.append(broker)
+            subscriptions.append(broker.subscribe(1))
+        time.sleep(0.2)  # let every tail thread open the spool
+
+        received = [dict() for _ in range(workers)]
+        deadline = [None]
+
+        def consume(subscription, seen):
+            while len(seen) < events and (deadline[0] is None or time.monotonic() < deadline[0]):
+                event = subscription.get(timeout=0.1)
+                if event is not None:
+                    seen[event['data']['seq']] = time.monotonic() - event['data']['sent']
+
+        def publish(offset):
+            for seq in range(offset, events, publishers):
+                brokers[seq % workers].publish(1, 'benchmark', {'seq': seq, 'sent': time.monotonic()})
+
+        consumers = [threading.Thread(target=consume, args=pair) for pair in zip(subscriptions, received)]
+        for thread in consumers:
+            thread.start()
+        started = time.perf_counter()
+        producers = [threading.Thread(target=publish, args=(offset,)) for offset in range(publishers)]
+        for thread in producers:
+            thread.start()
+        for thread in producers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        deadline[0] = time.monotonic() + 5
+        for thread in consumers:
+            thread.join()
+
+    print(f"Published {events} events from {publishers} threads in {elapsed:.2f} s "
+          f"({events / elapsed:.0f}/s), spool rotated at {max_size} bytes.")
+    print(f"{'worker':<8} {'received':>9} {'lost':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for index, seen in enumerate(received):
+        latencies = sorted(seen.values()) or [0.0]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{index:<8} {len(seen):>9} {events - len(seen):>6} "
+              f"{statistics.median(latencies) * 1000:>8.2f} {p99 * 1000:>8.2f}")
+
+    # One worker holding many streams: each stream runs the /api/stream loop
+    # on a thread of its own, as it would on a gthread worker thread
+    print()
+    print(f"{'streams':>8} {'delivered':>10} {'lost':>6} {'p50 ms':>8} {'p99 ms':>8} {'idle cpu %':>11} {'rss MB':>7}")
+    for count in (int(level) for level in streams.split(',')):
+        with tempfile.TemporaryDirectory() as directory:
+            broker = EventBroker()
+            broker.max_subscribers = count
+            broker.backend = FileBackend(broker, os.path.join(directory, 'events.log'), poll_interval=0.01)
+            subscriptions = [broker.subscribe(user_id) for user_id in range(count)]
+            latencies, frames = [], []
+            stop = threading.Event()
+
+            def stream(subscription):
+                while not stop.is_set():
+                    event = subscription.get(timeout=1.0)
+                    if event is not None:
+                        frames.append(f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n")
+                        latencies.append(time.monotonic() - event['data']['sent'])
+
+            threads = [threading.Thread(target=stream, args=(subscription,), daemon=True)
+                       for subscription in subscriptions]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.5)
+
+            # CPU the open but quiet streams cost (heartbeat waits)
+            cpu_started, idle_started = time.process_time(), time.monotonic()
+            time.sleep(2)
+            idle_cpu = (time.process_time() - cpu_started) / (time.monotonic() - idle_started) * 100
+
+            for seq in range(events):
+                broker.publish(seq % count, 'benchmark', {'seq': seq, 'sent': time.monotonic()})
+            deadline = time.monotonic() + 10
+            while len(latencies) < events and time.monotonic() < deadline:
+                time.sleep(0.05)
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        latencies = sorted(latencies) or [0.0]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{count:>8} {len(latencies):>10} {events - len(latencies):>6} "
+              f"{statistics.median(latencies) * 1000:>8.2f} {p99 * 1000:>8.2f} {idle_cpu:>11.1f} {rss:>7.0f}")
+
+
+@app.cli.command('warm-templates')
+@click.option('--benchmark', is_flag=True, help='Compare compiling from source with loading from the bytecode cache.')
+def warm_templates_command(benchmark):
+    """Compile every template into the shared bytecode cache."""
+    from warmup import warm_templates
+    if not benchmark:
+        timings = warm_templates()
+        print(f"Warmed {len(timings)} templates in {sum(timings.values()) * 1000:.1f} ms.")
+        return
+
+    cold = warm_templates(use_bytecode_cache=False)
+    warm_templates(reload=True)  # make sure every template is in the bytecode cache
+    cached = warm_templates(reload=True)
+    print(f"{'template':<40} {'source ms':>10} {'cached ms':>10}")
+    for name in cold:
+        print(f"{name:<40} {cold[name] * 1000:>10.2f} {cached.get(name, 0) * 1000:>10.2f}")
+    print(f"{'total':<40} {sum(cold.values()) * 1000:>10.2f} {sum(cached.values()) * 1000:>10.2f}")
+
+
+@app.cli.command('import-time')
+@click.option('--module', 'modules', multiple=True, default=('main', 'manage'), show_default=True,
+              help='Entry point to measure; repeat for several.')
+@click.option('--runs', default=5, show_default=True, help='Fresh interpreters per module; the fastest counts.')
+@click.option('--budget-ms', type=float, default=lambda: float(os.environ.get('IMPORT_TIME_BUDGET_MS', '1200')),
+              show_default='IMPORT_TIME_BUDGET_MS or 1200', help='Fail if an entry point takes longer to import.')
+@click.option('--top', default=10, show_default=True, help='Packages to list per module.')
+def import_time_command(modules, runs, budget_ms, top):
+    """Measure entry point import time against a budget (exits 1 when over)."""
+    from startup import LAZY_PACKAGES, measure_imports
+    failures = []
+    for module in modules:
+        profile = measure_imports(module, runs=runs)
+        print(f"{module}: {profile.total_ms:.0f} ms (budget {budget_ms:.0f} ms)")
+        for package, self_us in profile.packages.most_common(top):
+            print(f"  {package:<30} {self_us / 1000:>8.1f} ms")
+        if profile.total_ms > budget_ms:
+            failures.append(f"{module} took {profile.total_ms:.0f} ms to import")
+        failures.extend(f"{module} imports {package}, which should load on first use"
+                        for package in LAZY_PACKAGES if profile.loaded(package))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+
+
+jobs_cli = AppGroup('jobs', help='Run and maintain the background job queue.')
+
+
+@jobs_cli.command('worker')
+@click.option('--threads', default=4, show_default=True, help='Jobs run at once; gateway calls mostly wait on I/O.')
+@click.option('--burst', is_flag=True, help='Exit once no job is due instead of polling forever.')
+@click.option('--webhooks/--no-webhooks', default=True, show_default=True,
+              help='Also apply stored payment webhooks (see webhooks.py).')
+def jobs_worker_command(threads, burst, webhooks):
+    """Run queued background jobs until SIGTERM or Ctrl-C."""
+    import signal
+    import threading
+    import checkout  # noqa: F401  (registers the checkout job handlers)
+    from jobs import JobWorker, configure_worker_connections
+    from webhooks import WebhookProcessor
+
+    configure_worker_connections()
+    workers = [JobWorker() for _ in range(threads)]
+    processor = WebhookProcessor() if webhooks else None
+
+    def stop(signum, frame):
+        print("Stopping after the jobs in progress...")
+        for worker in (*workers, *([processor] if processor else [])):
+            worker.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    counts = []
+    events = []
+    pool = [threading.Thread(target=lambda worker=worker: counts.append(worker.run(exit_when_idle=burst)),
+                             name=f'job-worker-{index}')
+            for index, worker in enumerate(workers)]
+    if processor:
+        pool.append(threading.Thread(target=lambda: events.append(processor.run(exit_when_idle=burst)),
+                                     name='webhook-processor'))
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        while thread.is_alive():
+            thread.join(timeout=1)  # short joins keep the main thread responsive to signals
+    print(f"Ran {sum(counts)} jobs" + (f", processed {sum(events[0].values())} webhook events." if events else "."))
+
+
+@jobs_cli.command('prune')
+@click.option('--days', default=30, show_default=True, help='Keep succeeded jobs finished more recently than this.')
+def jobs_prune_command(days):
+    """Delete old succeeded jobs (dead jobs are kept for inspection)."""
+    from jobs import prune_jobs
+    print(f"Deleted {prune_jobs(days)} finished jobs.")
+
+
+app.cli.add_command(jobs_cli)
+
+
+webhooks_cli = AppGroup('webhooks', help='Process, replay and load-test payment webhooks.')
+
+
+@webhooks_cli.command('process')
+def webhooks_process_command():
+    """Apply every stored webhook event now (the job worker normally does this)."""
+    from webhooks import WebhookProcessor
+    counts = WebhookProcessor().run(exit_when_idle=True)
+    print(f"Processed {sum(counts.values())} events: {dict(counts)}")
+
+
+@webhooks_cli.command('replay')
+@click.option('--since', type=click.DateTime(), help='Only events received at or after this time (UTC).')
+@click.option('--until', type=click.DateTime(), help='Only events received before this time (UTC).')
+@click.option('--outcome', 'outcomes', multiple=True,
+              type=click.Choice(['applied', 'duplicate', 'stale', 'unmatched', 'ignored']),
+              help='Only events with this outcome; repeat for several.')
+@click.option('--event-id', 'event_ids', multiple=True, help='Only this gateway event id; repeat for several.')
+@click.option('--file', 'source', type=click.File('rb'),
+              help='Ingest raw webhook bodies from a file, one JSON object per line, instead.')
+@click.option('--dry-run', is_flag=True, help='Only count the events that would be replayed.')
+@click.option('--process', is_flag=True, help='Apply the replayed events now instead of leaving them to the worker.')
+def webhooks_replay_command(since, until, outcomes, event_ids, source, dry_run, process):
+    """Queue stored (or exported) webhook events to be applied again."""
+    from webhooks import WebhookProcessor, ingest_event, replay_events
+    if source is not None:
+        lines = [line.strip() for line in source if line.strip()]
+        if not dry_run:
+            for line in lines:
+                ingest_event(line)
+        print(f"{'Would ingest' if dry_run else 'Ingested'} {len(lines)} events from {source.name}.")
+    else:
+        count = replay_events(since=since, until=until, outcomes=outcomes, event_ids=event_ids, dry_run=dry_run)
+        print(f"{'Would replay' if dry_run else 'Replaying'} {count} events.")
+    if process and not dry_run:
+        counts = WebhookProcessor().run(exit_when_idle=True)
+        print(f"Processed {sum(counts.values())} events: {dict(counts)}")
+
+
+@webhooks_cli.command('loadtest')
+@click.option('--payments', default=2000, show_default=True, help='Test payments to send events for.')
+@click.option('--threads', default=8, show_default=True, help='Concurrent webhook connections.')
+@click.option('--duplicate-rate', default=0.1, show_default=True, help='Share of events delivered twice.')
+@click.option('--url', help='Webhook URL of a running server on the same database (e.g. gunicorn with '
+                            'several workers); by default an in-process server is started.')
+@click.option('--keep', is_flag=True, help='Keep the test payments and events afterwards.')
+def webhooks_loadtest_command(payments, threads, duplicate_rate, url, keep):
+    """Push webhooks through the app over HTTP and check the resulting payment statuses.
+
+    Test payments and events are written to the configured database and
+    removed afterwards; point DATABASE_URL at a scratch copy. The
+    in-process server shares one interpreter with the senders, so use
+    --url against gunicorn to measure real throughput.
+    """
+    import json
+    import random
+    import statistics
+    import threading
+    import time
+    import uuid
+    from sqlalchemy import delete, func, insert, select
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from main import create_app
+    from datetime import datetime
+    from models import Payment, PaymentEvent, PaymentStatus, User
+    from revenue import adjust_revenue
+    from thawani_stub import send_webhooks
+    from webhooks import EVENT_STATUSES, STATUS_RANK, WebhookProcessor, ingest_event, replay_events
+
+    user_id = db.session.execute(select(User.id).limit(1)).scalar()
+    if user_id is None:
+        raise click.ClickException("Needs at least one user to own the test payments.")
+    rng = random.Random(42)
+    run = uuid.uuid4().hex[:8]
+    description = f"webhook loadtest {run}"
+    sessions = [f"lt{run}_session_{index}" for index in range(payments)]
+    created_at = datetime.utcnow()
+    db.session.execute(insert(Payment.__table__), [{
+        'amount': 1.0, 'currency': 'OMR', 'description': description, 'status': PaymentStatus.PENDING,
+        'user_id': user_id, 'stripe_session_id': session_id, 'created_at': created_at
+    } for session_id in sessions])
+    adjust_revenue([(created_at, 'OMR', None, PaymentStatus.PENDING, 1.0, 1)] * payments)
+    db.session.commit()
+
+    # Every payment succeeds; some also get a cancellation that arrives late
+    # and some a refund. Delivery order is shuffled and some events repeat.
+    events = []
+    expected = {}
+    for session_id in sessions:
+        types = ['checkout.success']
+        if rng.random() < 0.3:
+            types.append('checkout.cancelled')
+        if rng.random() < 0.15:
+            types.append('refund.success')
+        expected[session_id] = max((EVENT_STATUSES[event_type] for event_type in types), key=STATUS_RANK.get)
+        for event_type in types:
+            events.append(json.dumps({
+                'event_id': f"lt{run}_event_{len(events)}", 'event_type': event_type,
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'data': {'session_id': session_id}
+            }).encode())
+    deliveries = events + rng.sample(events, int(len(events) * duplicate_rate))
+    rng.shuffle(deliveries)
+
+    # DB work of the ingest step alone, without HTTP in the way
+    ingest_times = []
+    for index in range(500):
+        body = json.dumps({'event_id': f"lt{run}_ping_{index}", 'event_type': 'loadtest.ping', 'data': {}}).encode()
+        ingest_started = time.perf_counter()
+        ingest_event(body)
+        ingest_times.append(time.perf_counter() - ingest_started)
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args):
+            pass
+
+    server = None
+    if url is None:
+        server = make_server('127.0.0.1', 0, create_app(), threaded=True, request_handler=KeepAliveHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/payment/webhook"
+    processor = WebhookProcessor()
+    processor_thread = threading.Thread(target=processor.run)
+    processor_thread.start()
+    unprocessed = select(func.count()).select_from(PaymentEvent).where(
+        PaymentEvent.processed_at.is_(None), PaymentEvent.event_id.like(f"lt{run}_%"))
+    try:
+        started = time.perf_counter()
+        latencies, errors = send_webhooks(url, deliveries, threads=threads)
+        sent = time.perf_counter() - started
+        while db.session.execute(unprocessed).scalar():
+            db.session.rollback()
+            time.sleep(0.05)
+        drained = time.perf_counter() - started
+    finally:
+        processor.stop()
+        processor_thread.join()
+        if server is not None:
+            server.shutdown()
+
+    def check():
+        statuses = dict(db.session.execute(
+            select(Payment.stripe_session_id, Payment.status).where(Payment.description == description)).all())
+        outcomes = dict(db.session.execute(
+            select(PaymentEvent.outcome, func.count()).where(PaymentEvent.event_id.like(f"lt{run}_event_%"))
+            .group_by(PaymentEvent.outcome)).all())
+        return sum(1 for session_id, status in expected.items() if statuses.get(session_id) != status), outcomes
+
+    wrong, outcomes = check()
+
+    # Replaying everything must change nothing; it also times the processor alone
+    event_ids = [json.loads(body)['event_id'] for body in events]
+    for start in range(0, len(event_ids), 1000):
+        replay_events(event_ids=event_ids[start:start + 1000])
+    replay_started = time.perf_counter()
+    replayed = sum(WebhookProcessor().run(exit_when_idle=True).values())
+    replay_seconds = time.perf_counter() - replay_started
+    wrong_after_replay, replay_outcomes = check()
+
+    def percentile(values, share):
+        return sorted(values)[int(len(values) * share)] * 1000
+
+    print(f"Delivered {len(deliveries)} webhooks ({len(deliveries) - len(events)} repeats) for {payments} payments "
+          f"over {threads} connections.")
+    print(f"  ingest: {len(deliveries) / sent:.0f} events/s, latency p50 {percentile(latencies, 0.5):.2f} ms, "
+          f"p99 {percentile(latencies, 0.99):.2f} ms, {len(errors)} errors")
+    print(f"  ingest DB work: p50 {percentile(ingest_times, 0.5):.3f} ms, p99 {percentile(ingest_times, 0.99):.3f} ms, "
+          f"mean {statistics.mean(ingest_times) * 1000:.3f} ms")
+    print(f"  all applied {drained:.2f}s after the first delivery ({len(deliveries) / drained:.0f} events/s end to end)")
+    print(f"  outcomes: {outcomes}")
+    print(f"  payments with the wrong final status: {wrong}")
+    print(f"Replayed {replayed} events in {replay_seconds:.2f}s ({replayed / replay_seconds:.0f} events/s): "
+          f"{replay_outcomes}, {wrong_after_replay} wrong statuses")
+
+    if not keep:
+        db.session.execute(delete(PaymentEvent).where(PaymentEvent.event_id.like(f"lt{run}_%")))
+        adjust_revenue([(created_at, 'OMR', None, status, 1.0, -1) for status in db.session.execute(
+            select(Payment.status).where(Payment.description == description)).scalars()])
+        db.session.execute(delete(Payment).where(Payment.description == description))
+        db.session.commit()
+    if wrong or wrong_after_replay or errors:
+        raise SystemExit(1)
+
+
+app.cli.add_command(webhooks_cli)
+
+
+payments_cli = AppGroup('payments', help='Maintain payment records.')
+
+
+@payments_cli.command('reconcile')
+@click.option('--batch-size', type=int, help='Payments per page and per transaction [RECONCILE_BATCH_SIZE].')
+@click.option('--workers', type=int, help='Concurrent gateway lookups [RECONCILE_WORKERS].')
+@click.option('--min-age', type=int, help='Skip payments younger than this many seconds [RECONCILE_MIN_AGE].')
+@click.option('--abandon-after', type=int,
+              help='Fail unpaid payments older than this many seconds [RECONCILE_ABANDON_AFTER].')
+@click.option('--max-pages', type=int, help='Stop after this many pages; the next run resumes from there.')
+@click.option('--checkpoint', 'checkpoint_path', help='Checkpoint file [RECONCILE_CHECKPOINT_PATH].')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and start from the oldest pending payment.')
+@click.option('--dry-run', is_flag=True, help='Ask the gateway and report, but change nothing.')
+@click.option('--report', 'report_file', type=click.File('w'), help='Also write the report as JSON to this file.')
+def payments_reconcile_command(batch_size, workers, min_age, abandon_after, max_pages, checkpoint_path,
+                               restart, dry_run, report_file):
+    """Settle PENDING payments from the state of their checkout sessions."""
+    import json
+    from reconcile import Checkpoint, ReconcileAborted, reconcile_payments
+
+    try:
+        report = reconcile_payments(batch_size=batch_size, workers=workers, min_age=min_age,
+                                    abandon_after=abandon_after, dry_run=dry_run, max_pages=max_pages,
+                                    checkpoint=Checkpoint(checkpoint_path), restart=restart)
+    except ReconcileAborted as e:
+        raise click.ClickException(f"{e}; run again to resume from the last finished page.")
+    if report['resumed_from']:
+        print(f"Resumed after payments created at {report['resumed_from']}.")
+    print(f"{'Would settle' if dry_run else 'Settled'} pending payments: scanned {report['scanned']} "
+          f"in {report['pages']} pages{'' if report['finished'] else ' (stopped early; resumable)'}.")
+    print(f"  sessions: {dict(report['states'])}")
+    print(f"  actions: {dict(report['actions'])}")
+    if not dry_run:
+        print(f"  payments changed: {report['changed']}")
+    for sample in report['samples']:
+        print(f"  #{sample['payment_id']} {sample['session_id'] or '-'} created {sample['created_at']}: "
+              f"{sample['state']} -> {sample['action']}")
+    if report_file is not None:
+        json.dump(report, report_file, indent=2)
+
+
+app.cli.add_command(payments_cli)
+
+
+reports_cli = AppGroup('reports', help='Build and benchmark the revenue rollups.')
+
+
+@reports_cli.command('backfill-revenue')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), help='First day to rebuild (whole months).')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), help='Last day to rebuild (whole months).')
+def backfill_revenue_command(since, until):
+    """Rebuild the daily and monthly revenue rollups from the payments table."""
+    from revenue import rebuild_revenue
+    counted = rebuild_revenue(since=since.date() if since else None, until=until.date() if until else None)
+    print(f"Rebuilt revenue rollups from {counted} payments.")
+
+
+@reports_cli.command('revenue-benchmark')
+@click.option('--payments', default=10000000, show_default=True, help='Size of the generated payment history.')
+@click.option('--years', default=5, show_default=True, help='Span of the generated history.')
+@click.option('--runs', default=5, show_default=True, help='Timed runs per report.')
+def revenue_benchmark(payments, years, runs):
+    """Compare GROUP BY over payments with the revenue rollups on a generated SQLite database."""
+    import random
+    import tempfile
+    import time
+    from datetime import date, timedelta
+    from sqlalchemy import BigInteger, case, cast, create_engine, event, func, select
+    from sqlalchemy.orm import Session
+    from models import Payment, PaymentStatus, RevenueDaily, RevenueMonthly
+    from revenue import CURRENCY_EXPONENTS, rebuild_revenue, revenue_report
+
+    rng = random.Random(42)
+    end = date(2026, 6, 30)
+    first_day = end - timedelta(days=365 * years - 1)
+    days = (end - first_day).days + 1
+    statuses = [status.name for status in (PaymentStatus.COMPLETED, PaymentStatus.PENDING,
+                                            PaymentStatus.FAILED, PaymentStatus.REFUNDED)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{directory}/bench.db")
+
+        @event.listens_for(engine, 'connect')
+        def fast_writes(dbapi_connection, connection_record):
+            dbapi_connection.execute('PRAGMA journal_mode=WAL')
+            dbapi_connection.execute('PRAGMA synchronous=OFF')
+
+        for model in (Payment, RevenueDaily, RevenueMonthly):
+            model.__table__.create(engine)
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            for offset in range(days):
+                count = payments // days + (1 if offset < payments % days else 0)
+                day = (first_day + timedelta(days=offset)).isoformat()
+                rows = []
+                for second in sorted(rng.randrange(86400) for _ in range(count)):
+                    currency = 'OMR' if rng.random() < 0.7 else 'USD'
+                    scale = 1000 if currency == 'OMR' else 100
+                    rows.append((rng.randrange(scale, 500 * scale) / scale, currency,
+                                 rng.choices(statuses, (70, 10, 15, 5))[0], 1, rng.randrange(200) or None,
+                                 f"{day} {second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}.000000"))
+                connection.exec_driver_sql(
+                    "INSERT INTO payment (amount, currency, status, user_id, project_id, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        print(f"Generated {payments} payments over {days} days in {time.perf_counter() - started:.1f} s.")
+
+        with Session(engine) as session:
+            started = time.perf_counter()
+            rebuild_revenue(session=session)
+            print(f"Backfilled the rollups in {time.perf_counter() - started:.1f} s "
+                  f"({session.scalar(select(func.count()).select_from(RevenueDaily)):,} daily rows, "
+                  f"{session.scalar(select(func.count()).select_from(RevenueMonthly)):,} monthly rows).")
+
+            currency = func.coalesce(Payment.currency, 'USD')
+            factor = case({code: 10 ** exponent for code, exponent in CURRENCY_EXPONENTS.items()},
+                          value=currency, else_=100)
+
+            def direct(start, stop, amount):
+                return session.execute(
+                    select(currency, Payment.status, func.count(), func.sum(amount))
+                    .where(Payment.created_at >= start, Payment.created_at < stop + timedelta(days=1))
+                    .group_by(currency, Payment.status)
+                ).all()
+
+            def timed(function, times):
+                started = time.perf_counter()
+                for _ in range(times):
+                    result = function()
+                return result, (time.perf_counter() - started) / times * 1000
+
+            print(f"{'range':<22} {'group by ms':>12} {'rollups ms':>11} {'speedup':>8}  exact")
+            ranges = [
+                ('7 days', end - timedelta(days=6), end),
+                ('31 days, mid-month', date(end.year, 1, 15), date(end.year, 2, 14)),
+                ('1 quarter', date(end.year, 4, 1), end),
+                ('1 year', end - timedelta(days=364), end),
+                (f'{years} years', first_day, end),
+            ]
+            for label, start, stop in ranges:
+                # A GROUP BY over the whole range scans every row, so it gets fewer runs
+                _, direct_ms = timed(lambda: direct(start, stop, Payment.amount), max(1, runs // 5))
+                report, rollup_ms = timed(lambda: revenue_report(start, stop, session=session), runs)
+                exact = {(row[0], row[1].value): (row[2], row[3]) for row in
+                         direct(start, stop, cast(func.round(Payment.amount * factor), BigInteger))}
+                matches = exact == {(row['currency'], row['status']): (row['count'], row['amount_minor'])
+                                    for row in report['rows']}
+                print(f"{label:<22} {direct_ms:>12.1f} {rollup_ms:>11.2f} {direct_ms / rollup_ms:>7.0f}x  "
+                      f"{'yes' if matches else 'NO'}")
+        engine.dispose()
+
+
+app.cli.add_command(reports_cli)
+
+
+assets_cli = AppGroup('assets', help='Build fingerprinted static assets.')
+
+
+@assets_cli.command('build')
+@click.option('--no-vendor', is_flag=True, help='Do not download missing vendor assets.')
+@click.option('--refresh-vendor', is_flag=True, help='Re-download vendor assets even if present.')
+@click.option('--clean', is_flag=True, help='Remove files left over from earlier builds.')
+def build_assets_command(no_vendor, refresh_vendor, clean):
+    """Minify, hash and precompress static assets into static/dist."""
+    from assets import build_assets, fetch_vendor_assets
+    if not no_vendor:
+        fetched = fetch_vendor_assets(app.static_folder, force=refresh_vendor)
+        print(f"Fetched {fetched} vendor assets.")
+    manifest = build_assets(app.static_folder, clean=clean)
+    print(f"Built {len(manifest)} assets into {app.static_folder}/dist.")
+
+
+app.cli.add_command(assets_cli)
+
+
 if __name__ == '__main__':
     app.run()
 
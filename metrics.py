@@ -0,0 +1,296 @@
+"""Per-request performance metrics.
+
+With METRICS_ENABLED set, every request records its wall time, the time
+and number of its SQL statements (SQLAlchemy cursor events) and the time
+spent rendering templates (Flask template signals). The figures are sent
+back in a Server-Timing header, so browser dev tools show where a request
+went, and are aggregated per endpoint into histograms served at /metrics
+in the Prometheus text format.
+
+Each gunicorn worker keeps its histograms in memory and a background thread
+writes them to the worker's own file in METRICS_DIR every
+METRICS_FLUSH_INTERVAL seconds. /metrics sums the files of every worker,
+folding those of exited workers into an archive so counters never go
+backwards when workers are recycled. When METRICS_ENABLED is off none of
+the hooks are installed.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import Response, abort, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app, private_directory, state_path
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name: (help text, bucket bounds)
+HISTOGRAMS = {
+    'platform_request_duration_seconds': ('Request wall time in seconds', SECONDS_BUCKETS),
+    'platform_request_db_seconds': ('Time spent in SQL statements per request', SECONDS_BUCKETS),
+    'platform_request_db_queries': ('SQL statements executed per request', QUERY_BUCKETS),
+    'platform_request_template_seconds': ('Time spent rendering templates per request', SECONDS_BUCKETS),
+    'platform_gateway_request_seconds': ('Payment gateway call latency in seconds', SECONDS_BUCKETS),
+    'platform_job_seconds': ('Background job run time in seconds', SECONDS_BUCKETS),
+    'platform_job_wait_seconds': ('Time background jobs waited past their due time', SECONDS_BUCKETS),
+    'platform_webhook_lag_seconds': ('Time from receiving a webhook to applying it', SECONDS_BUCKETS),
+}
+
+ARCHIVE_FILE = 'archive.json'
+
+
+def _merge(target, series):
+    """Add serialized histogram series into `target` ({key: [buckets, sum, count]})"""
+    for name, labels, buckets, total, count in series:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        current = target.get(key)
+        if current is None:
+            target[key] = [list(buckets), total, count]
+        else:
+            current[0] = [a + b for a, b in zip(current[0], buckets)]
+            current[1] += total
+            current[2] += count
+
+
+def _serialize(histograms):
+    return [[name, [list(pair) for pair in labels], buckets, total, count]
+            for (name, labels), (buckets, total, count) in histograms.items()]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_bound(bound):
+    return repr(float(bound)) if isinstance(bound, float) else str(bound)
+
+
+class RequestMetrics:
+    """Request timing hooks plus a histogram store shared through files"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.server_timing = True
+        self.directory = None
+        self.token = None
+        self.flush_interval = 1.0
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._dirty = False
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', False)
+        if not self.enabled:
+            return
+        self.server_timing = app.config.get('METRICS_SERVER_TIMING', self.server_timing)
+        self.directory = app.config.get('METRICS_DIR') or state_path('metrics')
+        self.token = app.config.get('METRICS_TOKEN')
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', self.flush_interval)
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        event.listen(Engine, 'before_cursor_execute', self._query_started)
+        event.listen(Engine, 'after_cursor_execute', self._query_finished)
+        app.add_url_rule('/metrics', 'metrics', self._metrics_view)
+        atexit.register(self.flush, force=True)
+
+    # Request hooks
+
+    def _start_request(self):
+        g._metrics = {'started': time.perf_counter(), 'db': 0.0, 'queries': 0, 'template': 0.0,
+                      'template_started': []}
+
+    def _query_started(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and '_metrics' in g:
+            conn.info.setdefault('_metrics_query_started', []).append(time.perf_counter())
+
+    def _query_finished(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('_metrics_query_started')
+        if started and has_request_context() and '_metrics' in g:
+            g._metrics['db'] += time.perf_counter() - started.pop()
+            g._metrics['queries'] += 1
+
+    def _template_started(self, sender, template, context, **extra):
+        if '_metrics' in g:
+            g._metrics['template_started'].append(time.perf_counter())
+
+    def _template_finished(self, sender, template, context, **extra):
+        if '_metrics' in g and g._metrics['template_started']:
+            g._metrics['template'] += time.perf_counter() - g._metrics['template_started'].pop()
+
+    def _finish_request(self, response):
+        timings = g.pop('_metrics', None)
+        if timings is None or request.endpoint == 'metrics':
+            return response
+        duration = time.perf_counter() - timings['started']
+        if self.server_timing:
+            response.headers.add('Server-Timing', ', '.join((
+                f"db;dur={timings['db'] * 1000:.1f};desc=\"{timings['queries']} queries\"",
+                f"tpl;dur={timings['template'] * 1000:.1f}",
+                f"total;dur={duration * 1000:.1f}",
+            )))
+        endpoint = request.endpoint or 'unmatched'
+        self.observe('platform_request_duration_seconds', duration,
+                     endpoint=endpoint, method=request.method, status=response.status_code)
+        self.observe('platform_request_db_seconds', timings['db'], endpoint=endpoint)
+        self.observe('platform_request_db_queries', timings['queries'], endpoint=endpoint)
+        self.observe('platform_request_template_seconds', timings['template'], endpoint=endpoint)
+        return response
+
+    # Histogram store
+
+    def observe(self, name, value, **labels):
+        """Record one observation of histogram `name` (a no-op when disabled)"""
+        if not self.enabled:
+            return
+        bounds = HISTOGRAMS[name][1]
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self._lock:
+            if self._pid != os.getpid():
+                # First observation in this process; anything inherited on
+                # fork is already counted in the parent's file
+                self._pid = os.getpid()
+                self._histograms = {}
+                self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+                self._thread.start()
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [[0] * (len(bounds) + 1), 0.0, 0]
+            # Buckets are stored non-cumulative; the last one is +Inf
+            index = next((i for i, bound in enumerate(bounds) if value <= bound), len(bounds))
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+            self._dirty = True
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self, force=False):
+        """Write this worker's histograms to its file if they changed"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._pid != os.getpid() or (not self._dirty and not force):
+                return
+            data = json.dumps(_serialize(self._histograms))
+            self._dirty = False
+        path = os.path.join(self.directory, f"worker-{os.getpid()}.json")
+        temp_path = f"{path}.tmp"
+        try:
+            private_directory(self.directory)
+            with open(temp_path, 'w') as handle:
+                handle.write(data)
+            os.replace(temp_path, path)
+        except (OSError, RuntimeError):
+            logger.exception("Could not write request metrics to %s", path)
+
+    def collect(self):
+        """Sum the histograms of every worker, past and present"""
+        self.flush(force=True)
+        totals = {}
+        with open(os.path.join(private_directory(self.directory), '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+                archive = self._read(archive_path)
+                archived = {}
+                _merge(archived, archive)
+                exited = []
+                for filename in os.listdir(self.directory):
+                    if not (filename.startswith('worker-') and filename.endswith('.json')):
+                        continue
+                    path = os.path.join(self.directory, filename)
+                    series = self._read(path)
+                    if self._alive(int(filename[7:-5])):
+                        _merge(totals, series)
+                    else:
+                        _merge(archived, series)
+                        exited.append(path)
+                if exited:
+                    # Fold exited workers into the archive so their counts survive
+                    temp_path = f"{archive_path}.tmp"
+                    with open(temp_path, 'w') as handle:
+                        json.dump(_serialize(archived), handle)
+                    os.replace(temp_path, archive_path)
+                    for path in exited:
+                        os.remove(path)
+                _merge(totals, _serialize(archived))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return totals
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return []
+        except ValueError:
+            logger.warning("Ignoring unreadable metrics file %s", path)
+            return []
+
+    @staticmethod
+    def _alive(pid):
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def render(self):
+        """Prometheus text exposition of the aggregated histograms"""
+        totals = self.collect()
+        lines = []
+        for name, (help_text, bounds) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (series_name, labels), (buckets, total, count) in sorted(totals.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip((*bounds, '+Inf'), buckets):
+                    cumulative += bucket
+                    le = bound if bound == '+Inf' else _format_bound(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total!r}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def _metrics_view(self):
+        if self.token and request.headers.get('Authorization') != f"Bearer {self.token}":
+            abort(403)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+request_metrics = RequestMetrics(app)
@@ -0,0 +1,26 @@
+"""add index for the admin unverified-user list
+
+Revision ID: 055fa20b71d4
+Revises: 71da45559687
+Create Date: 2026-10-17 11:02:19.554081
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '055fa20b71d4'
+down_revision = '71da45559687'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_verified_created', ['is_verified', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_verified_created')
@@ -0,0 +1,43 @@
+"""add blog_post_search full-text index
+
+Revision ID: 0a49a5e4fd34
+Revises: ccc2416d7bd4
+Create Date: 2026-10-17 15:12:44.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a49a5e4fd34'
+down_revision = 'ccc2416d7bd4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The index is filled by `flask search-reindex`
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS blog_post_search "
+            "USING fts5(title, excerpt, tags, content, comments, tokenize='porter unicode61')"
+        )
+    elif dialect == 'postgresql':
+        op.execute(
+            "CREATE TABLE IF NOT EXISTS blog_post_search ("
+            "post_id INTEGER PRIMARY KEY REFERENCES blog_post (id) ON DELETE CASCADE, "
+            "title TEXT, excerpt TEXT, tags TEXT, content TEXT, comments TEXT, "
+            "document TSVECTOR NOT NULL)"
+        )
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_blog_post_search_document "
+            "ON blog_post_search USING gin (document)"
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        op.execute("DROP TABLE IF EXISTS blog_post_search")
@@ -0,0 +1,89 @@
+"""add tag, blog_post_tags and blog_category tables
+
+Revision ID: 266570218c5c
+Revises: 0a49a5e4fd34
+Create Date: 2026-10-17 16:02:31.774019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '266570218c5c'
+down_revision = '0a49a5e4fd34'
+branch_labels = None
+depends_on = None
+
+
+def _split_tags(value):
+    # Frozen copy of models.Tag.split at the time of this migration
+    names = []
+    for part in (value or '').split(','):
+        name = ' '.join(part.split()).lower()[:50]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def upgrade():
+    tag = op.create_table('tag',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('post_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    blog_post_tags = op.create_table('blog_post_tags',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['blog_post.id'], ),
+    sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+    sa.PrimaryKeyConstraint('post_id', 'tag_id')
+    )
+    with op.batch_alter_table('blog_post_tags', schema=None) as batch_op:
+        batch_op.create_index('ix_blog_post_tags_tag_post', ['tag_id', 'post_id'], unique=False)
+
+    blog_category = op.create_table('blog_category',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('post_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    # Split the existing comma-separated tags and count published posts
+    blog_post = sa.table('blog_post',
+        sa.column('id', sa.Integer), sa.column('tags', sa.String),
+        sa.column('category', sa.String), sa.column('is_published', sa.Boolean))
+    connection = op.get_bind()
+    tag_ids = {}
+    tag_counts = {}
+    category_counts = {}
+    links = []
+    for post_id, tags, category, is_published in connection.execute(
+            sa.select(blog_post.c.id, blog_post.c.tags, blog_post.c.category, blog_post.c.is_published)):
+        for name in _split_tags(tags):
+            tag_ids.setdefault(name, len(tag_ids) + 1)
+            links.append({'post_id': post_id, 'tag_id': tag_ids[name]})
+            if is_published:
+                tag_counts[name] = tag_counts.get(name, 0) + 1
+        if is_published:
+            category_counts[category] = category_counts.get(category, 0) + 1
+
+    if tag_ids:
+        op.bulk_insert(tag, [{'id': tag_id, 'name': name, 'post_count': tag_counts.get(name, 0)}
+                             for name, tag_id in tag_ids.items()])
+        op.bulk_insert(blog_post_tags, links)
+        if connection.dialect.name == 'postgresql':
+            op.execute("SELECT setval(pg_get_serial_sequence('tag', 'id'), (SELECT max(id) FROM tag))")
+    if category_counts:
+        op.bulk_insert(blog_category, [{'name': name, 'post_count': count}
+                                       for name, count in category_counts.items()])
+
+
+def downgrade():
+    op.drop_table('blog_category')
+    with op.batch_alter_table('blog_post_tags', schema=None) as batch_op:
+        batch_op.drop_index('ix_blog_post_tags_tag_post')
+
+    op.drop_table('blog_post_tags')
+    op.drop_table('tag')
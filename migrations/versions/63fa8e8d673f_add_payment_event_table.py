@@ -0,0 +1,47 @@
+"""add payment_event table
+
+Revision ID: 63fa8e8d673f
+Revises: 69e44bdbb40b
+Create Date: 2026-10-17 01:39:24.926821
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '63fa8e8d673f'
+down_revision = '69e44bdbb40b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('payment_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('provider', sa.String(length=20), nullable=False),
+    sa.Column('event_id', sa.String(length=255), nullable=False),
+    sa.Column('event_type', sa.String(length=100), nullable=False),
+    sa.Column('session_id', sa.String(length=255), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('occurred_at', sa.DateTime(), nullable=True),
+    sa.Column('received_at', sa.DateTime(), nullable=False),
+    sa.Column('batch_id', sa.String(length=32), nullable=True),
+    sa.Column('claimed_at', sa.DateTime(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.Column('outcome', sa.String(length=20), nullable=True),
+    sa.Column('payment_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['payment_id'], ['payment.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('payment_event', schema=None) as batch_op:
+        batch_op.create_index('ix_payment_event_provider_event', ['provider', 'event_id', 'id'], unique=False)
+        batch_op.create_index('ix_payment_event_unprocessed', ['processed_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('payment_event', schema=None) as batch_op:
+        batch_op.drop_index('ix_payment_event_unprocessed')
+        batch_op.drop_index('ix_payment_event_provider_event')
+
+    op.drop_table('payment_event')
@@ -0,0 +1,42 @@
+"""add revenue rollup tables
+
+Revision ID: 67cb3262e65a
+Revises: 783024995987
+Create Date: 2026-10-17 01:54:22.094333
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '67cb3262e65a'
+down_revision = '783024995987'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('revenue_daily',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('project_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('status', sa.Enum('PENDING', 'COMPLETED', 'FAILED', 'REFUNDED', name='paymentstatus', native_enum=False), nullable=False),
+    sa.Column('payment_count', sa.Integer(), nullable=False),
+    sa.Column('amount_minor', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'currency', 'project_id', 'status')
+    )
+    op.create_table('revenue_monthly',
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('project_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('status', sa.Enum('PENDING', 'COMPLETED', 'FAILED', 'REFUNDED', name='paymentstatus', native_enum=False), nullable=False),
+    sa.Column('payment_count', sa.Integer(), nullable=False),
+    sa.Column('amount_minor', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('month', 'currency', 'project_id', 'status')
+    )
+
+
+def downgrade():
+    op.drop_table('revenue_monthly')
+    op.drop_table('revenue_daily')
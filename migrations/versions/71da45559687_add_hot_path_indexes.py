@@ -0,0 +1,52 @@
+"""add indexes for hot query paths
+
+Revision ID: 71da45559687
+Revises: 
+Create Date: 2026-10-17 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '71da45559687'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# (table, index name, columns) — kept in sync with __table_args__ in models.py
+INDEXES = [
+    ('message', 'ix_message_recipient_read_sent', ['recipient_id', 'is_read', 'sent_at']),
+    ('message', 'ix_message_recipient_sent', ['recipient_id', 'sent_at']),
+    ('message', 'ix_message_sender_recipient_sent', ['sender_id', 'recipient_id', 'sent_at']),
+    ('project', 'ix_project_client_updated', ['client_id', 'updated_at']),
+    ('project', 'ix_project_status_updated', ['status', 'updated_at']),
+    ('project', 'ix_project_updated', ['updated_at']),
+    ('contract', 'ix_contract_client_updated', ['client_id', 'updated_at']),
+    ('contract', 'ix_contract_status', ['status']),
+    ('contract', 'ix_contract_updated', ['updated_at']),
+    ('payment', 'ix_payment_user_created', ['user_id', 'created_at']),
+    ('payment', 'ix_payment_stripe_session_id', ['stripe_session_id']),
+    ('payment', 'ix_payment_status', ['status']),
+    ('payment', 'ix_payment_created', ['created_at']),
+    ('blog_post', 'ix_blog_post_published', ['is_published', 'published_at']),
+    ('blog_post', 'ix_blog_post_published_category', ['is_published', 'category', 'published_at']),
+    ('comment', 'ix_comment_post_parent_created', ['post_id', 'parent_id', 'created_at']),
+    ('git_hub_repo', 'ix_git_hub_repo_featured_updated', ['is_featured', 'updated_at']),
+    ('git_hub_repo', 'ix_git_hub_repo_updated', ['updated_at']),
+    ('activity_log', 'ix_activity_log_created', ['created_at']),
+]
+
+
+def upgrade():
+    for table, name, columns in INDEXES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(name, columns, unique=False)
+
+
+def downgrade():
+    for table, name, columns in reversed(INDEXES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(name)
@@ -0,0 +1,28 @@
+"""index pending payments by creation time
+
+Revision ID: 783024995987
+Revises: 63fa8e8d673f
+Create Date: 2026-10-17 01:48:13.439558
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '783024995987'
+down_revision = '63fa8e8d673f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_payment_status'))
+        batch_op.create_index('ix_payment_status_created', ['status', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('payment', schema=None) as batch_op:
+        batch_op.drop_index('ix_payment_status_created')
+        batch_op.create_index(batch_op.f('ix_payment_status'), ['status'], unique=False)
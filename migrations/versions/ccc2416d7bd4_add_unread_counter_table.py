@@ -0,0 +1,34 @@
+"""add unread_counter table
+
+Revision ID: ccc2416d7bd4
+Revises: 055fa20b71d4
+Create Date: 2026-10-17 13:40:05.207113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ccc2416d7bd4'
+down_revision = '055fa20b71d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('unread_counter',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('unread_messages', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # Backfill from existing messages
+    op.execute(
+        'INSERT INTO unread_counter (user_id, unread_messages) '
+        'SELECT recipient_id, COUNT(*) FROM message WHERE is_read IS NOT TRUE GROUP BY recipient_id'
+    )
+
+
+def downgrade():
+    op.drop_table('unread_counter')
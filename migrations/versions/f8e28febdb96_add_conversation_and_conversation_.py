@@ -0,0 +1,129 @@
+"""add conversation and conversation_participant tables
+
+Revision ID: f8e28febdb96
+Revises: 266570218c5c
+Create Date: 2026-10-17 01:16:39.511980
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f8e28febdb96'
+down_revision = '266570218c5c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conversation = op.create_table('conversation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subject', sa.String(length=200), nullable=False),
+    sa.Column('root_message_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=True),
+    sa.Column('last_sender_id', sa.Integer(), nullable=True),
+    sa.Column('last_preview', sa.String(length=120), nullable=True),
+    sa.Column('last_activity_at', sa.DateTime(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['last_message_id'], ['message.id'], name='fk_conversation_last_message_id', use_alter=True),
+    sa.ForeignKeyConstraint(['last_sender_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['root_message_id'], ['message.id'], name='fk_conversation_root_message_id', use_alter=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    conversation_participant = op.create_table('conversation_participant',
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('other_user_id', sa.Integer(), nullable=False),
+    sa.Column('unread_count', sa.Integer(), nullable=False),
+    sa.Column('last_activity_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversation.id'], ),
+    sa.ForeignKeyConstraint(['other_user_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('conversation_id', 'user_id')
+    )
+    with op.batch_alter_table('conversation_participant', schema=None) as batch_op:
+        batch_op.create_index('ix_conversation_participant_user_activity', ['user_id', 'last_activity_at', 'conversation_id'], unique=False)
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('conversation_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_message_conversation_id'), ['conversation_id'], unique=False)
+        batch_op.create_foreign_key('fk_message_conversation_id', 'conversation', ['conversation_id'], ['id'])
+
+    # Group the existing messages into threads by following parent_id up to
+    # the root, then write one summary per thread
+    message = sa.table('message',
+        sa.column('id', sa.Integer), sa.column('parent_id', sa.Integer), sa.column('subject', sa.String),
+        sa.column('content', sa.Text), sa.column('sender_id', sa.Integer), sa.column('recipient_id', sa.Integer),
+        sa.column('is_read', sa.Boolean), sa.column('sent_at', sa.DateTime),
+        sa.column('conversation_id', sa.Integer))
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(
+        message.c.id, message.c.parent_id, message.c.subject, message.c.sender_id,
+        message.c.recipient_id, message.c.is_read, message.c.sent_at
+    ).order_by(message.c.sent_at, message.c.id)).all()
+    parents = {row.id: row.parent_id for row in rows}
+
+    def root_of(message_id):
+        seen = set()
+        while parents.get(message_id) in parents and message_id not in seen:
+            seen.add(message_id)
+            message_id = parents[message_id]
+        return message_id
+
+    conversations = {}
+    participants = {}
+    assignments = []
+    for row in rows:
+        root_id = root_of(row.id)
+        summary = conversations.get(root_id)
+        if summary is None:
+            summary = conversations[root_id] = {
+                'id': len(conversations) + 1, 'subject': row.subject, 'root_message_id': root_id,
+                'message_count': 0
+            }
+        summary.update(last_message_id=row.id, last_sender_id=row.sender_id,
+                       last_activity_at=row.sent_at, message_count=summary['message_count'] + 1)
+        assignments.append({'message_id': row.id, 'conversation_id': summary['id']})
+        for user_id, other_user_id in ((row.sender_id, row.recipient_id), (row.recipient_id, row.sender_id)):
+            participant = participants.setdefault((summary['id'], user_id), {
+                'conversation_id': summary['id'], 'user_id': user_id, 'other_user_id': other_user_id,
+                'unread_count': 0
+            })
+            participant['last_activity_at'] = row.sent_at
+        if not row.is_read and row.recipient_id != row.sender_id:
+            participants[(summary['id'], row.recipient_id)]['unread_count'] += 1
+
+    if not conversations:
+        return
+    previews = {}
+    last_ids = [summary['last_message_id'] for summary in conversations.values()]
+    for start in range(0, len(last_ids), 500):
+        previews.update(connection.execute(
+            sa.select(message.c.id, sa.func.substr(message.c.content, 1, 120))
+            .where(message.c.id.in_(last_ids[start:start + 500]))
+        ).all())
+    for summary in conversations.values():
+        summary['last_preview'] = previews.get(summary['last_message_id'])
+    op.bulk_insert(conversation, list(conversations.values()))
+    op.bulk_insert(conversation_participant, list(participants.values()))
+    connection.execute(
+        message.update().where(message.c.id == sa.bindparam('message_id'))
+        .values(conversation_id=sa.bindparam('conversation_id')),
+        assignments
+    )
+    if connection.dialect.name == 'postgresql':
+        op.execute("SELECT setval(pg_get_serial_sequence('conversation', 'id'), (SELECT max(id) FROM conversation))")
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_message_conversation_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_message_conversation_id'))
+        batch_op.drop_column('conversation_id')
+
+    with op.batch_alter_table('conversation_participant', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversation_participant_user_activity')
+
+    op.drop_table('conversation_participant')
+    op.drop_table('conversation')
@@ -28,6 +28,12 @@ class PaymentStatus(enum.Enum):
     FAILED = "failed"
     REFUNDED = "refunded"
 
+class JobStatus(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    DEAD = "dead"
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -53,6 +59,10 @@ class User(UserMixin, db.Model):
     blog_posts = db.relationship('BlogPost', backref='author', lazy=True)
     comments = db.relationship('Comment', backref='author', lazy=True)
     
+    __table_args__ = (
+        db.Index('ix_user_verified_created', 'is_verified', 'created_at'),
+    )
+    
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
     
@@ -81,6 +91,12 @@ class Project(db.Model):
     files = db.relationship('ProjectFile', backref='project', lazy=True, cascade='all, delete-orphan')
     milestones = db.relationship('Milestone', backref='project', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('ix_project_client_updated', 'client_id', 'updated_at'),
+        db.Index('ix_project_status_updated', 'status', 'updated_at'),
+        db.Index('ix_project_updated', 'updated_at'),
+    )
+
 class ProjectFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
@@ -117,6 +133,12 @@ class Contract(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_contract_client_updated', 'client_id', 'updated_at'),
+        db.Index('ix_contract_status', 'status'),
+        db.Index('ix_contract_updated', 'updated_at'),
+    )
+
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Float, nullable=False)
@@ -132,6 +154,54 @@ class Payment(db.Model):
     paid_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_payment_user_created', 'user_id', 'created_at'),
+        db.Index('ix_payment_stripe_session_id', 'stripe_session_id'),
+        # Also serves status-only filters; reconcile.py pages PENDING rows by (created_at, id)
+        db.Index('ix_payment_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_payment_created', 'created_at'),
+    )
+
+class PaymentEvent(db.Model):
+    # Raw gateway webhook, stored as received; webhooks.py applies it later
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(20), nullable=False)
+    event_id = db.Column(db.String(255), nullable=False)
+    event_type = db.Column(db.String(100), nullable=False)
+    session_id = db.Column(db.String(255), nullable=True)
+    payload = db.Column(db.Text, nullable=False)
+    occurred_at = db.Column(db.DateTime, nullable=True)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    batch_id = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    outcome = db.Column(db.String(20), nullable=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_payment_event_provider_event', 'provider', 'event_id', 'id'),
+        db.Index('ix_payment_event_unprocessed', 'processed_at', 'id'),
+    )
+
+class RevenueDaily(db.Model):
+    # Payment count and total per creation day, maintained by revenue.py.
+    # Amounts are integer minor units; project_id 0 means no project.
+    day = db.Column(db.Date, primary_key=True)
+    currency = db.Column(db.String(3), primary_key=True)
+    project_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    status = db.Column(db.Enum(PaymentStatus, native_enum=False), primary_key=True)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    amount_minor = db.Column(db.BigInteger, nullable=False, default=0)
+
+class RevenueMonthly(db.Model):
+    # Same as RevenueDaily per calendar month (month is its first day)
+    month = db.Column(db.Date, primary_key=True)
+    currency = db.Column(db.String(3), primary_key=True)
+    project_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    status = db.Column(db.Enum(PaymentStatus, native_enum=False), primary_key=True)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    amount_minor = db.Column(db.BigInteger, nullable=False, default=0)
+
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     subject = db.Column(db.String(200), nullable=False)
@@ -142,10 +212,83 @@ class Message(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     attachment_path = db.Column(db.String(500), nullable=True)
     sent_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Thread summary row, maintained by conversations.py
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', name='fk_message_conversation_id'),
+                                nullable=True, index=True)
     
     # Self-referential relationship for threading
     replies = db.relationship('Message', backref=db.backref('parent', remote_side=[id]), lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_message_recipient_read_sent', 'recipient_id', 'is_read', 'sent_at'),
+        db.Index('ix_message_recipient_sent', 'recipient_id', 'sent_at'),
+        db.Index('ix_message_sender_recipient_sent', 'sender_id', 'recipient_id', 'sent_at'),
+    )
+
+class Conversation(db.Model):
+    # Summary of one message thread, maintained by conversations.py
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(200), nullable=False)
+    root_message_id = db.Column(db.Integer, db.ForeignKey('message.id', use_alter=True,
+                                name='fk_conversation_root_message_id'), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('message.id', use_alter=True,
+                                name='fk_conversation_last_message_id'), nullable=True)
+    last_sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    last_preview = db.Column(db.String(120), nullable=True)
+    last_activity_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    last_sender = db.relationship('User', foreign_keys=[last_sender_id])
+
+class ConversationParticipant(db.Model):
+    # One row per user per conversation; the inbox is read from this table
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    other_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    # Copy of Conversation.last_activity_at so the inbox is one index range scan
+    last_activity_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    conversation = db.relationship('Conversation')
+    other_user = db.relationship('User', foreign_keys=[other_user_id])
+
+    __table_args__ = (
+        db.Index('ix_conversation_participant_user_activity', 'user_id', 'last_activity_at', 'conversation_id'),
+    )
+
+class UnreadCounter(db.Model):
+    # Denormalized unread-message count per user, maintained by unread.py
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    unread_messages = db.Column(db.Integer, nullable=False, default=0)
+
+blog_post_tags = db.Table(
+    'blog_post_tags',
+    db.Column('post_id', db.Integer, db.ForeignKey('blog_post.id'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    db.Index('ix_blog_post_tags_tag_post', 'tag_id', 'post_id'),
+)
+
+class Tag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+    # Published posts carrying this tag, maintained by facets.py
+    post_count = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def split(value):
+        """Normalized, de-duplicated tag names from a comma-separated string"""
+        names = []
+        for part in (value or '').split(','):
+            name = ' '.join(part.split()).lower()[:50]
+            if name and name not in names:
+                names.append(name)
+        return names
+
+class BlogCategory(db.Model):
+    # Published posts per category, maintained by facets.py
+    name = db.Column(db.String(100), primary_key=True)
+    post_count = db.Column(db.Integer, nullable=False, default=0)
+
 class BlogPost(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -164,6 +307,23 @@ class BlogPost(db.Model):
     
     # Relationships
     comments = db.relationship('Comment', backref='post', lazy=True, cascade='all, delete-orphan')
+    # Normalized copy of `tags`, kept in sync by facets.py
+    tag_list = db.relationship('Tag', secondary=blog_post_tags, lazy=True, order_by='Tag.name')
+    
+    def get_view_count(self):
+        """Stored views plus increments still buffered by counters.py"""
+        from counters import counter_buffer
+        return (self.views or 0) + counter_buffer.pending(self.id, 'views')
+    
+    def get_like_count(self):
+        """Stored likes plus increments still buffered by counters.py"""
+        from counters import counter_buffer
+        return (self.likes or 0) + counter_buffer.pending(self.id, 'likes')
+
+    __table_args__ = (
+        db.Index('ix_blog_post_published', 'is_published', 'published_at'),
+        db.Index('ix_blog_post_published_category', 'is_published', 'category', 'published_at'),
+    )
 
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -177,6 +337,10 @@ class Comment(db.Model):
     # Self-referential relationship for nested comments
     replies = db.relationship('Comment', backref=db.backref('parent', remote_side=[id]), lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_comment_post_parent_created', 'post_id', 'parent_id', 'created_at'),
+    )
+
 class GitHubRepo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -189,6 +353,11 @@ class GitHubRepo(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_git_hub_repo_featured_updated', 'is_featured', 'updated_at'),
+        db.Index('ix_git_hub_repo_updated', 'updated_at'),
+    )
+
 class ActivityLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
@@ -197,3 +366,31 @@ class ActivityLog(db.Model):
     ip_address = db.Column(db.String(45), nullable=True)
     user_agent = db.Column(db.String(500), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_activity_log_created', 'created_at'),
+    )
+
+class Job(db.Model):
+    # Background work for the jobs.py worker; DEAD jobs ran out of attempts
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.Enum(JobStatus), default=JobStatus.QUEUED, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+        db.Index('ix_job_payment', 'payment_id'),
+    )
@@ -0,0 +1,97 @@
+"""Per-user notification versions for cheap badge polling.
+
+Every change to a user's badge counts bumps that user's version. The
+version lives in a small memory-mapped file shared by all gunicorn workers
+on the host, so /api/notifications/summary can answer a matching
+If-None-Match with 304 without loading the user or querying the database.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from app import app, private_directory, state_path
+
+HEADER_SIZE = 8
+SLOT_SIZE = 4
+DEFAULT_SLOTS = 65536
+
+
+class VersionStore:
+    """Version counters keyed by an arbitrary value, stored in a shared file.
+
+    Keys hash onto a fixed number of slots; a collision only means a
+    spurious version change (an extra 200 instead of a 304), never a stale
+    one. The header holds a random generation id written when the file is
+    created, so versions from a previous file are never mistaken for
+    current ones.
+    """
+
+    def __init__(self, path, slots=DEFAULT_SLOTS):
+        # Anyone who can write the file can freeze or bump versions, so it
+        # must sit in a private directory
+        self.path = path
+        self.slots = slots
+        self._map = None
+        self._fd = None
+        self._generation = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the current version tag for `key`"""
+        self._ensure_open()
+        offset = self._offset(key)
+        (value,) = struct.unpack_from('<I', self._map, offset)
+        return f"{self._generation}.{value}"
+
+    def bump(self, key):
+        """Advance the version for `key`"""
+        self._ensure_open()
+        offset = self._offset(key)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT_SIZE, offset)
+        try:
+            (value,) = struct.unpack_from('<I', self._map, offset)
+            struct.pack_into('<I', self._map, offset, (value + 1) & 0xFFFFFFFF)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT_SIZE, offset)
+
+    def _offset(self, key):
+        return HEADER_SIZE + (zlib.crc32(str(key).encode()) % self.slots) * SLOT_SIZE
+
+    def _ensure_open(self):
+        if self._map is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._map is not None and self._pid == os.getpid():
+                return
+            size = HEADER_SIZE + self.slots * SLOT_SIZE
+            private_directory(os.path.dirname(os.path.abspath(self.path)))
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, os.urandom(HEADER_SIZE), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, size)
+            self._fd = fd
+            self._generation = self._map[:HEADER_SIZE].hex()
+            self._pid = os.getpid()
+
+
+notification_versions = VersionStore(app.config.get('NOTIFICATION_VERSION_PATH') or state_path('notify.bin'))
+
+
+def notification_etag(user_id):
+    """Return the ETag value for a user's notification summary"""
+    return f"n{user_id}-{notification_versions.get(user_id)}"
+
+
+def bump_notifications(user_id):
+    """Mark a user's badge counts as changed"""
+    if user_id is not None:
+        notification_versions.bump(int(user_id))
@@ -0,0 +1,285 @@
+"""Response cache for public pages.
+
+Anonymous visitors get rendered pages straight from a cache keyed on route,
+query string and auth state, without loading a user or touching
+SQLAlchemy. Each entry records the versions of the tags it depends on
+('blog', 'github', 'projects'). Committing a change to a tagged model bumps
+the tag in a VersionStore shared by all workers, which makes the entries
+stale. A stale entry is still served once more while the page is
+re-rendered after the response has gone out.
+
+Backends: 'memory' (per-process LRU), 'file' (JSON files in a private
+instance directory shared by every worker on the host) and 'null'
+(disabled).
+"""
+import base64
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, request, session
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import app, private_directory, state_path
+from models import BlogPost, Comment, GitHubRepo, Project
+from notifications import VersionStore
+
+logger = logging.getLogger(__name__)
+
+# Tags invalidated when rows of these models are committed
+MODEL_TAGS = {
+    BlogPost: 'blog',
+    Comment: 'blog',
+    GitHubRepo: 'github',
+    Project: 'projects',
+}
+
+
+class NullBackend:
+    """Cache backend that stores nothing"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, entry):
+        pass
+
+
+class MemoryBackend:
+    """Per-process LRU cache backend"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class FileBackend:
+    """On-disk cache backend shared by every worker on the host.
+
+    Entries are plain JSON (the body base64-encoded), so a file is only
+    ever read back as data.
+    """
+
+    def __init__(self, directory, max_age=3600):
+        self.directory = directory
+        self.max_age = max_age
+        self._writes = 0
+        self._checked = False
+
+    def _path(self, key):
+        # Every entry access starts here; the directory is made on first use
+        if not self._checked:
+            private_directory(self.directory)
+            self._checked = True
+        return os.path.join(self.directory, '%08x.json' % zlib.crc32(key.encode()))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as handle:
+                entry = json.load(handle)
+            # Different keys can share a file name; never serve the wrong page
+            if entry['key'] != key:
+                return None
+            entry['tags'] = tuple(entry['tags'])
+            entry['headers'] = [tuple(header) for header in entry['headers']]
+            entry['body'] = base64.b64decode(entry['body'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return entry
+
+    def set(self, key, entry):
+        data = {**entry, 'body': base64.b64encode(entry['body']).decode('ascii')}
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as handle:
+                json.dump(data, handle, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Failed to write page cache entry")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def prune(self):
+        """Remove entries nobody has rewritten within max_age"""
+        cutoff = time.time() - self.max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+
+class PageCache:
+    """Cache rendered pages for anonymous visitors"""
+
+    def __init__(self, app=None):
+        self.ttl = 60
+        self.stale_ttl = 300
+        self.backend = NullBackend()
+        self.tag_versions = None
+        self._app = None
+        self._revalidating = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.ttl = app.config.get('PAGE_CACHE_TTL', self.ttl)
+        self.stale_ttl = app.config.get('PAGE_CACHE_STALE_TTL', self.stale_ttl)
+        backend = app.config.get('PAGE_CACHE_BACKEND', 'memory')
+        if backend == 'file':
+            directory = app.config.get('PAGE_CACHE_DIR') or os.path.join(app.instance_path, 'pages')
+            self.backend = FileBackend(directory, max_age=self.ttl + self.stale_ttl)
+        elif backend == 'memory':
+            self.backend = MemoryBackend(app.config.get('PAGE_CACHE_MAX_ENTRIES', 512))
+        else:
+            self.backend = NullBackend()
+        self.tag_versions = VersionStore(state_path('page_tags.bin'), slots=64)
+
+    def invalidate(self, *tags):
+        """Mark every entry depending on any of `tags` as stale"""
+        for tag in tags:
+            self.tag_versions.bump(tag)
+
+    def cached(self, tags=()):
+        """Decorator for views whose anonymous output can be shared"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self._cacheable_request():
+                    return view(*args, **kwargs)
+
+                key = self._key()
+                tag_state = self._tag_state(tags)
+                entry = None if g.get('_page_cache_refresh') else self.backend.get(key)
+                if entry is not None:
+                    age = time.time() - entry['created']
+                    fresh = age < self.ttl and entry['tags'] == tag_state
+                    if fresh:
+                        return self._response(entry, 'HIT')
+                    if age < self.ttl + self.stale_ttl:
+                        response = self._response(entry, 'STALE')
+                        self._schedule_revalidation(response, key)
+                        return response
+
+                # Tag versions are read before rendering, so a change that
+                # commits mid-render leaves the entry stale, not wrongly fresh
+                response = self._app.make_response(view(*args, **kwargs))
+                self._store(key, tag_state, response)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+    def _cacheable_request(self):
+        if request.method != 'GET':
+            return False
+        # Signed-in visitors (or ones about to be, via remember-me) and
+        # pending flash messages get a freshly rendered page
+        if session.get('_user_id') is not None or '_flashes' in session:
+            return False
+        return self._app.config.get('REMEMBER_COOKIE_NAME', 'remember_token') not in request.cookies
+
+    @staticmethod
+    def _key():
+        query = '&'.join(f"{name}={value}" for name, value in sorted(request.args.items(multi=True)))
+        return f"anon:{request.path}?{query}"
+
+    def _tag_state(self, tags):
+        return tuple(self.tag_versions.get(tag) for tag in tags)
+
+    def _store(self, key, tag_state, response):
+        if response.status_code != 200 or response.mimetype != 'text/html':
+            return
+        if 'Set-Cookie' in response.headers or response.is_streamed:
+            return
+        self.backend.set(key, {
+            'key': key,
+            'created': time.time(),
+            'tags': tag_state,
+            'status': response.status_code,
+            'headers': [(name, value) for name, value in response.headers if name.lower() != 'content-length'],
+            'body': response.get_data()
+        })
+
+    def _response(self, entry, state):
+        response = self._app.response_class(entry['body'], status=entry['status'], headers=entry['headers'])
+        response.headers['X-Cache'] = state
+        # Honour the validators the view set when the entry was rendered
+        return response.make_conditional(request)
+
+    def _schedule_revalidation(self, response, key):
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+        path, query_string = request.path, request.query_string
+
+        def revalidate():
+            try:
+                with self._app.test_request_context(path, query_string=query_string):
+                    g._page_cache_refresh = True
+                    self._app.full_dispatch_request()
+            except Exception:
+                logger.exception("Page cache revalidation failed for %s", key)
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        # Re-render after the stale body has been sent to the client
+        response.call_on_close(revalidate)
+
+
+page_cache = PageCache(app)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_tagged_changes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        tag = MODEL_TAGS.get(type(obj))
+        if tag:
+            session.info.setdefault('page_cache_tags', set()).add(tag)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_tagged_pages(session):
+    tags = session.info.pop('page_cache_tags', None)
+    if tags:
+        page_cache.invalidate(*tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_tagged_changes(session):
+    session.info.pop('page_cache_tags', None)
@@ -1,20 +1,18 @@
 from flask import Blueprint, request, jsonify, redirect, url_for, current_app
-import requests
 import os
 from app import db
+from checkout import queue_thawani_checkout
 from models import Payment, User, Project, Contract, Milestone, PaymentStatus
-from datetime import datetime
+from revenue import record_payment
+from webhooks import ingest_event, move_payment
 
 payment_bp = Blueprint('payment', __name__)
 
-THAWANI_API_KEY = os.environ.get('THAWANI_API_KEY')
 THAWANI_MERCHANT_CODE = os.environ.get('THAWANI_MERCHANT_CODE')
 THAWANI_SUCCESS_URL = os.environ.get('THAWANI_SUCCESS_URL')
 THAWANI_CANCEL_URL = os.environ.get('THAWANI_CANCEL_URL')
 THAWANI_WEBHOOK_URL = os.environ.get('THAWANI_WEBHOOK_URL')
 
-THAWANI_API_BASE_URL = "https://uatcheckout.thawani.om/api/v1"
-
 @payment_bp.route('/create-checkout-session', methods=['POST'])
 def create_checkout_session():
     data = request.get_json()
@@ -40,12 +38,8 @@ def create_checkout_session():
         status=PaymentStatus.PENDING
     )
     db.session.add(new_payment)
-    db.session.commit()
-
-    headers = {
-        'Content-Type': 'application/json',
-        'thawani-api-key': THAWANI_API_KEY
-    }
+    db.session.flush()
+    record_payment(new_payment)
 
     payload = {
         "client_reference_id": str(new_payment.id),
@@ -64,31 +58,25 @@ def create_checkout_session():
         }
     }
 
-    try:
-        response = requests.post(f"{THAWANI_API_BASE_URL}/checkout/session", headers=headers, json=payload)
-        response.raise_for_status()
-        checkout_data = response.json()
-
-        if checkout_data.get('success') and checkout_data.get('data', {}).get('session_id'):
-            new_payment.stripe_session_id = checkout_data['data']['session_id'] # Reusing stripe_session_id for Thawani session_id
-            db.session.commit()
-            return jsonify({'session_id': checkout_data['data']['session_id'], 'checkout_url': checkout_data['data']['checkout_url']})
-        else:
-            current_app.logger.error(f"Thawani checkout session creation failed: {checkout_data.get('description')}")
-            return jsonify({'error': checkout_data.get('description', 'Failed to create Thawani checkout session')}), 500
-    except requests.exceptions.RequestException as e:
-        current_app.logger.error(f"Request to Thawani API failed: {e}")
-        return jsonify({'error': 'Failed to connect to payment gateway'}), 500
+    # The job worker calls the gateway; the client polls status_url (or
+    # listens for `job_status` on /api/stream) for the checkout URL
+    job = queue_thawani_checkout(new_payment, payload)
+    db.session.commit()
+    return jsonify({
+        'payment_id': new_payment.id,
+        'job_id': job.id,
+        'status': job.status.value,
+        'status_url': url_for('main.api_job', job_id=job.id)
+    }), 202
 
 @payment_bp.route('/payment/success', methods=['GET'])
 def payment_success():
     session_id = request.args.get('session_id')
     payment = Payment.query.filter_by(stripe_session_id=session_id).first()
     if payment:
-        payment.status = PaymentStatus.COMPLETED
-        payment.paid_at = datetime.utcnow()
-        db.session.commit()
-        return jsonify({'message': 'Payment successful', 'payment_id': payment.id})
+        if move_payment(payment, PaymentStatus.COMPLETED):
+            return jsonify({'message': 'Payment successful', 'payment_id': payment.id})
+        return jsonify({'message': f'Payment is already {payment.status.value}', 'payment_id': payment.id})
     return jsonify({'error': 'Payment not found'}), 404
 
 @payment_bp.route('/payment/cancel', methods=['GET'])
@@ -96,30 +84,20 @@ def payment_cancel():
     session_id = request.args.get('session_id')
     payment = Payment.query.filter_by(stripe_session_id=session_id).first()
     if payment:
-        payment.status = PaymentStatus.FAILED
-        db.session.commit()
-        return jsonify({'message': 'Payment cancelled', 'payment_id': payment.id})
+        if move_payment(payment, PaymentStatus.FAILED):
+            return jsonify({'message': 'Payment cancelled', 'payment_id': payment.id})
+        return jsonify({'message': f'Payment is already {payment.status.value}', 'payment_id': payment.id})
     return jsonify({'error': 'Payment not found'}), 404
 
 @payment_bp.route('/payment/webhook', methods=['POST'])
 def payment_webhook():
-    data = request.get_json()
-    event_type = data.get('event_type')
-    session_id = data.get('data', {}).get('session_id')
-
-    if event_type == 'checkout.success' and session_id:
-        payment = Payment.query.filter_by(stripe_session_id=session_id).first()
-        if payment:
-            payment.status = PaymentStatus.COMPLETED
-            payment.paid_at = datetime.utcnow()
-            db.session.commit()
-            current_app.logger.info(f"Webhook: Payment {payment.id} updated to COMPLETED.")
-            return jsonify({'status': 'success'}), 200
-    
-    current_app.logger.warning(f"Webhook: Unhandled event type {event_type} or missing session_id.")
-    return jsonify({'status': 'ignored'}), 200
-
-
+    # Store and acknowledge only; the job worker applies events in batches
+    try:
+        ingest_event(request.get_data())
+    except ValueError:
+        current_app.logger.warning("Webhook: ignoring a body that is not a JSON object.")
+        return jsonify({'status': 'invalid'}), 400
+    return jsonify({'status': 'accepted'}), 200
 
 
 @payment_bp.route('/payment/checkout')
@@ -0,0 +1,265 @@
+"""Settle payments left PENDING by asking the gateway what happened.
+
+A payment only leaves PENDING through the success/cancel redirects or a
+webhook, so a customer who closes the tab (or a webhook that never
+arrives) leaves it pending for good. reconcile_payments() walks the
+pending payments oldest first, in pages keyed on (created_at, id):
+
+* the page is read in its own short transaction;
+* the checkout sessions are fetched concurrently, RECONCILE_WORKERS at a
+  time, through the pooled gateway client (and the Stripe SDK for Stripe
+  sessions), with no transaction open;
+* the results are applied in one transaction per page with
+  webhooks.move_payments(), so a payment a webhook has moved in the
+  meantime is left alone;
+* the position is saved to a checkpoint file, so an interrupted run over
+  years of history resumes where it stopped.
+
+`flask payments reconcile` runs it; `--dry-run` fetches and reports
+without writing anything.
+"""
+import json
+import logging
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, select
+
+from app import app, db, private_directory, state_path
+from checkout import stripe_sdk
+from gateway import GatewayError, GatewayUnavailable, thawani
+from models import Job, JobStatus, Payment, PaymentStatus
+from utils import decode_cursor, encode_cursor
+from webhooks import announce_moves, move_payments, parse_time
+
+logger = logging.getLogger(__name__)
+
+# Stripe checkout session ids; the same column holds Thawani session ids
+STRIPE_SESSION_PREFIX = 'cs_'
+
+# What the gateway says about a checkout session
+PAID = 'paid'
+CANCELLED = 'cancelled'
+EXPIRED = 'expired'
+UNPAID = 'unpaid'
+MISSING = 'missing'
+ERROR = 'error'
+# No session was ever stored: the checkout job died, or is still running
+NO_SESSION = 'no_session'
+CREATING = 'creating'
+
+# Actions taken on a payment, and the status each one sets
+ACTIONS = {
+    'completed': PaymentStatus.COMPLETED,
+    'failed': PaymentStatus.FAILED,
+    'abandoned': PaymentStatus.FAILED,
+    'open': None,
+    'unknown': None,
+}
+
+SAMPLE_SIZE = 20
+
+
+class ReconcileAborted(Exception):
+    """The gateway stopped answering; the checkpoint still points at the unfinished page"""
+
+
+def _thawani_session(session_id):
+    try:
+        data = thawani.get_checkout_session(session_id)
+    except GatewayError as e:
+        if isinstance(e, GatewayUnavailable):
+            raise
+        return MISSING if e.status == 404 else ERROR
+    status = (data.get('payment_status') or '').lower()
+    if status in (PAID, CANCELLED, EXPIRED):
+        return status
+    expire_at = parse_time(data.get('expire_at'))
+    if expire_at is not None and expire_at < datetime.utcnow():
+        return EXPIRED
+    return UNPAID
+
+
+def _stripe_session(session_id):
+    stripe = stripe_sdk()
+    try:
+        session = stripe.checkout.Session.retrieve(session_id)
+    except stripe.InvalidRequestError as e:
+        return MISSING if e.http_status == 404 else ERROR
+    except stripe.StripeError:
+        return ERROR
+    if session.payment_status in ('paid', 'no_payment_required'):
+        return PAID
+    if session.status == 'expired':
+        return EXPIRED
+    return UNPAID
+
+
+def session_state(session_id):
+    """PAID, CANCELLED, EXPIRED, UNPAID, MISSING or ERROR for one checkout session.
+
+    Raises GatewayUnavailable while the Thawani circuit is open.
+    """
+    if session_id.startswith(STRIPE_SESSION_PREFIX):
+        return _stripe_session(session_id)
+    return _thawani_session(session_id)
+
+
+def decide(state, created_at, abandon_before):
+    """The action for a pending payment whose session is in `state`"""
+    if state == PAID:
+        return 'completed'
+    if state in (CANCELLED, EXPIRED):
+        return 'failed'
+    if state in (UNPAID, NO_SESSION):
+        # Nobody is coming back to pay this one
+        return 'abandoned' if created_at < abandon_before else 'open'
+    if state == CREATING:
+        return 'open'
+    return 'unknown'
+
+
+class Checkpoint:
+    """Position of the last finished page, kept in a small JSON file"""
+
+    def __init__(self, path=None):
+        self.path = path or app.config.get('RECONCILE_CHECKPOINT_PATH') or state_path('reconcile.json')
+
+    def load(self):
+        # The checkpoint decides which payments are settled, so only one
+        # kept in a private directory is trusted
+        private_directory(os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, state):
+        temporary = f"{self.path}.tmp"
+        private_directory(os.path.dirname(os.path.abspath(self.path)))
+        with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600), 'w') as f:
+            json.dump(state, f)
+        os.replace(temporary, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _pending_page(after, created_before, batch_size):
+    criteria = [Payment.status == PaymentStatus.PENDING, Payment.created_at < created_before]
+    if after is not None:
+        created_at, payment_id = after
+        criteria.append(or_(Payment.created_at > created_at,
+                            and_(Payment.created_at == created_at, Payment.id > payment_id)))
+    return db.session.execute(
+        select(Payment.id, Payment.stripe_session_id, Payment.user_id, Payment.created_at)
+        .where(*criteria).order_by(Payment.created_at, Payment.id).limit(batch_size)
+    ).all()
+
+
+def _awaiting_checkout(payment_ids):
+    """Payments among `payment_ids` whose checkout job may still create a session"""
+    if not payment_ids:
+        return set()
+    return set(db.session.execute(
+        select(Job.payment_id).where(Job.payment_id.in_(payment_ids),
+                                     Job.status.in_((JobStatus.QUEUED, JobStatus.RUNNING)))
+    ).scalars())
+
+
+def reconcile_payments(batch_size=None, workers=None, min_age=None, abandon_after=None, dry_run=False,
+                       max_pages=None, checkpoint=None, restart=False):
+    """Settle pending payments from their checkout sessions; returns a report dict.
+
+    Only payments older than `min_age` seconds are looked at, so checkouts
+    in progress are not touched; unpaid ones older than `abandon_after`
+    seconds are marked FAILED. Stops after `max_pages` pages if given,
+    leaving the checkpoint for the next run; a run that reaches the end
+    clears it. With `dry_run` nothing is written, the checkpoint included.
+    """
+    batch_size = batch_size or app.config['RECONCILE_BATCH_SIZE']
+    workers = workers or app.config['RECONCILE_WORKERS']
+    min_age = app.config['RECONCILE_MIN_AGE'] if min_age is None else min_age
+    abandon_after = app.config['RECONCILE_ABANDON_AFTER'] if abandon_after is None else abandon_after
+    checkpoint = checkpoint or Checkpoint()
+    if restart and not dry_run:
+        checkpoint.clear()
+    saved = {} if restart else checkpoint.load()
+    after = decode_cursor(saved.get('cursor'))
+
+    now = datetime.utcnow()
+    created_before = now - timedelta(seconds=min_age)
+    abandon_before = now - timedelta(seconds=abandon_after)
+    report = {
+        'resumed_from': after[0].isoformat() if after else None,
+        'scanned': 0,
+        'pages': 0,
+        'actions': Counter(),
+        'states': Counter(),
+        'changed': 0,
+        'samples': [],
+        'finished': False,
+    }
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reconcile') as executor:
+        while max_pages is None or report['pages'] < max_pages:
+            rows = _pending_page(after, created_before, batch_size)
+            awaiting = _awaiting_checkout([row.id for row in rows if not row.stripe_session_id])
+            # Nothing is held open while the gateway is called
+            db.session.rollback()
+            if not rows:
+                report['finished'] = True
+                break
+
+            with_session = [row for row in rows if row.stripe_session_id]
+            try:
+                states = dict(zip((row.id for row in with_session),
+                                  executor.map(session_state, (row.stripe_session_id for row in with_session))))
+            except GatewayUnavailable as e:
+                raise ReconcileAborted(str(e)) from e
+
+            moves = defaultdict(dict)  # target status -> {payment id: time}
+            owners = {}
+            for row in rows:
+                if row.stripe_session_id:
+                    state = states[row.id]
+                else:
+                    state = CREATING if row.id in awaiting else NO_SESSION
+                action = decide(state, row.created_at, abandon_before)
+                report['states'][state] += 1
+                report['actions'][action] += 1
+                if ACTIONS[action] is not None:
+                    moves[ACTIONS[action]][row.id] = now
+                    owners[row.id] = row.user_id
+                    if len(report['samples']) < SAMPLE_SIZE:
+                        report['samples'].append({'payment_id': row.id, 'session_id': row.stripe_session_id,
+                                                  'created_at': row.created_at.isoformat(),
+                                                  'state': state, 'action': action})
+
+            after = (rows[-1].created_at, rows[-1].id)
+            if not dry_run:
+                report['changed'] += move_payments(moves)
+                db.session.commit()
+                announce_moves(moves, owners)
+                checkpoint.save({
+                    'cursor': encode_cursor(*after),
+                    'started_at': saved.get('started_at') or now.isoformat(),
+                    'updated_at': datetime.utcnow().isoformat(),
+                })
+            report['scanned'] += len(rows)
+            report['pages'] += 1
+            logger.info("Reconciled %d pending payments up to %s: %s", report['scanned'],
+                        after[0].isoformat(), dict(report['actions']))
+            if len(rows) < batch_size:
+                report['finished'] = True
+                break
+
+    if report['finished'] and not dry_run:
+        checkpoint.clear()
+    return report
@@ -0,0 +1,281 @@
+"""Revenue rollups: payment counts and totals per day and per month.
+
+revenue_daily and revenue_monthly hold, for each (period, currency,
+project, status), how many payments there are and their total in integer
+minor units (baisa for OMR, cents for USD). Sums are exact, and a report
+over years of payments reads a few hundred rollup rows instead of every
+payment. Both tables change in the same transaction as the payments:
+
+* record_payment() when a payment is created;
+* webhooks.move_payments() for every status change (webhook processing,
+  reconciliation and the payment views), which only moves a payment
+  forward through STATUS_RANK.
+
+A payment counts towards the day (UTC) it was created, so a status change
+moves it between status buckets of that same day. `flask reports
+backfill-revenue` rebuilds the tables from Payment. revenue_report()
+answers any date range with whole months from revenue_monthly and the
+days at either end from revenue_daily.
+"""
+import math
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from sqlalchemy import BigInteger, Date, case, cast, delete, func, insert, select, update
+
+from app import db
+from models import Payment, PaymentStatus, RevenueDaily, RevenueMonthly
+
+# ISO 4217 minor unit digits where they are not 2
+CURRENCY_EXPONENTS = {
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0,
+    'PYG': 0, 'RWF': 0, 'UGX': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+}
+DEFAULT_CURRENCY = 'USD'  # Payment.currency's column default
+NO_PROJECT = 0
+
+REPORT_GROUPS = ('day', 'month', 'currency', 'project', 'status')
+
+
+def currency_exponent(currency):
+    return CURRENCY_EXPONENTS.get(currency or DEFAULT_CURRENCY, 2)
+
+
+def to_minor_units(amount, currency):
+    """A Payment.amount as an integer in the currency's minor unit.
+
+    Rounds half away from zero like SQL ROUND(), which the backfill uses,
+    so both paths count a payment the same.
+    """
+    scaled = (amount or 0.0) * 10 ** currency_exponent(currency)
+    return int(math.copysign(math.floor(abs(scaled) + 0.5), scaled))
+
+
+def from_minor_units(amount_minor, currency):
+    """Exact Decimal amount in the major unit"""
+    return Decimal(amount_minor).scaleb(-currency_exponent(currency))
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+# Each rollup table with its period column and how a day maps onto it
+ROLLUPS = (
+    (RevenueDaily.__table__, 'day', lambda day: day),
+    (RevenueMonthly.__table__, 'month', _month_start),
+)
+
+
+def adjust_revenue(changes):
+    """Apply payment changes to the rollups in the current transaction.
+
+    `changes` are (created_at, currency, project_id, status, amount, sign)
+    tuples: sign 1 counts a payment in, -1 takes it out again.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for created_at, currency, project_id, status, amount, sign in changes:
+        if created_at is None:
+            continue
+        currency = currency or DEFAULT_CURRENCY
+        delta = deltas[(created_at.date(), currency, project_id or NO_PROJECT, status)]
+        delta[0] += sign
+        delta[1] += sign * to_minor_units(amount, currency)
+
+    for table, period, period_of in ROLLUPS:
+        rows = defaultdict(lambda: [0, 0])
+        for (day, currency, project_id, status), (count, amount_minor) in deltas.items():
+            row = rows[(period_of(day), currency, project_id, status)]
+            row[0] += count
+            row[1] += amount_minor
+        rows = [{period: key[0], 'currency': key[1], 'project_id': key[2], 'status': key[3],
+                 'payment_count': count, 'amount_minor': amount_minor}
+                for key, (count, amount_minor) in rows.items() if count or amount_minor]
+        if rows:
+            _add_rows(table, period, rows)
+
+
+def _add_rows(table, period, rows):
+    key = [table.c[period], table.c.currency, table.c.project_id, table.c.status]
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        # Imported here: the PostgreSQL dialect package is slow to load
+        from sqlalchemy.dialects import postgresql, sqlite
+        dialect_insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = dialect_insert(table)
+        statement = statement.on_conflict_do_update(index_elements=key, set_={
+            'payment_count': table.c.payment_count + statement.excluded.payment_count,
+            'amount_minor': table.c.amount_minor + statement.excluded.amount_minor,
+        })
+        db.session.execute(statement, rows)
+        return
+
+    for row in rows:
+        result = db.session.execute(
+            update(table).where(*(column == row[column.name] for column in key))
+            .values(payment_count=table.c.payment_count + row['payment_count'],
+                    amount_minor=table.c.amount_minor + row['amount_minor'])
+        )
+        if result.rowcount == 0:
+            db.session.execute(insert(table).values(**row))
+
+
+def record_payment(payment):
+    """Count a newly created (flushed) payment in the rollups"""
+    adjust_revenue([(payment.created_at, payment.currency, payment.project_id, payment.status,
+                     payment.amount, 1)])
+
+
+def rebuild_revenue(since=None, until=None, session=None):
+    """Recompute the rollups for every month from `since` to `until` (dates) from Payment.
+
+    Each month is rebuilt and committed on its own, so the rollup tables
+    are only locked for one month's aggregate at a time. Without dates,
+    covers all payments. Returns how many payments were counted.
+    """
+    session = session or db.session
+    if since is None or until is None:
+        first, last = session.execute(select(func.min(Payment.created_at), func.max(Payment.created_at))).one()
+        if first is None:
+            return 0
+        since = since or first.date()
+        until = until or last.date()
+
+    currency = func.coalesce(Payment.currency, DEFAULT_CURRENCY)
+    factor = case({code: 10 ** exponent for code, exponent in CURRENCY_EXPONENTS.items()},
+                  value=currency, else_=100)
+    day = func.date(Payment.created_at, type_=Date)
+    project_id = func.coalesce(Payment.project_id, NO_PROJECT)
+    daily, monthly = RevenueDaily.__table__, RevenueMonthly.__table__
+
+    counted = 0
+    month = _month_start(since)
+    while month <= until:
+        next_month = _next_month(month)
+        # Deleting first takes the write lock before the payments are read
+        session.execute(delete(daily).where(daily.c.day >= month, daily.c.day < next_month))
+        session.execute(delete(monthly).where(monthly.c.month == month))
+        rows = session.execute(
+            select(day, currency, project_id, Payment.status, func.count(),
+                   func.sum(cast(func.round(Payment.amount * factor), BigInteger)))
+            .where(Payment.created_at >= datetime.combine(month, time()),
+                   Payment.created_at < datetime.combine(next_month, time()))
+            .group_by(day, currency, project_id, Payment.status)
+        ).all()
+        if rows:
+            session.execute(insert(daily), [{
+                'day': row[0], 'currency': row[1], 'project_id': row[2], 'status': row[3],
+                'payment_count': row[4], 'amount_minor': row[5] or 0,
+            } for row in rows])
+            totals = defaultdict(lambda: [0, 0])
+            for _, row_currency, row_project, status, count, amount_minor in rows:
+                total = totals[(row_currency, row_project, status)]
+                total[0] += count
+                total[1] += amount_minor or 0
+            session.execute(insert(monthly), [{
+                'month': month, 'currency': key[0], 'project_id': key[1], 'status': key[2],
+                'payment_count': count, 'amount_minor': amount_minor,
+            } for key, (count, amount_minor) in totals.items()])
+        session.commit()
+        counted += sum(row[4] for row in rows)
+        month = next_month
+    return counted
+
+
+def _split_range(start, end):
+    """(day ranges, month range or None) that together cover start..end.
+
+    Calendar months wholly inside the range come from the monthly rollup,
+    the days before and after them from the daily one.
+    """
+    first_month = start if start.day == 1 else _next_month(start)
+    after_last_month = _month_start(end + timedelta(days=1))
+    if first_month >= after_last_month:
+        return [(start, end)], None
+    days = []
+    if start < first_month:
+        days.append((start, first_month - timedelta(days=1)))
+    if after_last_month <= end:
+        days.append((after_last_month, end))
+    return days, (first_month, _month_start(after_last_month - timedelta(days=1)))
+
+
+def revenue_report(start, end, group_by=('currency', 'status'), currencies=None, statuses=None,
+                   project_id=None, session=None):
+    """Payment counts and totals for payments created from `start` to `end` (inclusive dates).
+
+    `group_by` takes names from REPORT_GROUPS. Rows are always split by
+    currency as well, since amounts in different currencies do not add up;
+    `totals` has one entry per currency. Amounts are exact decimal strings.
+    """
+    session = session or db.session
+    group_by = [name for name in REPORT_GROUPS if name in group_by or name == 'currency']
+    if 'day' in group_by:
+        days, months = [(start, end)], None
+    else:
+        days, months = _split_range(start, end)
+
+    merged = defaultdict(lambda: [0, 0])
+    sources = [(RevenueDaily.__table__, 'day', day_range) for day_range in days]
+    if months:
+        sources.append((RevenueMonthly.__table__, 'month', months))
+    for table, period, (first, last) in sources:
+        columns = {
+            'day': table.c[period], 'month': table.c[period], 'currency': table.c.currency,
+            'project': table.c.project_id, 'status': table.c.status,
+        }
+        # Daily rows are grouped by day, then folded into months below
+        dimensions = [columns[name].label(name) for name in group_by]
+        criteria = [table.c[period] >= first, table.c[period] <= last]
+        if currencies:
+            criteria.append(table.c.currency.in_(currencies))
+        if statuses:
+            criteria.append(table.c.status.in_(statuses))
+        if project_id is not None:
+            criteria.append(table.c.project_id == project_id)
+        for row in session.execute(
+            select(*dimensions, func.sum(table.c.payment_count), func.sum(table.c.amount_minor))
+            .where(*criteria).group_by(*dimensions)
+        ):
+            key = tuple(_month_start(row[index]) if name == 'month' else row[index]
+                        for index, name in enumerate(group_by))
+            merged[key][0] += row[-2]
+            merged[key][1] += row[-1]
+
+    rows = []
+    totals = defaultdict(lambda: [0, 0])
+    for key in sorted(merged, key=lambda key: [value.value if isinstance(value, PaymentStatus) else value
+                                               for value in key]):
+        count, amount_minor = merged[key]
+        if not count and not amount_minor:
+            continue
+        row = dict(zip(group_by, key))
+        for name in ('day', 'month'):
+            if name in row:
+                row[name] = row[name].isoformat()
+        if 'project' in row:
+            row['project'] = row['project'] or None
+        if 'status' in row:
+            row['status'] = row['status'].value
+        row.update(count=count, amount_minor=amount_minor,
+                   amount=str(from_minor_units(amount_minor, row['currency'])))
+        rows.append(row)
+        total = totals[row['currency']]
+        total[0] += count
+        total[1] += amount_minor
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'group_by': group_by,
+        'rows': rows,
+        'totals': {currency: {'count': count, 'amount_minor': amount_minor,
+                              'amount': str(from_minor_units(amount_minor, currency))}
+                   for currency, (count, amount_minor) in sorted(totals.items())},
+    }
@@ -1,19 +1,42 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, send_from_directory
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, send_from_directory, session, make_response, Response, abort
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
+import json
 import os
-import stripe
-from datetime import datetime
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import case, false, func, select
+from sqlalchemy.orm import aliased, joinedload, selectinload
 from app import app, db
+from checkout import queue_stripe_checkout
+from comments import load_comment_tree
+from conditional import conditional
+from conversations import (adjust_conversation_unread, get_participant, list_conversations, load_thread,
+                           mark_conversation_read, record_message)
+from counters import counter_buffer
+from events import broker
+from facets import get_blog_facets
+from jobs import job_state, queue_summary, requeue_job
 from models import *
-from utils import admin_required, log_activity, allowed_file
-
-# Configure Stripe
-stripe.api_key = app.config['STRIPE_SECRET_KEY']
+from notifications import bump_notifications, notification_etag
+from page_cache import page_cache
+from revenue import REPORT_GROUPS, revenue_report
+from search import search_posts
+from stats import get_admin_stats
+from unread import adjust_unread, get_unread_count, mark_read
+from utils import admin_required, log_activity, allowed_file, keyset_paginate
+from webhooks import move_payment
 
 main_bp = Blueprint('main', __name__)
 
+# Rows per page for the keyset-paginated list views
+LIST_PAGE_SIZE = 25
+# Top-level comment threads per blog post page
+COMMENT_THREADS_PER_PAGE = 20
+UNVERIFIED_PAGE_SIZE = 10
+
 @main_bp.route('/')
+@page_cache.cached(tags=('blog', 'github'))
 def index():
     if current_user.is_authenticated:
         if current_user.role == UserRole.ADMIN:
@@ -44,34 +67,85 @@ def dashboard():
 @login_required
 @admin_required
 def admin():
-    # Get admin dashboard statistics
-    total_users = User.query.count()
-    total_projects = Project.query.count()
-    active_contracts = Contract.query.filter_by(status=ContractStatus.ACTIVE).count()
-    pending_payments = Payment.query.filter_by(status=PaymentStatus.PENDING).count()
+    # Get admin dashboard statistics (single query, cached briefly)
+    stats = get_admin_stats()
     
     # Recent activity
     recent_activities = ActivityLog.query.order_by(ActivityLog.created_at.desc()).limit(10).all()
-    unverified_users = User.query.filter_by(is_verified=False).all()
+    unverified_users = keyset_paginate(User.query.filter_by(is_verified=False), User.created_at, User.id,
+                                       cursor=request.args.get('unverified_cursor'), per_page=UNVERIFIED_PAGE_SIZE)
     
-    stats = {
-        'total_users': total_users,
-        'total_projects': total_projects,
-        'active_contracts': active_contracts,
-        'pending_payments': pending_payments
-    }
+    dead_jobs = Job.query.filter_by(status=JobStatus.DEAD).order_by(Job.updated_at.desc()).limit(5).all()
     
-    return render_template('admin.html', stats=stats, activities=recent_activities, unverified_users=unverified_users)
+    return render_template('admin.html', stats=stats, activities=recent_activities, unverified_users=unverified_users,
+                           job_queue=queue_summary(), dead_jobs=dead_jobs)
+
+def _scope_validators(model, query, *related):
+    """Newest updated_at and row count of a list view's scope.
+
+    `related` are single-value selects over the rows of other tables the
+    page renders (clients, files...); their values join the row count in
+    the ETag.
+    """
+    last_modified, count = query.with_entities(func.max(model.updated_at), func.count(model.id)).order_by(None).one()
+    if not related:
+        return last_modified, count
+    values = db.session.execute(select(*(statement.scalar_subquery() for statement in related))).one()
+    return last_modified, (count, *values)
+
+def _page_validators(query, sort_column, id_column, columns=(), related=lambda ids: ()):
+    """Validators for just the rows of the keyset page being requested.
+
+    Reads the page's keys (plus `columns`) with the same index seek the
+    view will use, and `related(ids)` single-value selects over the rows of
+    other tables those rows render, so the cost follows the page size
+    rather than the size of the viewer's scope.
+    """
+    page = keyset_paginate(query.order_by(None).with_entities(id_column, sort_column, *columns),
+                           sort_column, id_column, cursor=request.args.get('cursor'), per_page=LIST_PAGE_SIZE)
+    rows = [tuple(row) for row in page]
+    last_modified = max(filter(None, (row[1] for row in rows)), default=None)
+    statements = related([row[0] for row in rows]) if rows else ()
+    values = db.session.execute(select(*(statement.scalar_subquery() for statement in statements))).one() \
+        if statements else ()
+    return last_modified, (rows, page.next_cursor, *values)
+
+def _project_validators():
+    # The list shows file names, milestone progress, the client's name and
+    # which deadlines have passed
+    def related(project_ids):
+        client_ids = select(Project.client_id).where(Project.id.in_(project_ids))
+        return (
+            select(func.count(ProjectFile.id)).where(ProjectFile.project_id.in_(project_ids)),
+            select(func.max(ProjectFile.id)).where(ProjectFile.project_id.in_(project_ids)),
+            select(func.count(Milestone.id)).where(Milestone.project_id.in_(project_ids)),
+            select(func.max(Milestone.id)).where(Milestone.project_id.in_(project_ids)),
+            select(func.sum(case((Milestone.is_completed, 1), else_=0))).where(Milestone.project_id.in_(project_ids)),
+            select(func.max(User.updated_at)).where(User.id.in_(client_ids)),
+        )
+    return _page_validators(_projects_query(), Project.updated_at, Project.id,
+                            columns=[(Project.deadline < datetime.utcnow()).label('overdue')], related=related)
 
 @main_bp.route('/projects')
 @login_required
+@conditional(_project_validators)
 def projects():
+    page = keyset_paginate(_projects_query(), Project.updated_at, Project.id,
+                           cursor=request.args.get('cursor'), per_page=LIST_PAGE_SIZE)
+    return render_template('projects.html', projects=page, now=datetime.utcnow())
+
+def _projects_query():
     if current_user.role == UserRole.ADMIN:
-        all_projects = Project.query.order_by(Project.updated_at.desc()).all()
+        query = Project.query
     else:
-        all_projects = Project.query.filter_by(client_id=current_user.id).order_by(Project.updated_at.desc()).all()
+        query = Project.query.filter_by(client_id=current_user.id)
     
-    return render_template('projects.html', projects=all_projects)
+    # The list renders each project's client, files and milestones
+    return query.options(
+        joinedload(Project.client),
+        selectinload(Project.files),
+        selectinload(Project.milestones)
+    )
 
 @main_bp.route('/project-wizard')
 def project_wizard():
@@ -150,6 +224,7 @@ def submit_project_wizard():
             if file and file.filename and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
                 file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
                 file.save(file_path)
                 
                 # Create file record
@@ -252,80 +327,148 @@ def create_project():
     
     return render_template('create_project.html')
 
+def _contract_validators():
+    # Each row shows the client's name, email and picture, and whether it has expired
+    def related(contract_ids):
+        client_ids = select(Contract.client_id).where(Contract.id.in_(contract_ids))
+        return (select(func.max(User.updated_at)).where(User.id.in_(client_ids)),)
+    return _page_validators(_contracts_query(), Contract.updated_at, Contract.id,
+                            columns=[(Contract.expires_at < datetime.utcnow()).label('expired')], related=related)
+
 @main_bp.route('/contracts')
 @login_required
+@conditional(_contract_validators)
 def contracts():
+    page = keyset_paginate(_contracts_query(), Contract.updated_at, Contract.id,
+                           cursor=request.args.get('cursor'), per_page=LIST_PAGE_SIZE)
+    return render_template('contracts.html', contracts=page, now=datetime.utcnow())
+
+def _contracts_query():
     if current_user.role == UserRole.ADMIN:
-        all_contracts = Contract.query.order_by(Contract.updated_at.desc()).all()
+        query = Contract.query
     else:
-        all_contracts = Contract.query.filter_by(client_id=current_user.id).order_by(Contract.updated_at.desc()).all()
-    
-    return render_template('contracts.html', contracts=all_contracts)
+        query = Contract.query.filter_by(client_id=current_user.id)
+    return query.options(joinedload(Contract.client))
 
 @main_bp.route('/payments')
 @login_required
 def payments():
-    if current_user.role == UserRole.ADMIN:
-        all_payments = Payment.query.order_by(Payment.created_at.desc()).all()
-    else:
-        all_payments = Payment.query.filter_by(user_id=current_user.id).order_by(Payment.created_at.desc()).all()
+    query = _payments_query()
+    page = keyset_paginate(query, Payment.created_at, Payment.id,
+                           cursor=request.args.get('cursor'), per_page=LIST_PAGE_SIZE)
+    
+    # Summary cards cover every payment, not just the rows on this page
+    payment_stats = {status.value: {'count': 0, 'amount': 0} for status in PaymentStatus}
+    totals = query.with_entities(Payment.status, func.count(Payment.id), func.sum(Payment.amount)) \
+        .group_by(Payment.status).all()
+    for status, count, amount in totals:
+        payment_stats[status.value] = {'count': count, 'amount': amount or 0}
     
-    return render_template('payments.html', payments=all_payments)
+    return render_template('payments.html', payments=page, payment_stats=payment_stats)
+
+def _payments_query():
+    if current_user.role == UserRole.ADMIN:
+        return Payment.query
+    return Payment.query.filter_by(user_id=current_user.id)
 
 @main_bp.route('/create-checkout-session', methods=['POST'])
 @login_required
 def create_checkout_session():
-    try:
-        payment_id = request.form.get('payment_id')
-        payment = Payment.query.get_or_404(payment_id)
-        
-        # Verify user authorization
-        if current_user.role != UserRole.ADMIN and payment.user_id != current_user.id:
-            flash('Unauthorized access', 'error')
-            return redirect(url_for('main.payments'))
-        
-        YOUR_DOMAIN = request.host_url.rstrip('/')
-        
-        checkout_session = stripe.checkout.Session.create(
-            line_items=[
-                {
-                    'price_data': {
-                        'currency': payment.currency.lower(),
-                        'product_data': {
-                            'name': payment.description or f'Payment #{payment.id}',
-                        },
-                        'unit_amount': int(payment.amount * 100),  # Convert to cents
-                    },
-                    'quantity': 1,
-                },
-            ],
-            mode='payment',
-            success_url=YOUR_DOMAIN + url_for('main.payment_success', payment_id=payment.id),
-            cancel_url=YOUR_DOMAIN + url_for('main.payment_cancel', payment_id=payment.id),
-            metadata={
-                'payment_id': payment.id,
-                'user_id': current_user.id
-            }
-        )
-        
-        # Update payment with Stripe session ID
-        payment.stripe_session_id = checkout_session.id
-        db.session.commit()
-        
-        return redirect(checkout_session.url or url_for('main.payments'), code=303)
-    except Exception as e:
-        flash(f'Error creating payment session: {str(e)}', 'error')
+    payment_id = request.form.get('payment_id')
+    payment = Payment.query.get_or_404(payment_id)
+    
+    # Verify user authorization
+    if current_user.role != UserRole.ADMIN and payment.user_id != current_user.id:
+        flash('Unauthorized access', 'error')
         return redirect(url_for('main.payments'))
+    
+    YOUR_DOMAIN = request.host_url.rstrip('/')
+    
+    # The worker creates the Stripe session; the pending page waits for it
+    job = queue_stripe_checkout(
+        payment, current_user.id,
+        success_url=YOUR_DOMAIN + url_for('main.payment_success', payment_id=payment.id),
+        cancel_url=YOUR_DOMAIN + url_for('main.payment_cancel', payment_id=payment.id)
+    )
+    db.session.commit()
+    
+    return redirect(url_for('main.checkout_pending', job_id=job.id), code=303)
+
+@main_bp.route('/checkout/<int:job_id>')
+@login_required
+def checkout_pending(job_id):
+    job = _owned_job_or_404(job_id)
+    return render_template('checkout_pending.html', job=job_state(job))
+
+def _owned_job_or_404(job_id):
+    job = Job.query.get_or_404(job_id)
+    if current_user.role != UserRole.ADMIN and job.user_id != current_user.id:
+        abort(404)
+    return job
+
+@main_bp.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job(job_id):
+    job = _owned_job_or_404(job_id)
+    response = jsonify(job_state(job, include_error=current_user.role == UserRole.ADMIN))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@main_bp.route('/api/admin/jobs')
+@login_required
+@admin_required
+def api_admin_jobs():
+    try:
+        status = JobStatus(request.args.get('status', JobStatus.DEAD.value))
+    except ValueError:
+        return jsonify({'error': 'Invalid status'}), 400
+    page = keyset_paginate(Job.query.filter_by(status=status), Job.updated_at, Job.id,
+                           cursor=request.args.get('cursor'), per_page=LIST_PAGE_SIZE)
+    return _page_json(page, lambda job: dict(job_state(job, include_error=True),
+                                            payment_id=job.payment_id, user_id=job.user_id,
+                                            updated_at=_isoformat(job.updated_at)))
+
+@main_bp.route('/api/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+@admin_required
+def retry_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.status != JobStatus.DEAD:
+        return jsonify({'success': False, 'error': 'Only dead jobs can be retried'}), 409
+    requeue_job(job)
+    db.session.commit()
+    
+    log_activity(current_user.id, 'JOB_RETRY', f'Requeued job {job.id} ({job.kind})')
+    return jsonify({'success': True})
+
+@main_bp.route('/api/reports/revenue')
+@login_required
+@admin_required
+def api_revenue_report():
+    # Answered from the revenue rollups (see revenue.py), never from Payment
+    try:
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow().date()
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') \
+            else end - timedelta(days=29)
+        group_by = [name for name in request.args.get('group_by', 'currency,status').split(',') if name]
+        statuses = [PaymentStatus(value) for value in request.args.getlist('status')]
+        project_id = request.args.get('project_id', type=int)
+    except ValueError:
+        return jsonify({'error': 'Invalid parameters'}), 400
+    if start > end or any(name not in REPORT_GROUPS for name in group_by):
+        return jsonify({'error': 'Invalid parameters'}), 400
+    return jsonify(revenue_report(start, end, group_by=group_by, currencies=request.args.getlist('currency'),
+                                  statuses=statuses, project_id=project_id))
 
 @main_bp.route('/payment/success/<int:payment_id>')
 @login_required
 def payment_success(payment_id):
     payment = Payment.query.get_or_404(payment_id)
     
-    # Update payment status
-    payment.status = PaymentStatus.COMPLETED
-    payment.paid_at = datetime.utcnow()
-    db.session.commit()
+    # Only moves forward (see webhooks.STATUS_RANK), so a refunded payment stays refunded
+    if not move_payment(payment, PaymentStatus.COMPLETED):
+        flash(f'Payment is already {payment.status.value}', 'info')
+        return redirect(url_for('main.payments'))
     
     log_activity(current_user.id, 'PAYMENT_SUCCESS', f'Payment #{payment.id} completed')
     flash('Payment completed successfully!', 'success')
@@ -340,20 +483,27 @@ def payment_cancel(payment_id):
 @main_bp.route('/messages')
 @login_required
 def messages():
+    conversations = list_conversations(current_user.id, cursor=request.args.get('cursor'),
+                                       per_page=LIST_PAGE_SIZE)
+    
+    return render_template('messages.html', conversations=conversations,
+                           unread_total=get_unread_count(current_user.id))
+
+def _message_queries():
+    """Return (sent, received) message queries visible to the current user"""
     if current_user.role == UserRole.ADMIN:
-        sent_messages = Message.query.filter_by(sender_id=current_user.id).order_by(Message.sent_at.desc()).all()
-        received_messages = Message.query.filter_by(recipient_id=current_user.id).order_by(Message.sent_at.desc()).all()
+        sent_query = Message.query.filter_by(sender_id=current_user.id)
+        received_query = Message.query.filter_by(recipient_id=current_user.id)
     else:
         # Clients can only see messages with admin
         admin_user = User.query.filter_by(role=UserRole.ADMIN).first()
         if admin_user:
-            sent_messages = Message.query.filter_by(sender_id=current_user.id, recipient_id=admin_user.id).order_by(Message.sent_at.desc()).all()
-            received_messages = Message.query.filter_by(sender_id=admin_user.id, recipient_id=current_user.id).order_by(Message.sent_at.desc()).all()
+            sent_query = Message.query.filter_by(sender_id=current_user.id, recipient_id=admin_user.id)
+            received_query = Message.query.filter_by(sender_id=admin_user.id, recipient_id=current_user.id)
         else:
-            sent_messages = []
-            received_messages = []
-    
-    return render_template('messages.html', sent_messages=sent_messages, received_messages=received_messages)
+            sent_query = Message.query.filter(false())
+            received_query = Message.query.filter(false())
+    return sent_query, received_query
 
 @main_bp.route('/messages/send', methods=['POST'])
 @login_required
@@ -367,6 +517,16 @@ def send_message():
         admin_user = User.query.filter_by(role=UserRole.ADMIN).first()
         recipient_id = admin_user.id if admin_user else None
     
+    # Replies go to the other side of the message being answered
+    parent_id = request.form.get('parent_id', type=int)
+    parent = None
+    if parent_id:
+        parent = Message.query.get(parent_id)
+        if parent is None or current_user.id not in (parent.sender_id, parent.recipient_id):
+            flash('Message not found', 'error')
+            return redirect(url_for('main.messages'))
+        recipient_id = parent.recipient_id if parent.sender_id == current_user.id else parent.sender_id
+    
     if not recipient_id:
         flash('No recipient specified', 'error')
         return redirect(url_for('main.messages'))
@@ -375,7 +535,8 @@ def send_message():
         subject=subject,
         content=content,
         sender_id=current_user.id,
-        recipient_id=recipient_id
+        recipient_id=recipient_id,
+        parent_id=parent.id if parent else None
     )
     
     # Handle file attachment
@@ -388,45 +549,106 @@ def send_message():
             attachment.save(attachment_path)
             message.attachment_path = attachment_path
     
-    db.session.add(message)
+    record_message(message)
+    adjust_unread(int(recipient_id), 1)
     db.session.commit()
+    bump_notifications(message.recipient_id)
+    broker.publish(message.recipient_id, 'message', {
+        'id': message.id,
+        'subject': message.subject,
+        'sender': current_user.get_full_name()
+    })
     
     log_activity(current_user.id, 'MESSAGE_SEND', f'Sent message: {subject}')
     flash('Message sent successfully!', 'success')
     return redirect(url_for('main.messages'))
 
 @main_bp.route('/blog')
+@page_cache.cached(tags=('blog',))
 def blog():
     page = request.args.get('page', 1, type=int)
     category = request.args.get('category')
+    tag = request.args.get('tag')
     
     query = BlogPost.query.filter_by(is_published=True)
     if category:
         query = query.filter_by(category=category)
+    if tag:
+        query = query.join(blog_post_tags, blog_post_tags.c.post_id == BlogPost.id) \
+            .join(Tag, Tag.id == blog_post_tags.c.tag_id).filter(Tag.name == tag.lower())
     
     posts = query.order_by(BlogPost.published_at.desc()).paginate(
         page=page, per_page=6, error_out=False
     )
     
-    categories = db.session.query(BlogPost.category).filter_by(is_published=True).distinct().all()
-    categories = [cat[0] for cat in categories]
+    # Facet counts are maintained incrementally by facets.py
+    categories, tags = get_blog_facets()
+    
+    # Count comments for the whole page in one grouped query
+    post_ids = [post.id for post in posts.items]
+    comment_counts = {}
+    if post_ids:
+        comment_counts = dict(
+            db.session.query(Comment.post_id, func.count(Comment.id))
+            .filter(Comment.post_id.in_(post_ids))
+            .group_by(Comment.post_id)
+            .all()
+        )
     
-    return render_template('blog.html', posts=posts, categories=categories, current_category=category)
+    return render_template('blog.html', posts=posts, categories=categories, current_category=category,
+                           tags=tags, current_tag=tag, comment_counts=comment_counts)
+
+@main_bp.route('/blog/search')
+@page_cache.cached(tags=('blog',))
+def blog_search():
+    query = request.args.get('q', '').strip()[:200]
+    page = request.args.get('page', 1, type=int)
+    results = search_posts(query, page=page, per_page=10) if query else None
+    return render_template('blog_search.html', query=query, results=results)
+
+def _blog_post_validators(post_id):
+    # Names and pictures of the author and of every commenter are rendered
+    commenter = aliased(Comment)
+    authors = select(func.max(User.updated_at)).where(
+        (User.id == BlogPost.author_id)
+        | User.id.in_(select(commenter.author_id).where(commenter.post_id == post_id))
+    )
+    row = db.session.query(
+        BlogPost.updated_at, BlogPost.likes, func.count(Comment.id), func.max(Comment.created_at),
+        func.max(Comment.id), func.sum(Comment.likes), authors.scalar_subquery()
+    ).outerjoin(Comment, Comment.post_id == BlogPost.id).filter(BlogPost.id == post_id).group_by(BlogPost.id).first()
+    if row is None:
+        return None
+    updated_at, likes, comment_count, last_comment, last_comment_id, comment_likes, authors_updated = row
+    last_modified = max(filter(None, (updated_at, last_comment)), default=None)
+    # View counts change on every visit and are deliberately left out
+    likes = (likes or 0) + counter_buffer.pending(post_id, 'likes')
+    return last_modified, (likes, comment_count, last_comment_id, comment_likes, authors_updated)
+
+def _count_blog_view(post_id):
+    counter_buffer.increment(post_id, 'views')
 
 @main_bp.route('/blog/<int:post_id>')
+@conditional(_blog_post_validators, on_not_modified=_count_blog_view)
 def blog_post(post_id):
-    post = BlogPost.query.get_or_404(post_id)
+    post = BlogPost.query.options(joinedload(BlogPost.author)).filter_by(id=post_id).first_or_404()
     
-    # Increment views
-    post.views += 1
-    db.session.commit()
+    # Increment views (buffered and flushed in batches)
+    _count_blog_view(post.id)
     
-    # Get comments
-    comments = Comment.query.filter_by(post_id=post_id, parent_id=None).order_by(Comment.created_at.desc()).all()
+    # Get the comment tree (one page of threads) in a single query
+    comment_tree = load_comment_tree(
+        post_id,
+        page=request.args.get('comments_page', 1, type=int),
+        per_page=COMMENT_THREADS_PER_PAGE,
+        root_id=request.args.get('thread', type=int)
+    )
     
-    return render_template('blog_post.html', post=post, comments=comments)
+    return render_template('blog_post.html', post=post, comment_tree=comment_tree)
 
 @main_bp.route('/github')
+@page_cache.cached(tags=('github',))
+@conditional(lambda: _scope_validators(GitHubRepo, GitHubRepo.query))
 def github_repos():
     repos = GitHubRepo.query.order_by(GitHubRepo.updated_at.desc()).all()
     return render_template('github.html', repos=repos)
@@ -443,17 +665,59 @@ def uploaded_file(filename):
 def mark_message_read(message_id):
     message = Message.query.get_or_404(message_id)
     if message.recipient_id == current_user.id:
-        message.is_read = True
-        db.session.commit()
+        if mark_read(message.id, current_user.id):
+            adjust_conversation_unread(message.conversation_id, current_user.id, -1)
+            db.session.commit()
+            bump_notifications(current_user.id)
+        broker.publish(current_user.id, 'message_read', {'id': message.id})
         return jsonify({'success': True})
     return jsonify({'success': False, 'error': 'Unauthorized'}), 403
 
+@main_bp.route('/api/conversations/<int:conversation_id>')
+@login_required
+def api_conversation(conversation_id):
+    participant = get_participant(conversation_id, current_user.id)
+    if participant is None:
+        return jsonify({'error': 'Not found'}), 404
+    conversation = participant.conversation
+    return jsonify({
+        'id': conversation.id,
+        'subject': conversation.subject,
+        'unread_count': participant.unread_count,
+        'messages': [{
+            'id': message.id,
+            'parent_id': message.parent_id,
+            'depth': depth,
+            'subject': message.subject,
+            'content': message.content,
+            'sender': message.sender.get_full_name(),
+            'recipient': message.recipient.get_full_name(),
+            'from_me': message.sender_id == current_user.id,
+            'is_read': message.is_read,
+            'has_attachment': bool(message.attachment_path),
+            'sent_at': _isoformat(message.sent_at)
+        } for message, depth in load_thread(conversation)]
+    })
+
+@main_bp.route('/api/conversations/<int:conversation_id>/read', methods=['POST'])
+@login_required
+def mark_conversation_read_api(conversation_id):
+    if get_participant(conversation_id, current_user.id) is None:
+        return jsonify({'success': False, 'error': 'Not found'}), 404
+    marked = mark_conversation_read(conversation_id, current_user.id)
+    if marked:
+        adjust_unread(current_user.id, -marked)
+    db.session.commit()
+    if marked:
+        bump_notifications(current_user.id)
+        broker.publish(current_user.id, 'conversation_read', {'id': conversation_id})
+    return jsonify({'success': True, 'marked': marked})
+
 @main_bp.route('/api/like-post/<int:post_id>', methods=['POST'])
 def like_post(post_id):
     post = BlogPost.query.get_or_404(post_id)
-    post.likes += 1
-    db.session.commit()
-    return jsonify({'likes': post.likes})
+    counter_buffer.increment(post.id, 'likes')
+    return jsonify({'likes': post.get_like_count()})
 
 @main_bp.route('/api/verify-user/<int:user_id>', methods=['POST'])
 @login_required
@@ -479,12 +743,99 @@ def update_project_status(project_id):
         project.status = ProjectStatus(new_status)
         project.progress = progress
         db.session.commit()
+        broker.publish(project.client_id, 'project_status', {
+            'id': project.id,
+            'status': project.status.value,
+            'progress': project.progress
+        })
         
         log_activity(current_user.id, 'PROJECT_UPDATE', f'Updated project {project.id} status to {new_status}')
         return jsonify({'success': True})
     except ValueError:
         return jsonify({'success': False, 'error': 'Invalid status'}), 400
 
+# Paginated list endpoints for infinite scroll
+def _page_json(page, serialize):
+    return jsonify({
+        'items': [serialize(item) for item in page],
+        'next_cursor': page.next_cursor,
+        'has_next': page.has_next
+    })
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+@main_bp.route('/api/projects')
+@login_required
+def api_projects():
+    page = keyset_paginate(_projects_query(), Project.updated_at, Project.id,
+                           cursor=request.args.get('cursor'), per_page=LIST_PAGE_SIZE)
+    return _page_json(page, lambda project: {
+        'id': project.id,
+        'title': project.title,
+        'project_type': project.project_type,
+        'status': project.status.value,
+        'progress': project.progress,
+        'budget': project.budget,
+        'deadline': _isoformat(project.deadline),
+        'client': project.client.get_full_name(),
+        'file_count': len(project.files),
+        'milestone_count': len(project.milestones),
+        'updated_at': _isoformat(project.updated_at)
+    })
+
+@main_bp.route('/api/contracts')
+@login_required
+def api_contracts():
+    page = keyset_paginate(_contracts_query(), Contract.updated_at, Contract.id,
+                           cursor=request.args.get('cursor'), per_page=LIST_PAGE_SIZE)
+    return _page_json(page, lambda contract: {
+        'id': contract.id,
+        'title': contract.title,
+        'status': contract.status.value,
+        'total_amount': contract.total_amount,
+        'client': contract.client.get_full_name(),
+        'signed_at': _isoformat(contract.signed_at),
+        'expires_at': _isoformat(contract.expires_at),
+        'updated_at': _isoformat(contract.updated_at)
+    })
+
+@main_bp.route('/api/payments')
+@login_required
+def api_payments():
+    page = keyset_paginate(_payments_query(), Payment.created_at, Payment.id,
+                           cursor=request.args.get('cursor'), per_page=LIST_PAGE_SIZE)
+    return _page_json(page, lambda payment: {
+        'id': payment.id,
+        'amount': payment.amount,
+        'currency': payment.currency,
+        'description': payment.description,
+        'status': payment.status.value,
+        'paid_at': _isoformat(payment.paid_at),
+        'created_at': _isoformat(payment.created_at)
+    })
+
+@main_bp.route('/api/messages')
+@login_required
+def api_messages():
+    sent_query, received_query = _message_queries()
+    if request.args.get('folder') == 'sent':
+        query = sent_query.options(joinedload(Message.recipient))
+    else:
+        query = received_query.options(joinedload(Message.sender))
+    page = keyset_paginate(query, Message.sent_at, Message.id,
+                           cursor=request.args.get('cursor'), per_page=LIST_PAGE_SIZE)
+    return _page_json(page, lambda message: {
+        'id': message.id,
+        'subject': message.subject,
+        'preview': message.content[:60],
+        'sender_id': message.sender_id,
+        'recipient_id': message.recipient_id,
+        'is_read': message.is_read,
+        'has_attachment': bool(message.attachment_path),
+        'sent_at': _isoformat(message.sent_at)
+    })
+
 # Error handlers
 @main_bp.errorhandler(404)
 def not_found(error):
@@ -500,40 +851,108 @@ def internal_error(error):
     return render_template('500.html'), 500
 
 # API endpoints for real-time updates
+def _unread_message_count(user_id):
+    return get_unread_count(user_id)
+
+@main_bp.route('/api/notifications/summary')
+def api_notifications_summary():
+    # Answer revalidation from the shared version counter before Flask-Login
+    # loads the user, so an unchanged badge costs no database work
+    user_id = session.get('_user_id')
+    if user_id is not None:
+        etag = notification_etag(user_id)
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+    
+    if not current_user.is_authenticated:
+        return jsonify({'messages': 0, 'notifications': 0, 'version': None})
+    
+    # Read the version before counting so a concurrent change is never hidden
+    etag = notification_etag(current_user.id)
+    unread = _unread_message_count(current_user.id)
+    response = jsonify({
+        'messages': unread,
+        # Count unread messages as notifications for now
+        'notifications': unread,
+        'version': etag
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@main_bp.route('/api/stream')
+@login_required
+def api_stream():
+    subscription = broker.subscribe(current_user.id)
+    if subscription is None:
+        # Worker is at its stream limit; the client falls back to polling
+        response = jsonify({'error': 'Too many open streams'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    
+    heartbeat = app.config['SSE_HEARTBEAT_INTERVAL']
+    max_duration = app.config['SSE_MAX_DURATION']
+    
+    def stream():
+        started = time.monotonic()
+        try:
+            yield 'retry: 5000\n\n'
+            while time.monotonic() - started < max_duration:
+                event = subscription.get(timeout=heartbeat)
+                if event is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+    
+    # Streams are long-lived, so release the database connection up front
+    db.session.remove()
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @main_bp.route('/api/unread-messages')
 def api_unread_messages():
     if not current_user.is_authenticated:
         return jsonify({'count': 0})
-    count = Message.query.filter_by(recipient_id=current_user.id, is_read=False).count()
-    return jsonify({'count': count})
+    return jsonify({'count': _unread_message_count(current_user.id)})
 
 @main_bp.route('/api/notifications')
 def api_notifications():
     if not current_user.is_authenticated:
         return jsonify({'count': 0})
     # Count unread messages as notifications for now
-    count = Message.query.filter_by(recipient_id=current_user.id, is_read=False).count()
-    return jsonify({'count': count})
+    return jsonify({'count': _unread_message_count(current_user.id)})
 
 @main_bp.route('/privacy')
+@page_cache.cached()
 def privacy_policy():
     from datetime import datetime
     current_date = datetime.now().strftime('%B %d, %Y')
     return render_template('privacy.html', current_date=current_date)
 
 @main_bp.route('/terms')
+@page_cache.cached()
 def terms_of_service():
     from datetime import datetime
     current_date = datetime.now().strftime('%B %d, %Y')
     return render_template('terms.html', current_date=current_date)
 
 @main_bp.route('/latest-projects')
+@page_cache.cached(tags=('projects',))
 def latest_projects():
     # Show latest 6 completed projects (public view)
     featured_projects = Project.query.filter_by(status=ProjectStatus.COMPLETED).order_by(Project.updated_at.desc()).limit(6).all()
     return render_template('latest_projects.html', projects=featured_projects)
 
 @main_bp.route('/timeline')
+@page_cache.cached()
 def timeline():
     """Display developer timeline page"""
     return render_template('timeline.html')
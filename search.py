@@ -0,0 +1,407 @@
+"""Full-text search over published blog posts and their comments.
+
+Each published post has one row in the blog_post_search index holding its
+title, excerpt, tags, content and the text of all its comments. The index
+is engine-specific:
+
+* SQLite: an FTS5 virtual table (porter stemming), ranked with bm25().
+* PostgreSQL: a table with a weighted tsvector column and a GIN index,
+  ranked with ts_rank_cd() and highlighted with ts_headline().
+* Anything else falls back to unranked LIKE matching.
+
+The index table is created by a migration (0a49a5e4fd34); on a database
+without it (e.g. one made with create_all) search falls back to LIKE.
+Session hooks note which posts a transaction changed, and once it commits
+the posts are re-indexed, each at most once per SEARCH_REINDEX_DELAY: a
+busy comment thread costs one re-index per delay rather than one per
+comment. `flask search-reindex` rebuilds the whole index.
+"""
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+
+from markupsafe import Markup, escape
+from sqlalchemy import event, func, inspect, select, text
+from sqlalchemy.orm import Session, joinedload
+
+from app import app, db
+from models import BlogPost, Comment
+
+logger = logging.getLogger(__name__)
+
+INDEX_TABLE = 'blog_post_search'
+
+# Highlight markers: private-use characters that never occur in real text,
+# swapped for <mark> tags after the surrounding text has been escaped
+HIGHLIGHT_START = '\ue000'
+HIGHLIGHT_END = '\ue001'
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SqliteSearch:
+    """FTS5 virtual table keyed by the post id (rowid)"""
+
+    def create(self, connection):
+        # Only for throwaway databases (search-benchmark); see the migration
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX_TABLE} "
+            "USING fts5(title, excerpt, tags, content, comments, tokenize='porter unicode61')"
+        ))
+
+    def delete(self, connection, post_ids):
+        connection.execute(text(f"DELETE FROM {INDEX_TABLE} WHERE rowid = :id"),
+                           [{'id': post_id} for post_id in post_ids])
+
+    def upsert(self, connection, documents):
+        self.delete(connection, [document['id'] for document in documents])
+        connection.execute(text(
+            f"INSERT INTO {INDEX_TABLE} (rowid, title, excerpt, tags, content, comments) "
+            "VALUES (:id, :title, :excerpt, :tags, :content, :comments)"
+        ), documents)
+
+    @staticmethod
+    def _match(query):
+        # Quote every term so user input can never be parsed as FTS5 syntax;
+        # the last term is a prefix so partially typed words still match
+        terms = _TERM_RE.findall(query)
+        if not terms:
+            return None
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    def search(self, connection, query, limit, offset):
+        match = self._match(query)
+        if match is None:
+            return 0, []
+        total = connection.execute(text(
+            f"SELECT count(*) FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH :match"
+        ), {'match': match}).scalar()
+        rows = connection.execute(text(
+            f"SELECT rowid, highlight({INDEX_TABLE}, 0, :start, :end), "
+            f"snippet({INDEX_TABLE}, -1, :start, :end, '…', 32) "
+            f"FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH :match "
+            # Column weights: title, excerpt, tags, content, comments
+            f"ORDER BY bm25({INDEX_TABLE}, 10.0, 4.0, 6.0, 1.0, 0.5) LIMIT :limit OFFSET :offset"
+        ), {'match': match, 'start': HIGHLIGHT_START, 'end': HIGHLIGHT_END,
+            'limit': limit, 'offset': offset}).all()
+        return total, [tuple(row) for row in rows]
+
+
+class PostgresSearch:
+    """Weighted tsvector column with a GIN index"""
+
+    DOCUMENT = (
+        "setweight(to_tsvector('english', coalesce(:title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(:tags, '') || ' ' || coalesce(:excerpt, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(:content, '')), 'C') || "
+        "setweight(to_tsvector('english', coalesce(:comments, '')), 'D')"
+    )
+
+    def create(self, connection):
+        # Only for throwaway databases; see the migration
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {INDEX_TABLE} ("
+            "post_id INTEGER PRIMARY KEY REFERENCES blog_post (id) ON DELETE CASCADE, "
+            "title TEXT, excerpt TEXT, tags TEXT, content TEXT, comments TEXT, "
+            "document TSVECTOR NOT NULL)"
+        ))
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{INDEX_TABLE}_document ON {INDEX_TABLE} USING gin (document)"
+        ))
+
+    def delete(self, connection, post_ids):
+        connection.execute(text(f"DELETE FROM {INDEX_TABLE} WHERE post_id = :id"),
+                           [{'id': post_id} for post_id in post_ids])
+
+    def upsert(self, connection, documents):
+        connection.execute(text(
+            f"INSERT INTO {INDEX_TABLE} (post_id, title, excerpt, tags, content, comments, document) "
+            f"VALUES (:id, :title, :excerpt, :tags, :content, :comments, {self.DOCUMENT}) "
+            "ON CONFLICT (post_id) DO UPDATE SET title = excluded.title, excerpt = excluded.excerpt, "
+            "tags = excluded.tags, content = excluded.content, comments = excluded.comments, "
+            "document = excluded.document"
+        ), documents)
+
+    def search(self, connection, query, limit, offset):
+        if not _TERM_RE.search(query):
+            return 0, []
+        total = connection.execute(text(
+            f"SELECT count(*) FROM {INDEX_TABLE} WHERE document @@ websearch_to_tsquery('english', :query)"
+        ), {'query': query}).scalar()
+        # Rank and page first so ts_headline only runs on the rows shown
+        rows = connection.execute(text(
+            "SELECT ranked.post_id, "
+            "ts_headline('english', ranked.title, ranked.q, :title_options), "
+            "ts_headline('english', coalesce(ranked.content, '') || ' ' || coalesce(ranked.comments, ''), "
+            "ranked.q, :snippet_options) "
+            "FROM (SELECT s.post_id, s.title, s.content, s.comments, q, ts_rank_cd(s.document, q) AS rank "
+            f"      FROM {INDEX_TABLE} s, websearch_to_tsquery('english', :query) q "
+            "      WHERE s.document @@ q ORDER BY rank DESC, s.post_id DESC LIMIT :limit OFFSET :offset) ranked "
+            "ORDER BY ranked.rank DESC, ranked.post_id DESC"
+        ), {
+            'query': query, 'limit': limit, 'offset': offset,
+            'title_options': f'StartSel={HIGHLIGHT_START},StopSel={HIGHLIGHT_END},HighlightAll=true',
+            'snippet_options': f'StartSel={HIGHLIGHT_START},StopSel={HIGHLIGHT_END},'
+                               'MaxFragments=2,MaxWords=32,MinWords=12,FragmentDelimiter=" … "',
+        }).all()
+        return total, [tuple(row) for row in rows]
+
+
+class LikeSearch:
+    """Unranked substring matching for engines without a full-text index"""
+
+    def create(self, connection):
+        pass
+
+    def delete(self, connection, post_ids):
+        pass
+
+    def upsert(self, connection, documents):
+        pass
+
+    def search(self, connection, query, limit, offset):
+        terms = _TERM_RE.findall(query)
+        if not terms:
+            return 0, []
+        post = BlogPost.__table__
+        criteria = [post.c.is_published.is_(True)]
+        for term in terms:
+            pattern = f"%{term}%"
+            criteria.append(post.c.title.ilike(pattern) | post.c.content.ilike(pattern)
+                            | post.c.tags.ilike(pattern) | post.c.excerpt.ilike(pattern))
+        base = select(post.c.id, post.c.title, post.c.content).where(*criteria)
+        total = connection.execute(select(func.count()).select_from(base.subquery())).scalar()
+        rows = connection.execute(
+            base.order_by(post.c.published_at.desc()).limit(limit).offset(offset)
+        ).all()
+        return total, [(row.id, _mark_terms(row.title, terms), _mark_terms(row.content[:200], terms))
+                       for row in rows]
+
+
+def _mark_terms(value, terms):
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    return pattern.sub(lambda match: f"{HIGHLIGHT_START}{match.group(0)}{HIGHLIGHT_END}", value or '')
+
+
+BACKENDS = {'sqlite': SqliteSearch, 'postgresql': PostgresSearch}
+
+_backends = {}
+_lock = threading.Lock()
+
+
+def get_backend(connection):
+    """Return the search backend for `connection`'s database.
+
+    Never creates anything: without the migrated index table the database
+    gets LIKE matching. Looked up once per database URL.
+    """
+    url = str(connection.engine.url)
+    backend = _backends.get(url)
+    if backend is None:
+        backend_class = BACKENDS.get(connection.dialect.name, LikeSearch)
+        if backend_class is not LikeSearch and not inspect(connection).has_table(INDEX_TABLE):
+            logger.warning("No %s table (run `flask db upgrade`); searching with LIKE", INDEX_TABLE)
+            backend_class = LikeSearch
+        with _lock:
+            backend = _backends.setdefault(url, backend_class())
+    return backend
+
+
+def highlight(value):
+    """Escape indexed text and turn highlight markers into <mark> tags"""
+    return Markup(str(escape(value or ''))
+                  .replace(HIGHLIGHT_START, '<mark>')
+                  .replace(HIGHLIGHT_END, '</mark>'))
+
+
+def reindex_posts(connection, post_ids):
+    """Bring the index rows of `post_ids` up to date"""
+    post_ids = sorted(set(post_ids))
+    if not post_ids:
+        return
+    backend = get_backend(connection)
+    post = BlogPost.__table__
+    comment = Comment.__table__
+    posts = connection.execute(
+        select(post.c.id, post.c.title, post.c.excerpt, post.c.tags, post.c.content)
+        .where(post.c.id.in_(post_ids), post.c.is_published.is_(True))
+    ).all()
+    comments = {}
+    for post_id, content in connection.execute(
+        select(comment.c.post_id, comment.c.content)
+        .where(comment.c.post_id.in_(post_ids)).order_by(comment.c.id)
+    ):
+        comments.setdefault(post_id, []).append(content)
+
+    backend.delete(connection, post_ids)
+    documents = [{
+        'id': row.id, 'title': row.title, 'excerpt': row.excerpt, 'tags': row.tags,
+        'content': row.content, 'comments': '\n'.join(comments.get(row.id, ()))
+    } for row in posts]
+    if documents:
+        backend.upsert(connection, documents)
+
+
+def rebuild_index(connection, batch_size=1000):
+    """Re-index every post in batches; returns the number of posts seen"""
+    get_backend(connection)
+    post = BlogPost.__table__
+    last_id = 0
+    seen = 0
+    while True:
+        post_ids = connection.execute(
+            select(post.c.id).where(post.c.id > last_id).order_by(post.c.id).limit(batch_size)
+        ).scalars().all()
+        if not post_ids:
+            return seen
+        reindex_posts(connection, post_ids)
+        last_id = post_ids[-1]
+        seen += len(post_ids)
+
+
+class SearchResults:
+    """One page of search hits, with the pagination attributes templates use"""
+
+    def __init__(self, query, page, per_page, total, hits):
+        self.query = query
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.items = hits
+
+    @property
+    def pages(self):
+        return max(1, -(-self.total // self.per_page))
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def has_next(self):
+        return self.page * self.per_page < self.total
+
+    @property
+    def prev_num(self):
+        return self.page - 1
+
+    @property
+    def next_num(self):
+        return self.page + 1
+
+
+def search_posts(query, page=1, per_page=10):
+    """Search published posts; returns SearchResults whose items are dicts
+    with the post, its highlighted title and a highlighted snippet"""
+    page = max(page, 1)
+    connection = db.session.connection()
+    total, rows = get_backend(connection).search(connection, query, per_page, (page - 1) * per_page)
+    posts = {}
+    if rows:
+        posts = {post.id: post for post in BlogPost.query.options(joinedload(BlogPost.author))
+                 .filter(BlogPost.id.in_([row[0] for row in rows]), BlogPost.is_published.is_(True))}
+    hits = [{'post': posts[post_id], 'title': highlight(title), 'snippet': highlight(snippet)}
+            for post_id, title, snippet in rows if post_id in posts]
+    return SearchResults(query, page, per_page, total, hits)
+
+
+class Reindexer:
+    """Re-index committed post changes, each post at most once per `delay`.
+
+    A post changed again while it waits is not queued a second time, so a
+    burst of comments on one post costs a single re-index. With a delay of
+    0 posts are re-indexed right after the commit (tests rely on this).
+    """
+
+    def __init__(self, app=None):
+        self.delay = 5.0
+        self._app = None
+        self._due = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.delay = app.config.get('SEARCH_REINDEX_DELAY', self.delay)
+        atexit.register(self.flush)
+
+    def schedule(self, post_ids):
+        if self.delay <= 0:
+            self._reindex(post_ids)
+            return
+        due = time.monotonic() + self.delay
+        with self._condition:
+            for post_id in post_ids:
+                self._due.setdefault(post_id, due)
+            self._ensure_thread()
+            self._condition.notify()
+
+    def flush(self):
+        """Re-index every waiting post now"""
+        with self._condition:
+            post_ids = list(self._due)
+            self._due.clear()
+        if post_ids:
+            self._reindex(post_ids)
+
+    def _ensure_thread(self):
+        # Called with the condition held; threads do not survive fork
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='search-reindex', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                post_ids = [post_id for post_id, due in self._due.items() if due <= now]
+                if not post_ids:
+                    self._condition.wait(min(self._due.values(), default=now + 60) - now)
+                    continue
+                for post_id in post_ids:
+                    del self._due[post_id]
+            try:
+                self._reindex(post_ids)
+            except Exception:
+                logger.exception("Failed to re-index blog posts %s", post_ids)
+
+    def _reindex(self, post_ids):
+        with self._app.app_context():
+            with db.engine.begin() as connection:
+                reindex_posts(connection, post_ids)
+
+
+reindexer = Reindexer(app)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changed_posts(session, flush_context):
+    post_ids = session.info.setdefault('search_post_ids', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, BlogPost):
+            post_ids.add(obj.id)
+        elif isinstance(obj, Comment):
+            post_ids.add(obj.post_id)
+    post_ids.discard(None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _reindex_committed_posts(session):
+    post_ids = session.info.pop('search_post_ids', None)
+    if post_ids:
+        reindexer.schedule(post_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_posts(session):
+    session.info.pop('search_post_ids', None)
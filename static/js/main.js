@@ -1025,43 +1025,179 @@ function initializeAjaxForms() {
     });
 }
 
+// Keyset "Load More" links: fetch the next page and append its rows in place
+function initializeLoadMore() {
+    document.addEventListener('click', function(e) {
+        const link = e.target.closest('[data-load-more]');
+        if (!link) return;
+        e.preventDefault();
+        
+        if (link.classList.contains('disabled')) return;
+        const selector = link.dataset.loadMore;
+        const originalHtml = link.innerHTML;
+        link.classList.add('disabled');
+        link.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Loading...';
+        
+        fetch(link.href, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(response => response.text())
+            .then(html => {
+                const doc = new DOMParser().parseFromString(html, 'text/html');
+                const source = doc.querySelector(selector);
+                const target = document.querySelector(selector);
+                if (source && target) {
+                    target.append(...source.children);
+                }
+                
+                const nextLink = doc.querySelector(`[data-load-more="${selector}"]`);
+                if (nextLink) {
+                    link.href = nextLink.href;
+                    link.innerHTML = originalHtml;
+                    link.classList.remove('disabled');
+                } else {
+                    link.parentElement.remove();
+                }
+            })
+            .catch(error => {
+                link.innerHTML = originalHtml;
+                link.classList.remove('disabled');
+                showNotification('Failed to load more items', 'error');
+                console.error('Error:', error);
+            });
+    });
+}
+
 // Real-time Updates
 function initializeRealTimeUpdates() {
-    // Check for new messages
-    setInterval(() => {
-        updateMessageCount();
-        updateNotificationCount();
-    }, 30000); // Check every 30 seconds
+    // Only signed-in pages carry badges worth updating
+    if (!document.querySelector('.message-count-badge')) return;
+    
+    let timer = null;
+    let stream = null;
+    
+    function startPolling() {
+        if (timer === null) {
+            timer = setInterval(updateNotificationSummary, 30000); // Check every 30 seconds
+        }
+    }
+    
+    function stopPolling() {
+        clearInterval(timer);
+        timer = null;
+    }
+    
+    // Prefer pushed events; poll only while the stream is unavailable
+    function openStream() {
+        if (!window.EventSource) {
+            startPolling();
+            return;
+        }
+        stream = new EventSource('/api/stream');
+        stream.onopen = stopPolling;
+        stream.onerror = startPolling;
+        ['message', 'message_read', 'project_status'].forEach(type => {
+            stream.addEventListener(type, event => {
+                updateNotificationSummary();
+                document.dispatchEvent(new CustomEvent('platform:' + type, { detail: JSON.parse(event.data) }));
+            });
+        });
+        stream.addEventListener('job_status', event => {
+            document.dispatchEvent(new CustomEvent('platform:job_status', { detail: JSON.parse(event.data) }));
+        });
+    }
+    
+    function closeStream() {
+        if (stream) {
+            stream.close();
+            stream = null;
+        }
+    }
+    
+    // Hidden tabs go quiet and catch up as soon as they are shown again
+    document.addEventListener('visibilitychange', () => {
+        if (document.hidden) {
+            closeStream();
+            stopPolling();
+        } else {
+            updateNotificationSummary();
+            openStream();
+        }
+    });
+    
+    if (!document.hidden) {
+        openStream();
+    }
 }
 
-function updateMessageCount() {
-    fetch('/api/unread-messages')
+function updateNotificationSummary() {
+    // The browser revalidates with If-None-Match and reuses the cached body on 304
+    fetch('/api/notifications/summary', { cache: 'no-cache', credentials: 'same-origin' })
         .then(response => response.json())
         .then(data => {
-            const badge = document.querySelector('.message-count-badge');
-            if (badge && data.count > 0) {
-                badge.textContent = data.count;
-                badge.style.display = 'inline';
-            } else if (badge) {
-                badge.style.display = 'none';
-            }
+            updateCountBadge('.message-count-badge', data.messages);
+            updateCountBadge('.notification-count-badge', data.notifications);
         })
-        .catch(error => console.error('Error updating message count:', error));
+        .catch(error => console.error('Error updating notifications:', error));
 }
 
-function updateNotificationCount() {
-    fetch('/api/notifications')
-        .then(response => response.json())
-        .then(data => {
-            const badge = document.querySelector('.notification-count-badge');
-            if (badge && data.count > 0) {
-                badge.textContent = data.count;
-                badge.style.display = 'inline';
-            } else if (badge) {
-                badge.style.display = 'none';
+function updateCountBadge(selector, count) {
+    const badge = document.querySelector(selector);
+    if (badge && count > 0) {
+        badge.textContent = count;
+        badge.style.display = 'inline';
+    } else if (badge) {
+        badge.style.display = 'none';
+    }
+}
+
+// Background jobs (checkout sessions and the like) run server-side; resolve
+// with the job's final state once it has succeeded or is dead
+function waitForJob(statusUrl, onUpdate) {
+    return new Promise((resolve, reject) => {
+        let delay = 500;
+        let timer = null;
+        let done = false;
+        
+        function finish(job) {
+            done = true;
+            clearTimeout(timer);
+            document.removeEventListener('platform:job_status', onEvent);
+            resolve(job);
+        }
+        
+        function check() {
+            fetch(statusUrl, { cache: 'no-store', credentials: 'same-origin' })
+                .then(response => {
+                    if (!response.ok) throw new Error('Job status unavailable (' + response.status + ')');
+                    return response.json();
+                })
+                .then(job => {
+                    if (done) return;
+                    if (onUpdate) onUpdate(job);
+                    if (job.status === 'succeeded' || job.status === 'dead') {
+                        finish(job);
+                    } else {
+                        // Pushed job_status events cut the wait short; polling backs off
+                        timer = setTimeout(check, delay);
+                        delay = Math.min(delay * 1.5, 5000);
+                    }
+                })
+                .catch(error => {
+                    done = true;
+                    document.removeEventListener('platform:job_status', onEvent);
+                    reject(error);
+                });
+        }
+        
+        function onEvent(event) {
+            if (!done && statusUrl.endsWith('/' + event.detail.id)) {
+                clearTimeout(timer);
+                check();
             }
-        })
-        .catch(error => console.error('Error updating notification count:', error));
+        }
+        
+        document.addEventListener('platform:job_status', onEvent);
+        check();
+    });
 }
 
 // Utility Functions
@@ -1093,6 +1229,7 @@ function throttle(func, limit) {
 // Initialize additional features when page is loaded
 window.addEventListener('load', function() {
     initializeAjaxForms();
+    initializeLoadMore();
     initializeRealTimeUpdates();
     
     // Add loading complete class
@@ -1114,6 +1251,7 @@ window.showNotification = function(message, type = 'info', duration = 5000) {
 // Export functions for global use
 window.PlatformJS = {
     showNotification: window.showNotification,
+    waitForJob,
     formatFileSize,
     debounce,
     throttle
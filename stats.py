@@ -0,0 +1,85 @@
+"""Admin dashboard statistics.
+
+All counters are computed in one round trip (a single SELECT of scalar
+subqueries) and the snapshot is cached per process for ADMIN_STATS_TTL
+seconds. Commits that touch users, projects, contracts or payments bump a
+version in a VersionStore shared by all workers, and every worker drops
+its snapshot once the version moves on.
+"""
+import threading
+import time
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from app import app, db, state_path
+from models import User, Project, Contract, Payment, ContractStatus, PaymentStatus
+from notifications import VersionStore
+
+TRACKED_MODELS = (User, Project, Contract, Payment)
+VERSION_KEY = 'admin_stats'
+
+_versions = VersionStore(state_path('admin_stats.bin'), slots=1)
+_lock = threading.Lock()
+_snapshot = None
+_snapshot_at = 0.0
+_snapshot_version = None
+
+
+def get_admin_stats():
+    """Return the admin counters, recomputing them if the cache is stale"""
+    global _snapshot, _snapshot_at, _snapshot_version
+    ttl = app.config.get('ADMIN_STATS_TTL', 30)
+    # Read before computing: a change committed meanwhile moves the version
+    # on, and the snapshot is not kept
+    version = _versions.get(VERSION_KEY)
+    with _lock:
+        if (_snapshot is not None and _snapshot_version == version
+                and time.monotonic() - _snapshot_at < ttl):
+            return dict(_snapshot)
+
+    snapshot = _compute_admin_stats()
+    if _versions.get(VERSION_KEY) == version:
+        with _lock:
+            _snapshot = snapshot
+            _snapshot_at = time.monotonic()
+            _snapshot_version = version
+    return dict(snapshot)
+
+
+def invalidate_admin_stats():
+    """Make every worker recompute the counters on its next read"""
+    _versions.bump(VERSION_KEY)
+
+
+def _compute_admin_stats():
+    def count(model, *criteria):
+        return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+    row = db.session.execute(select(
+        count(User).label('total_users'),
+        count(Project).label('total_projects'),
+        count(Contract, Contract.status == ContractStatus.ACTIVE).label('active_contracts'),
+        count(Payment, Payment.status == PaymentStatus.PENDING).label('pending_payments'),
+        count(User, User.is_verified == False).label('unverified_users')  # noqa: E712
+    )).one()
+    return dict(row._mapping)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_stats_changes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, TRACKED_MODELS):
+            session.info['admin_stats_dirty'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('admin_stats_dirty', False):
+        invalidate_admin_stats()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _reset_on_rollback(session):
+    session.info.pop('admin_stats_dirty', None)
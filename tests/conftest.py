@@ -0,0 +1,60 @@
+"""Shared fixtures: the application and an empty database.
+
+Tests run against an in-memory SQLite database unless TEST_DATABASE_URL
+points at another one (e.g. a scratch PostgreSQL database; its tables are
+dropped after every test).
+"""
+import os
+
+# app.py reads its configuration at import time
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+os.environ.setdefault('SESSION_SECRET', 'test')
+os.environ['ACTIVITY_LOG_SYNC'] = '1'
+os.environ['EVENT_BACKEND'] = 'local'
+os.environ['PAGE_CACHE_BACKEND'] = 'null'
+os.environ['JINJA_BYTECODE_CACHE_DIR'] = ''
+os.environ['SEARCH_REINDEX_DELAY'] = '0'
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app():
+    from main import app
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def database(app):
+    from app import db
+    with app.app_context():
+        db.create_all()
+        yield db
+        # Buffered view counts belong to this test's rows
+        from counters import counter_buffer
+        counter_buffer.flush(force=True)
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app, database):
+    return app.test_client()
+
+
+@pytest.fixture
+def count_queries(database):
+    """Call with a function; returns how many SQL statements it ran"""
+    from sqlalchemy import event
+
+    def count(function):
+        statements = []
+        listener = lambda *args, **kwargs: statements.append(args[2])
+        event.listen(database.engine, 'before_cursor_execute', listener)
+        try:
+            function()
+        finally:
+            event.remove(database.engine, 'before_cursor_execute', listener)
+        return len(statements)
+    return count
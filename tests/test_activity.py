@@ -0,0 +1,54 @@
+"""Activity entries of a request are written only if it did not fail."""
+from activity import activity_writer
+from models import ActivityLog, User, UserRole
+
+
+def logged_request(app, user, exc):
+    context = app.test_request_context('/')
+    context.push()
+    try:
+        activity_writer.log(user.id, 'profile_update', 'Updated profile')
+        assert ActivityLog.query.count() == 0
+    finally:
+        context.pop(exc)
+
+
+def test_entries_are_written_after_a_successful_request(app, database):
+    user = User(username='user', email='user@example.com', role=UserRole.CLIENT, password_hash='-')
+    database.session.add(user)
+    database.session.commit()
+    logged_request(app, user, None)
+    assert [entry.action for entry in ActivityLog.query] == ['profile_update']
+
+
+def test_entries_of_a_failed_request_are_dropped(app, database):
+    user = User(username='user', email='user@example.com', role=UserRole.CLIENT, password_hash='-')
+    database.session.add(user)
+    database.session.commit()
+    logged_request(app, user, RuntimeError('view failed'))
+    assert ActivityLog.query.count() == 0
+
+
+def test_entries_rolled_back_with_the_view_are_dropped(app, database):
+    user = User(username='user', email='user@example.com', role=UserRole.CLIENT, password_hash='-')
+    database.session.add(user)
+    database.session.commit()
+    with app.test_request_context('/'):
+        database.session.add(User(username='new', email='new@example.com', role=UserRole.CLIENT,
+                                  password_hash='-'))
+        database.session.flush()
+        activity_writer.log(user.id, 'ACCOUNT_CREATED', 'Never committed')
+        database.session.rollback()
+        activity_writer.log(user.id, 'PROJECT_SUBMITTED', 'Logged after the rollback')
+    assert [entry.action for entry in ActivityLog.query] == ['PROJECT_SUBMITTED']
+
+
+def test_committed_entries_survive_a_later_rollback(app, database):
+    user = User(username='user', email='user@example.com', role=UserRole.CLIENT, password_hash='-')
+    database.session.add(user)
+    database.session.commit()
+    with app.test_request_context('/'):
+        activity_writer.log(user.id, 'PROFILE_UPDATE', 'Committed with the change')
+        database.session.commit()
+        database.session.rollback()
+    assert [entry.action for entry in ActivityLog.query] == ['PROFILE_UPDATE']
@@ -0,0 +1,40 @@
+"""The admin counters cache follows changes committed by any worker."""
+from sqlalchemy import insert
+
+import stats
+from models import User, UserRole
+from notifications import VersionStore
+
+
+def add_user(database, name):
+    # Core insert: no ORM flush, so only an explicit bump invalidates the cache
+    database.session.execute(insert(User).values(username=name, email=f'{name}@example.com',
+                                                 password_hash='-', role=UserRole.CLIENT))
+    database.session.commit()
+
+
+def test_bump_from_another_worker_drops_the_snapshot(database):
+    stats.invalidate_admin_stats()
+    before = stats.get_admin_stats()['total_users']
+    add_user(database, 'one')
+    assert stats.get_admin_stats()['total_users'] == before
+
+    # Another process opens the same version file and bumps it
+    VersionStore(stats._versions.path, slots=1).bump(stats.VERSION_KEY)
+    assert stats.get_admin_stats()['total_users'] == before + 1
+
+
+def test_snapshot_computed_across_a_change_is_not_kept(database, monkeypatch):
+    stats.invalidate_admin_stats()
+    compute = stats._compute_admin_stats
+
+    def compute_then_change():
+        snapshot = compute()
+        add_user(database, 'late')
+        stats.invalidate_admin_stats()
+        return snapshot
+
+    monkeypatch.setattr(stats, '_compute_admin_stats', compute_then_change)
+    stale = stats.get_admin_stats()['total_users']
+    monkeypatch.setattr(stats, '_compute_admin_stats', compute)
+    assert stats.get_admin_stats()['total_users'] == stale + 1
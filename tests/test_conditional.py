@@ -0,0 +1,118 @@
+"""Conditional GET: repeat visits get 304 until something the page renders changes."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import BlogPost, Comment, Milestone, Project, ProjectFile, User, UserRole
+
+
+@pytest.fixture
+def users(database):
+    admin = User(username='admin', email='admin@example.com', role=UserRole.ADMIN, is_verified=True,
+                 first_name='Ada', last_name='Admin')
+    admin.set_password('password')
+    reader = User(username='reader', email='reader@example.com', role=UserRole.CLIENT, is_verified=True,
+                  first_name='Rea', last_name='Der', password_hash=admin.password_hash)
+    database.session.add_all([admin, reader])
+    database.session.commit()
+    return admin, reader
+
+
+def revalidate(client, path, response):
+    return client.get(path, headers={'If-None-Match': response.headers['ETag']})
+
+
+def test_blog_post_not_modified_until_comments_or_authors_change(client, database, users):
+    admin, reader = users
+    post = BlogPost(title='Post', content='-', category='news', is_published=True, author_id=admin.id, published_at=datetime.utcnow())
+    database.session.add(post)
+    database.session.commit()
+    path = f'/blog/{post.id}'
+
+    first = client.get(path)
+    assert first.status_code == 200
+    assert 'Last-Modified' not in first.headers
+    assert revalidate(client, path, first).status_code == 304
+
+    comment = Comment(content='First!', author_id=reader.id, post_id=post.id)
+    database.session.add(comment)
+    database.session.commit()
+    second = revalidate(client, path, first)
+    assert second.status_code == 200
+    assert b'First!' in second.data
+
+    reader.first_name = 'Renamed'
+    database.session.commit()
+    third = revalidate(client, path, second)
+    assert third.status_code == 200
+    assert b'Renamed' in third.data
+
+    comment.likes = 5
+    database.session.commit()
+    assert revalidate(client, path, third).status_code == 200
+
+
+def test_if_modified_since_alone_does_not_skip_rendering(client, database, users):
+    admin, _ = users
+    post = BlogPost(title='Post', content='-', category='news', is_published=True, author_id=admin.id, published_at=datetime.utcnow())
+    database.session.add(post)
+    database.session.commit()
+    response = client.get(f'/blog/{post.id}', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
+
+
+def test_projects_not_modified_until_related_rows_change(client, database, users):
+    admin, reader = users
+    project = Project(title='Site', description='-', project_type='web', client_id=reader.id)
+    database.session.add(project)
+    database.session.flush()
+    milestone = Milestone(title='Design', project_id=project.id)
+    database.session.add(milestone)
+    database.session.commit()
+    client.post('/auth/login', data={'username': 'admin', 'password': 'password'})
+    client.get('/projects')  # renders the login flash message
+
+    first = client.get('/projects')
+    assert first.status_code == 200
+    assert revalidate(client, '/projects', first).status_code == 304
+
+    milestone.is_completed = True
+    database.session.commit()
+    second = revalidate(client, '/projects', first)
+    assert second.status_code == 200
+    assert b'1 of 1 completed' in second.data
+
+    database.session.add(ProjectFile(filename='a.pdf', original_filename='brief.pdf', file_path='a.pdf',
+                                     file_size=1, mime_type='application/pdf', project_id=project.id))
+    database.session.commit()
+    third = revalidate(client, '/projects', second)
+    assert third.status_code == 200
+    assert b'brief.pdf' in third.data
+
+    reader.last_name = 'Client'
+    database.session.commit()
+    assert revalidate(client, '/projects', third).status_code == 200
+    assert revalidate(client, '/projects', client.get('/projects')).status_code == 304
+
+
+def test_project_validators_only_cover_the_requested_page(client, database, users):
+    admin, reader = users
+    now = datetime.utcnow()
+    projects = [Project(title=f'Project {index}', description='-', project_type='web', client_id=reader.id,
+                        updated_at=now - timedelta(minutes=index)) for index in range(30)]
+    database.session.add_all(projects)
+    database.session.commit()
+    client.post('/auth/login', data={'username': 'admin', 'password': 'password'})
+    client.get('/projects')  # renders the login flash message
+
+    first = client.get('/projects')
+    # The oldest project is on the second page, so a new file on it leaves the first as it was
+    database.session.add(ProjectFile(filename='a.pdf', original_filename='old.pdf', file_path='a.pdf',
+                                     file_size=1, mime_type='application/pdf', project_id=projects[-1].id))
+    database.session.commit()
+    assert revalidate(client, '/projects', first).status_code == 304
+
+    database.session.add(ProjectFile(filename='b.pdf', original_filename='new.pdf', file_path='b.pdf',
+                                     file_size=1, mime_type='application/pdf', project_id=projects[0].id))
+    database.session.commit()
+    assert revalidate(client, '/projects', first).status_code == 200
@@ -0,0 +1,77 @@
+"""Buffered blog counters reach the database on a timer and at most once."""
+import json
+import os
+import time
+
+import pytest
+
+from counters import CounterBuffer
+from models import BlogPost, User, UserRole
+
+
+@pytest.fixture
+def post(database):
+    author = User(username='author', email='author@example.com', role=UserRole.ADMIN, password_hash='-')
+    database.session.add(author)
+    database.session.flush()
+    post = BlogPost(title='Post', content='-', category='news', is_published=True, author_id=author.id)
+    database.session.add(post)
+    database.session.commit()
+    return post
+
+
+def views(database, post):
+    database.session.expire_all()
+    return database.session.get(BlogPost, post.id).views or 0
+
+
+def test_quiet_buffer_is_flushed_by_the_timer(app, database, post):
+    buffer = CounterBuffer(app)
+    buffer.flush_interval = 0.2
+    buffer.increment(post.id, 'views')
+    assert views(database, post) == 0
+    deadline = time.monotonic() + 5
+    while views(database, post) == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert views(database, post) == 1
+
+
+def test_spool_is_emptied_before_it_is_applied(app, database, post, tmp_path, monkeypatch):
+    buffer = CounterBuffer(app)
+    buffer.spool_path = str(tmp_path / 'counters.json')
+    buffer.increment(post.id, 'views', 3)
+    buffer.flush()
+    assert views(database, post) == 0
+
+    spooled_during_write = []
+    write = buffer._write
+
+    def write_and_peek(deltas):
+        write(deltas)
+        with open(buffer.spool_path) as spool:
+            spooled_during_write.append(json.load(spool)['deltas'])
+
+    monkeypatch.setattr(buffer, '_write', write_and_peek)
+    buffer.flush(force=True)
+    assert views(database, post) == 3
+    # A worker dying right after the commit leaves nothing to apply again
+    assert spooled_during_write == [[]]
+
+
+def test_spool_is_private(app, database, post, tmp_path):
+    buffer = CounterBuffer(app)
+    buffer.spool_path = str(tmp_path / 'spool' / 'counters.json')
+    buffer.increment(post.id, 'views')
+    buffer.flush()
+    assert os.stat(buffer.spool_path).st_mode & 0o777 == 0o600
+    assert os.stat(tmp_path / 'spool').st_mode & 0o777 == 0o700
+    buffer.flush(force=True)
+
+    shared = tmp_path / 'shared'
+    shared.mkdir(mode=0o777)
+    shared.chmod(0o777)
+    other = CounterBuffer(app)
+    other.spool_path = str(shared / 'counters.json')
+    with pytest.raises(RuntimeError):
+        other.flush()
+    assert not (shared / 'counters.json').exists()
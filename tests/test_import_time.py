@@ -0,0 +1,32 @@
+"""Importing the entry points stays within budget and leaves the filesystem alone."""
+import os
+
+import pytest
+
+from startup import LAZY_PACKAGES, measure_imports
+
+BUDGET_MS = float(os.environ.get('IMPORT_TIME_BUDGET_MS', '1200'))
+
+
+@pytest.fixture
+def runtime_directories(tmp_path, monkeypatch):
+    """Point every directory the app writes to at paths that do not exist yet"""
+    directories = {
+        'JINJA_BYTECODE_CACHE_DIR': tmp_path / 'jinja',
+        'PAGE_CACHE_DIR': tmp_path / 'pages',
+    }
+    for name, directory in directories.items():
+        monkeypatch.setenv(name, str(directory))
+    monkeypatch.setenv('PAGE_CACHE_BACKEND', 'file')
+    monkeypatch.setenv('EVENT_BACKEND', 'file')
+    monkeypatch.setenv('EVENT_SPOOL_PATH', str(tmp_path / 'events' / 'events.log'))
+    return tmp_path
+
+
+@pytest.mark.parametrize('module', ['main', 'manage'])
+def test_entry_point_imports_within_budget(module, runtime_directories):
+    profile = measure_imports(module, runs=3)
+    assert profile.total_ms <= BUDGET_MS, \
+        f"{module} took {profile.total_ms:.0f} ms to import: {profile.packages.most_common(5)}"
+    assert [package for package in LAZY_PACKAGES if profile.loaded(package)] == []
+    assert list(runtime_directories.iterdir()) == []
@@ -0,0 +1,56 @@
+"""The hot queries of routes.py must be answered from an index, not a table scan."""
+import pytest
+from sqlalchemy import false, func, select, text
+
+from models import (ActivityLog, BlogPost, Comment, Contract, GitHubRepo, Message, Payment, Project,
+                    ProjectStatus)
+
+HOT_QUERIES = [
+    ('unread badge', 'ix_message_recipient_read_sent',
+     select(func.count(Message.id)).where(Message.recipient_id == 1, Message.is_read == false())),
+    ('dashboard messages', 'ix_message_recipient_read_sent',
+     select(Message).where(Message.recipient_id == 1, Message.is_read == false())
+     .order_by(Message.sent_at.desc()).limit(5)),
+    ('inbox', 'ix_message_recipient_sent',
+     select(Message).where(Message.recipient_id == 1).order_by(Message.sent_at.desc()).limit(20)),
+    ('client projects', 'ix_project_client_updated',
+     select(Project).where(Project.client_id == 1).order_by(Project.updated_at.desc()).limit(5)),
+    ('completed projects', 'ix_project_status_updated',
+     select(Project).where(Project.status == ProjectStatus.COMPLETED).order_by(Project.updated_at.desc()).limit(6)),
+    ('client contracts', 'ix_contract_client_updated',
+     select(Contract).where(Contract.client_id == 1).order_by(Contract.updated_at.desc()).limit(5)),
+    ('client payments', 'ix_payment_user_created',
+     select(Payment).where(Payment.user_id == 1).order_by(Payment.created_at.desc()).limit(20)),
+    ('checkout session lookup', 'ix_payment_stripe_session_id',
+     select(Payment).where(Payment.stripe_session_id == 'cs_test')),
+    ('blog listing', 'ix_blog_post_published',
+     select(BlogPost).where(BlogPost.is_published.is_(True)).order_by(BlogPost.published_at.desc()).limit(10)),
+    ('blog category', 'ix_blog_post_published_category',
+     select(BlogPost).where(BlogPost.is_published.is_(True), BlogPost.category == 'news')
+     .order_by(BlogPost.published_at.desc()).limit(10)),
+    ('post comments', 'ix_comment_post_parent_created',
+     select(Comment).where(Comment.post_id == 1, Comment.parent_id.is_(None)).order_by(Comment.created_at)),
+    ('featured repos', 'ix_git_hub_repo_featured_updated',
+     select(GitHubRepo).where(GitHubRepo.is_featured.is_(True)).order_by(GitHubRepo.updated_at.desc()).limit(6)),
+    ('recent activity', 'ix_activity_log_created',
+     select(ActivityLog).order_by(ActivityLog.created_at.desc()).limit(10)),
+]
+
+
+def explain(database, statement):
+    """The query plan of `statement` as one line per step"""
+    connection = database.session.connection()
+    sql = str(statement.compile(connection, compile_kwargs={'literal_binds': True}))
+    if connection.dialect.name == 'postgresql':
+        # Empty tables are cheapest to scan; make the planner show whether it can use an index
+        connection.execute(text('SET LOCAL enable_seqscan = off'))
+        return [row[0] for row in connection.execute(text('EXPLAIN ' + sql))]
+    return [row[-1] for row in connection.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+
+
+@pytest.mark.parametrize('name, index, statement', HOT_QUERIES, ids=[query[0] for query in HOT_QUERIES])
+def test_hot_query_uses_index(database, name, index, statement):
+    plan = explain(database, statement)
+    assert any(index in step for step in plan), f"{name} does not use {index}: {plan}"
+    assert not any('Seq Scan' in step or (step.startswith('SCAN') and 'INDEX' not in step) for step in plan), \
+        f"{name} scans a table: {plan}"
@@ -0,0 +1,61 @@
+"""Keyset pages cover every row once, including rows with a NULL sort value."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, update
+
+from models import Project, User, UserRole
+from utils import decode_cursor, encode_cursor, keyset_paginate
+
+
+def test_cursor_round_trips_a_null_sort_value():
+    assert decode_cursor(encode_cursor(None, 7)) == (None, 7)
+    moment = datetime(2024, 5, 1, 12, 30)
+    assert decode_cursor(encode_cursor(moment, 7)) == (moment, 7)
+
+
+def test_pages_walk_through_null_sort_values(database):
+    client = User(username='client', email='client@example.com', role=UserRole.CLIENT, password_hash='-')
+    database.session.add(client)
+    database.session.flush()
+    start = datetime(2024, 1, 1)
+    for index in range(9):
+        database.session.add(Project(title=f'Project {index}', description='-', project_type='web',
+                                     client_id=client.id, updated_at=start + timedelta(days=index % 3)))
+    database.session.flush()
+    # onupdate would fill the column in again on an ORM update
+    database.session.execute(update(Project).where(Project.id % 3 == 0).values(updated_at=None))
+    database.session.commit()
+
+    seen, cursor = [], None
+    while True:
+        page = keyset_paginate(Project.query, Project.updated_at, Project.id, cursor=cursor, per_page=2)
+        seen.extend((project.updated_at, project.id) for project in page)
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+
+    rows = [(project.updated_at, project.id) for project in Project.query]
+    dated = sorted((row for row in rows if row[0] is not None), reverse=True)
+    undated = sorted((row for row in rows if row[0] is None), key=lambda row: row[1], reverse=True)
+    assert len(undated) == 3
+    assert seen == dated + undated
+
+
+def test_deep_cursor_seeks_instead_of_scanning(database):
+    if database.engine.dialect.name != 'sqlite':
+        pytest.skip('reads the SQLite query plan')
+    statements = []
+    listener = lambda connection, cursor, statement, parameters, *args: statements.append((statement, parameters))
+    event.listen(database.engine, 'before_cursor_execute', listener)
+    try:
+        keyset_paginate(Project.query, Project.updated_at, Project.id,
+                        cursor=encode_cursor(datetime(2024, 1, 1), 500), per_page=2)
+    finally:
+        event.remove(database.engine, 'before_cursor_execute', listener)
+
+    statement, parameters = statements[0]
+    plan = [row[-1] for row in database.session.connection()
+            .exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, tuple(parameters))]
+    assert len(plan) == 1 and plan[0].startswith('SEARCH project USING INDEX ix_project_updated'), plan
+    assert 'updated_at<?' in plan[0], plan
@@ -0,0 +1,51 @@
+"""Payment views only move a payment forward, and the revenue rollups follow."""
+import pytest
+
+import payment as payment_views
+from models import Payment, PaymentStatus, RevenueDaily, User, UserRole
+from revenue import rebuild_revenue, record_payment
+from webhooks import move_payments
+
+
+@pytest.fixture
+def pending_payment(database):
+    user = User(username='client', email='client@example.com', role=UserRole.CLIENT, password_hash='-')
+    database.session.add(user)
+    database.session.flush()
+    payment = Payment(amount=12.5, currency='OMR', user_id=user.id, stripe_session_id='cs_test')
+    database.session.add(payment)
+    database.session.flush()
+    record_payment(payment)
+    database.session.commit()
+    return payment
+
+
+def call(app, view):
+    with app.test_request_context(query_string={'session_id': 'cs_test'}):
+        return view().get_json()
+
+
+def rollups(database):
+    return sorted((row.status, row.payment_count, row.amount_minor)
+                  for row in database.session.query(RevenueDaily) if row.payment_count)
+
+
+def test_views_follow_status_rank(app, database, pending_payment):
+    assert call(app, payment_views.payment_cancel)['message'] == 'Payment cancelled'
+    assert call(app, payment_views.payment_success)['message'] == 'Payment successful'
+    assert pending_payment.status == PaymentStatus.COMPLETED
+    assert pending_payment.paid_at is not None
+
+    # A late cancel must not undo the success
+    assert call(app, payment_views.payment_cancel)['message'] == 'Payment is already completed'
+    assert pending_payment.status == PaymentStatus.COMPLETED
+
+    move_payments({PaymentStatus.REFUNDED: {pending_payment.id: None}})
+    database.session.commit()
+    assert call(app, payment_views.payment_success)['message'] == 'Payment is already refunded'
+    assert pending_payment.status == PaymentStatus.REFUNDED
+
+    assert rollups(database) == [(PaymentStatus.REFUNDED, 1, 12500)]
+    incremental = rollups(database)
+    rebuild_revenue(session=database.session)
+    assert rollups(database) == incremental
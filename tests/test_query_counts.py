@@ -0,0 +1,68 @@
+"""List pages run a fixed number of SQL statements however many rows they show."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import BlogPost, Comment, Contract, Milestone, Payment, Project, ProjectFile, User, UserRole
+
+# Upper bounds per page, for the fixture's data and for twice as much
+PAGES = [
+    ('/projects', 'admin', 4),
+    ('/contracts', 'admin', 2),
+    ('/payments', 'admin', 3),
+    ('/blog', None, 6),
+    ('/blog/{post_id}', None, 5),
+]
+
+
+def seed(database, rows):
+    """`rows` projects, contracts, payments and blog posts, each with its own client"""
+    admin = User(username='admin', email='admin@example.com', role=UserRole.ADMIN, is_verified=True)
+    admin.set_password('password')
+    database.session.add(admin)
+
+    now = datetime.utcnow()
+    post = None
+    for index in range(rows):
+        client = User(username=f'client{index}', email=f'client{index}@example.com', role=UserRole.CLIENT,
+                      first_name='Client', last_name=str(index), is_verified=True)
+        client.password_hash = admin.password_hash
+        database.session.add(client)
+        database.session.flush()
+        updated = now - timedelta(minutes=index)
+        project = Project(title=f'Project {index}', description='-', project_type='web', client_id=client.id,
+                          updated_at=updated)
+        database.session.add(project)
+        database.session.flush()
+        database.session.add_all([
+            ProjectFile(filename='f', original_filename='f', file_path='f', file_size=1, mime_type='text/plain',
+                        project_id=project.id),
+            Milestone(title='Milestone', project_id=project.id),
+            Contract(title=f'Contract {index}', content='-', total_amount=10, client_id=client.id, updated_at=updated),
+            Payment(amount=10 + index, user_id=client.id, created_at=updated),
+        ])
+        post = BlogPost(title=f'Post {index}', content='-', category='news', tags='a, b', is_published=True,
+                        author_id=admin.id, published_at=updated)
+        database.session.add(post)
+        database.session.flush()
+        for _ in range(3):
+            comment = Comment(content='-', author_id=client.id, post_id=post.id)
+            database.session.add(comment)
+            database.session.flush()
+            database.session.add(Comment(content='-', author_id=admin.id, post_id=post.id, parent_id=comment.id))
+    database.session.commit()
+    return post.id
+
+
+@pytest.mark.parametrize('rows', [10, 20])
+@pytest.mark.parametrize('path, user, limit', PAGES, ids=[page[0] for page in PAGES])
+def test_list_page_query_count(client, database, count_queries, rows, path, user, limit):
+    post_id = seed(database, rows)
+    if user:
+        client.post('/auth/login', data={'username': user, 'password': 'password'})
+    database.session.remove()
+
+    responses = []
+    queries = count_queries(lambda: responses.append(client.get(path.format(post_id=post_id))))
+    assert responses[0].status_code == 200
+    assert queries <= limit, f"{path} ran {queries} statements with {rows} rows"
@@ -0,0 +1,70 @@
+"""The search index is migrated, not created at runtime, and re-indexed after commit."""
+import pytest
+from sqlalchemy import inspect, text
+
+import search
+from models import BlogPost, Comment, User, UserRole
+
+
+@pytest.fixture
+def fts_index(database):
+    if database.engine.dialect.name != 'sqlite':
+        pytest.skip('creates the SQLite FTS5 index directly')
+    with database.engine.begin() as connection:
+        search.SqliteSearch().create(connection)
+    search._backends.clear()
+    yield
+    search._backends.clear()
+    with database.engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE {search.INDEX_TABLE}"))
+
+
+@pytest.fixture
+def post(database):
+    author = User(username='author', email='author@example.com', role=UserRole.ADMIN, password_hash='-')
+    database.session.add(author)
+    database.session.flush()
+    post = BlogPost(title='Kestrels', content='Birds of prey.', category='news', is_published=True,
+                    author_id=author.id)
+    database.session.add(post)
+    database.session.commit()
+    return post
+
+
+def add_comment(database, post, content):
+    database.session.add(Comment(content=content, author_id=post.author_id, post_id=post.id))
+    database.session.commit()
+
+
+def test_missing_index_table_falls_back_to_like(database, post):
+    search._backends.clear()
+    assert isinstance(search.get_backend(database.session.connection()), search.LikeSearch)
+    assert not inspect(database.engine).has_table(search.INDEX_TABLE)
+    assert [hit['post'].id for hit in search.search_posts('kestrels').items] == [post.id]
+
+
+def test_committed_comment_is_searchable(database, fts_index, post):
+    add_comment(database, post, 'A hovering windhover over the field.')
+    assert [hit['post'].id for hit in search.search_posts('windhover').items] == [post.id]
+
+
+def test_burst_of_comments_reindexes_the_post_once(database, fts_index, post, monkeypatch):
+    calls = []
+    monkeypatch.setattr(search.reindexer, 'delay', 60.0)
+    monkeypatch.setattr(search.reindexer, '_reindex', lambda post_ids: calls.append(sorted(post_ids)))
+    for number in range(10):
+        add_comment(database, post, f'Comment {number}')
+    assert calls == []
+
+    search.reindexer.flush()
+    assert calls == [[post.id]]
+
+
+def test_rolled_back_changes_are_not_reindexed(database, fts_index, post, monkeypatch):
+    calls = []
+    monkeypatch.setattr(search.reindexer, '_reindex', lambda post_ids: calls.append(sorted(post_ids)))
+    database.session.add(Comment(content='Never kept', author_id=post.author_id, post_id=post.id))
+    database.session.flush()
+    database.session.rollback()
+    database.session.commit()
+    assert calls == []
@@ -0,0 +1,24 @@
+"""A failing webhook batch is logged and the processor keeps going."""
+from collections import Counter
+
+from sqlalchemy.exc import IntegrityError
+
+import webhooks
+
+
+def test_unexpected_batch_error_does_not_stop_the_processor(database, monkeypatch):
+    outcomes = [IntegrityError('INSERT', {}, Exception('duplicate')), Counter(applied=1), Counter()]
+
+    def process_events(batch_size):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(webhooks, 'process_events', process_events)
+    processor = webhooks.WebhookProcessor(poll_interval=0.01)
+    # A failed batch counts as idle, so each run stops after it; run again
+    totals = Counter()
+    while outcomes:
+        totals.update(processor.run(exit_when_idle=True))
+    assert totals == Counter(applied=1)
@@ -0,0 +1,169 @@
+"""Local stand-in for the Thawani checkout API.
+
+Serves the calls gateway.ThawaniClient makes (create and fetch checkout
+sessions) from memory, with optional latency and failure injection, so the
+payment flow can be exercised and benchmarked without the real gateway.
+send_webhooks() plays the gateway's side of webhook delivery.
+
+Run it standalone with:
+
+    python thawani_stub.py --port 8089 --latency 0.05 --fail-rate 0.1
+    THAWANI_API_BASE_URL=http://127.0.0.1:8089/api/v1 gunicorn main:app
+
+`flask gateway-benchmark` starts one in-process with start_stub(), and
+`flask webhooks loadtest` uses send_webhooks().
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PREFIX = '/api/v1'
+
+
+class StubState:
+    """Sessions created so far plus the failure/latency settings"""
+
+    def __init__(self, latency=0.0, fail_rate=0.0, fail_status=503):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.sessions = {}
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real gateway
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # body waits on the client's delayed ACK (~40 ms) on reused connections
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.state.lock:
+            self.server.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        prefix = f"{API_PREFIX}/checkout/session/"
+        if not self.path.startswith(prefix):
+            return self._reply(404, {'success': False, 'description': 'Not found'})
+        if not self._simulate():
+            return
+        session = self.server.state.sessions.get(self.path[len(prefix):])
+        if session is None:
+            return self._reply(404, {'success': False, 'description': 'Session not found'})
+        self._reply(200, {'success': True, 'data': session})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.path != f"{API_PREFIX}/checkout/session":
+            return self._reply(404, {'success': False, 'description': 'Not found'})
+        if not self._simulate():
+            return
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            return self._reply(400, {'success': False, 'description': 'Invalid JSON'})
+        if not payload.get('client_reference_id') or not payload.get('products'):
+            return self._reply(400, {'success': False, 'description': 'Missing client_reference_id or products'})
+        session_id = f"checkout_{uuid.uuid4().hex}"
+        session = {
+            'session_id': session_id,
+            'client_reference_id': payload['client_reference_id'],
+            'total_amount': sum(p.get('unit_amount', 0) * p.get('quantity', 1) for p in payload['products']),
+            'payment_status': 'unpaid',
+            'metadata': payload.get('metadata') or {},
+            'checkout_url': f"http://{self.headers.get('Host', 'localhost')}/pay/{session_id}",
+        }
+        self.server.state.sessions[session_id] = session
+        self._reply(200, {'success': True, 'code': 2004, 'data': session})
+
+    def _simulate(self):
+        """Apply latency and injected failures; False if a failure was sent"""
+        state = self.server.state
+        with state.lock:
+            state.requests += 1
+        if state.latency:
+            time.sleep(state.latency)
+        if state.fail_rate and random.random() < state.fail_rate:
+            self._reply(state.fail_status, {'success': False, 'description': 'Injected failure'})
+            return False
+        return True
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def send_webhooks(url, bodies, threads=8):
+    """POST each raw JSON body to `url` the way the gateway delivers webhooks.
+
+    Bodies are spread over `threads` keep-alive connections. Returns
+    (per-request seconds, non-200 status codes).
+    """
+    import requests
+
+    latencies = []
+    errors = []
+
+    def deliver(chunk):
+        with requests.Session() as session:
+            for body in chunk:
+                started = time.perf_counter()
+                response = session.post(url, data=body, headers={'Content-Type': 'application/json'}, timeout=30)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+    senders = [threading.Thread(target=deliver, args=(bodies[index::threads],)) for index in range(threads)]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    return latencies, errors
+
+
+def start_stub(port=0, **settings):
+    """Serve the stub from a background thread; returns the server.
+
+    The base URL is f"http://127.0.0.1:{server.server_port}/api/v1"; the
+    settings live on `server.state` and can be changed while it runs.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(**settings)
+    threading.Thread(target=server.serve_forever, name='thawani-stub', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering.')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Share of calls answered with --fail-status.')
+    parser.add_argument('--fail-status', type=int, default=503)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StubHandler)
+    server.state = StubState(args.latency, args.fail_rate, args.fail_status)
+    print(f"Thawani stub listening on http://127.0.0.1:{args.port}{API_PREFIX}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Denormalized per-user unread message counters.
+
+The badge count is read on every dashboard render and poll, so it is kept
+in the unread_counter side table and adjusted in the same transaction as
+the message change, turning the read into a primary-key lookup.
+"""
+from sqlalchemy import case, delete, func, insert, select, update
+
+from app import db
+from models import Message, UnreadCounter
+
+
+def adjust_unread(user_id, delta):
+    """Add `delta` to a user's unread count in the current transaction"""
+    table = UnreadCounter.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        # Imported here: the PostgreSQL dialect package is slow to load
+        from sqlalchemy.dialects import postgresql, sqlite
+        dialect_insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = dialect_insert(table).values(user_id=user_id, unread_messages=max(delta, 0))
+        new_value = table.c.unread_messages + delta
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.user_id],
+            set_={'unread_messages': case((new_value < 0, 0), else_=new_value)}
+        )
+        db.session.execute(statement)
+        return
+
+    new_value = table.c.unread_messages + delta
+    result = db.session.execute(
+        update(table).where(table.c.user_id == user_id)
+        .values(unread_messages=case((new_value < 0, 0), else_=new_value))
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(table).values(user_id=user_id, unread_messages=max(delta, 0)))
+
+
+def mark_read(message_id, recipient_id):
+    """Flag a message read; returns True if it was unread until now.
+
+    The conditional UPDATE makes concurrent requests for the same message
+    decrement the counter only once.
+    """
+    result = db.session.execute(
+        update(Message.__table__)
+        .where(Message.__table__.c.id == message_id, Message.__table__.c.is_read.isnot(True))
+        .values(is_read=True)
+    )
+    if result.rowcount:
+        adjust_unread(recipient_id, -1)
+        return True
+    return False
+
+
+def get_unread_count(user_id):
+    """Return a user's unread message count (primary-key lookup)"""
+    count = db.session.execute(
+        select(UnreadCounter.unread_messages).where(UnreadCounter.user_id == user_id)
+    ).scalar()
+    return count or 0
+
+
+def reconcile_unread_counts():
+    """Rebuild every counter from the message table; returns rows written"""
+    table = UnreadCounter.__table__
+    counts = select(Message.recipient_id, func.count(Message.id)) \
+        .where(Message.is_read.isnot(True)) \
+        .group_by(Message.recipient_id)
+    db.session.execute(delete(table))
+    result = db.session.execute(insert(table).from_select(['user_id', 'unread_messages'], counts))
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,110 @@
+"""Cross-request cache of read-only user snapshots for Flask-Login.
+
+load_user() runs on every authenticated request, including badge polls.
+Instead of a SELECT per request it returns a detached UserSnapshot from a
+bounded LRU with a TTL. Each entry remembers the user's version in a
+shared VersionStore, and commits that touch a User bump that version, so
+every worker drops its stale snapshot on the next lookup.
+
+Views that modify the user must load the User row themselves.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import app, db, state_path
+from models import User
+from notifications import VersionStore
+
+
+class UserSnapshot(UserMixin):
+    """Detached, read-only copy of the User fields used on every page"""
+
+    FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'role', 'is_verified', 'profile_image')
+
+    def __init__(self, user):
+        for field in self.FIELDS:
+            object.__setattr__(self, field, getattr(user, field))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserSnapshot is read-only; load the User row to modify it")
+
+    def get_full_name(self):
+        return User.get_full_name(self)
+
+
+class UserCache:
+    """Bounded LRU + TTL cache of UserSnapshot objects"""
+
+    def __init__(self, app=None):
+        self.max_size = 1024
+        self.ttl = 300
+        self.versions = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_size = app.config.get('USER_CACHE_SIZE', self.max_size)
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+        self.versions = VersionStore(app.config.get('USER_CACHE_VERSION_PATH') or state_path('users.bin'))
+
+    def get(self, user_id):
+        """Return a snapshot of the user, or None if it does not exist"""
+        version = self.versions.get(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                snapshot, loaded_at, loaded_version = entry
+                if now - loaded_at < self.ttl and loaded_version == version:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return snapshot
+                del self._entries[user_id]
+            self.misses += 1
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot(user)
+        with self._lock:
+            self._entries[user_id] = (snapshot, now, version)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id):
+        """Drop a user's snapshot here and in every other worker"""
+        self.versions.bump(user_id)
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+user_cache = UserCache(app)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_user_changes(session, flush_context):
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            session.info.setdefault('changed_user_ids', set()).add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('changed_user_ids', None)
@@ -1,8 +1,11 @@
+import base64
+from datetime import datetime
 from functools import wraps
-from flask import flash, redirect, url_for, request
+from flask import flash, redirect, url_for
 from flask_login import current_user
-from app import db
-from models import ActivityLog, UserRole
+from sqlalchemy import and_, or_
+from activity import activity_writer
+from models import UserRole
 
 def admin_required(f):
     @wraps(f)
@@ -14,20 +17,81 @@ def admin_required(f):
     return decorated_function
 
 def log_activity(user_id, action, description):
-    """Log user activity"""
+    """Log user activity (written in the background by activity.py)"""
     try:
-        activity = ActivityLog(
-            user_id=user_id,
-            action=action,
-            description=description,
-            ip_address=request.remote_addr,
-            user_agent=request.headers.get('User-Agent', '')
-        )
-        db.session.add(activity)
-        db.session.commit()
+        activity_writer.log(user_id, action, description)
     except Exception as e:
         print(f"Error logging activity: {e}")
 
+class KeysetPage:
+    """A single page of results from keyset_paginate()"""
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+    
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+    
+    def __iter__(self):
+        return iter(self.items)
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def __bool__(self):
+        return bool(self.items)
+
+def encode_cursor(sort_value, row_id):
+    """Encode a (timestamp, id) position as an opaque URL-safe cursor; the timestamp may be None"""
+    raw = f"{sort_value.isoformat() if sort_value is not None else ''}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor(); returns None if invalid"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        sort_value, row_id = raw.rsplit('|', 1)
+        return (datetime.fromisoformat(sort_value) if sort_value else None), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def keyset_paginate(query, sort_column, id_column, cursor=None, per_page=20):
+    """Return the page of `query` after `cursor`, newest first.
+    
+    Rows are ordered by (sort_column, id_column) descending and the cursor
+    marks the last row of the previous page, so every page is an index range
+    scan of per_page + 1 rows no matter how deep the client has scrolled.
+    Rows whose sort_column is NULL follow as a tail segment, newest id
+    first, paged by id alone; neither segment's predicate ever has to
+    step over the other's rows.
+    """
+    position = decode_cursor(cursor)
+    rows = []
+    if position is None or position[0] is not None:
+        dated = query.filter(sort_column.isnot(None))
+        if position:
+            sort_value, last_id = position
+            dated = dated.filter(
+                sort_column <= sort_value,
+                or_(sort_column < sort_value, and_(sort_column == sort_value, id_column < last_id))
+            )
+        rows = dated.order_by(sort_column.desc(), id_column.desc()).limit(per_page + 1).all()
+    if len(rows) <= per_page:
+        undated = query.filter(sort_column.is_(None))
+        if position and position[0] is None:
+            undated = undated.filter(id_column < position[1])
+        rows += undated.order_by(id_column.desc()).limit(per_page + 1 - len(rows)).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    return KeysetPage(rows, next_cursor)
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     ALLOWED_EXTENSIONS = {
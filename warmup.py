@@ -0,0 +1,45 @@
+"""Template warm-up.
+
+Compiling a template is by far the slowest part of its first render, and
+every gunicorn worker (including ones recycled by max_requests) used to pay
+it on its first request for each page. warm_templates() loads every
+template into the Jinja environment up front: gunicorn calls it when a
+worker boots, and `flask warm-templates` fills the shared bytecode cache
+(JINJA_BYTECODE_CACHE_DIR) at deploy time so workers only unmarshal code.
+"""
+import logging
+import time
+
+from jinja2 import TemplateSyntaxError
+
+from app import app
+
+logger = logging.getLogger(__name__)
+
+
+def warm_templates(use_bytecode_cache=True, reload=False):
+    """Load every HTML template; returns {template name: seconds taken}.
+
+    Templates already loaded in this process are kept unless `reload` is
+    set. With `use_bytecode_cache=False` each template is compiled from
+    source, which is what a cold worker without the cache has to do.
+    """
+    env = app.jinja_env
+    bytecode_cache = env.bytecode_cache
+    if not use_bytecode_cache:
+        env.bytecode_cache = None
+    timings = {}
+    try:
+        if env.cache is not None and (reload or not use_bytecode_cache):
+            env.cache.clear()
+        for name in sorted(env.list_templates(extensions=['html'])):
+            started = time.perf_counter()
+            try:
+                env.get_template(name)
+            except TemplateSyntaxError:
+                logger.exception("Template %s failed to compile", name)
+                continue
+            timings[name] = time.perf_counter() - started
+    finally:
+        env.bytecode_cache = bytecode_cache
+    return timings
@@ -0,0 +1,339 @@
+"""Payment gateway webhooks: append-only ingest plus a batch processor.
+
+The webhook view only stores the raw event (one INSERT) and acknowledges
+it; everything else happens in process_events(), which the job worker
+runs in the background (`flask jobs worker`). Each batch:
+
+* drops replays: only the first row stored for a gateway event id is
+  applied, the others are marked ``duplicate``;
+* resolves every session id in the batch to its payment in one query;
+* moves payments with one UPDATE per target status. Statuses only move
+  up STATUS_RANK, so an event delivered late (a cancellation after the
+  success, a success after the refund) cannot undo a newer one.
+
+Every row keeps its outcome, so `flask webhooks replay` can put events
+back in the queue after a fix, or load events exported from the gateway.
+"""
+import hashlib
+import json
+import logging
+import threading
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, case, func, insert, or_, select, update
+from sqlalchemy.exc import OperationalError
+
+from app import app, db
+from events import broker
+from metrics import request_metrics
+from models import Payment, PaymentEvent, PaymentStatus
+from revenue import adjust_revenue
+from stats import invalidate_admin_stats
+
+logger = logging.getLogger(__name__)
+
+THAWANI = 'thawani'
+
+# Webhook event types that move a payment, and the status they move it to
+EVENT_STATUSES = {
+    'checkout.success': PaymentStatus.COMPLETED,
+    'checkout.completed': PaymentStatus.COMPLETED,
+    'checkout.cancelled': PaymentStatus.FAILED,
+    'checkout.failed': PaymentStatus.FAILED,
+    'checkout.expired': PaymentStatus.FAILED,
+    'refund.success': PaymentStatus.REFUNDED,
+}
+
+# A payment only moves to a higher rank, whatever order events arrive in
+STATUS_RANK = {
+    PaymentStatus.PENDING: 0,
+    PaymentStatus.FAILED: 1,
+    PaymentStatus.COMPLETED: 2,
+    PaymentStatus.REFUNDED: 3,
+}
+
+# Outcomes recorded on each processed event
+APPLIED = 'applied'
+DUPLICATE = 'duplicate'
+STALE = 'stale'
+UNMATCHED = 'unmatched'
+IGNORED = 'ignored'
+
+
+def parse_time(value):
+    """Naive UTC datetime from an ISO 8601 string or epoch seconds; None if unusable"""
+    try:
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+        if isinstance(value, str) and value:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+            return parsed
+    except (ValueError, OverflowError, OSError):
+        pass
+    return None
+
+
+def ingest_event(raw_body, provider=THAWANI):
+    """Store one webhook delivery as received.
+
+    Raises ValueError if the body is not a JSON object. Nothing is looked
+    up here, so the cost is one INSERT and its commit.
+    """
+    data = json.loads(raw_body)
+    if not isinstance(data, dict):
+        raise ValueError("Webhook body is not a JSON object")
+    body = data.get('data') if isinstance(data.get('data'), dict) else {}
+    event_id = data.get('event_id') or data.get('id') or body.get('event_id')
+    if not event_id:
+        # Without an id from the gateway, identical redeliveries share a content hash
+        event_id = 'sha256:' + hashlib.sha256(raw_body).hexdigest()
+    session_id = body.get('session_id')
+    db.session.execute(insert(PaymentEvent.__table__).values(
+        provider=provider,
+        event_id=str(event_id)[:255],
+        event_type=str(data.get('event_type') or '')[:100],
+        session_id=str(session_id)[:255] if session_id else None,
+        payload=raw_body.decode('utf-8', 'replace') if isinstance(raw_body, bytes) else raw_body,
+        occurred_at=parse_time(data.get('created_at') or body.get('created_at')),
+        received_at=datetime.utcnow(),
+    ))
+    db.session.commit()
+
+
+def _claim_batch(batch_size):
+    """Tag up to `batch_size` unprocessed events with a new batch id; None if there are none"""
+    table = PaymentEvent.__table__
+    now = datetime.utcnow()
+    # A batch whose processor died is released after WEBHOOK_CLAIM_TIMEOUT
+    abandoned = now - timedelta(seconds=app.config['WEBHOOK_CLAIM_TIMEOUT'])
+    claimable = and_(table.c.processed_at.is_(None),
+                     or_(table.c.batch_id.is_(None), table.c.claimed_at < abandoned))
+    ids = db.session.execute(
+        select(table.c.id).where(claimable).order_by(table.c.id).limit(batch_size)
+    ).scalars().all()
+    if not ids:
+        db.session.rollback()
+        return None
+    batch_id = uuid.uuid4().hex
+    claimed = db.session.execute(
+        update(table).where(table.c.id.in_(ids), claimable).values(batch_id=batch_id, claimed_at=now)
+    ).rowcount
+    db.session.commit()
+    return batch_id if claimed else None
+
+
+def move_payments(moves):
+    """Apply `moves` ({target status: {payment id: time}}) in the current transaction.
+
+    Each payment is only updated while its status ranks below the target,
+    which also covers changes made since the caller read it. COMPLETED
+    payments keep an existing paid_at and otherwise take the given time.
+    The revenue rollups are adjusted alongside. Returns how many payments
+    changed.
+    """
+    payment = Payment.__table__
+    returning = db.session.get_bind().dialect.update_returning
+    counted = (payment.c.created_at, payment.c.currency, payment.c.project_id, payment.c.amount)
+    changes = []
+    changed = 0
+    for target, times in moves.items():
+        if not times:
+            continue
+        values = {'status': target}
+        if target == PaymentStatus.COMPLETED:
+            values['paid_at'] = func.coalesce(payment.c.paid_at, case(times, value=payment.c.id))
+        # One UPDATE per current status, so the revenue rollups know which
+        # bucket each payment leaves
+        for current in [status for status, rank in STATUS_RANK.items() if rank < STATUS_RANK[target]]:
+            guard = (payment.c.id.in_(times), payment.c.status == current)
+            if returning:
+                rows = db.session.execute(update(payment).where(*guard).values(**values).returning(*counted)).all()
+            else:
+                rows = db.session.execute(select(*counted).where(*guard).with_for_update()).all()
+                db.session.execute(update(payment).where(*guard).values(**values))
+            for created_at, currency, project_id, amount in rows:
+                changes.append((created_at, currency, project_id, current, amount, -1))
+                changes.append((created_at, currency, project_id, target, amount, 1))
+            changed += len(rows)
+    adjust_revenue(changes)
+    return changed
+
+
+def announce_moves(moves, owners):
+    """After move_payments() is committed: refresh admin stats and tell each owner's stream"""
+    if not any(moves.values()):
+        return
+    invalidate_admin_stats()
+    for target, times in moves.items():
+        for payment_id in times:
+            broker.publish(owners[payment_id], 'payment_status', {'id': payment_id, 'status': target.value})
+
+
+def move_payment(payment, status):
+    """Move one payment like move_payments(), commit and announce it; returns whether it moved"""
+    moves = {status: {payment.id: datetime.utcnow()}}
+    moved = move_payments(moves)
+    db.session.commit()
+    if moved:
+        announce_moves(moves, {payment.id: payment.user_id})
+    return bool(moved)
+
+
+def process_events(batch_size=None):
+    """Apply one batch of stored events; returns a Counter of outcomes (empty when idle)"""
+    batch_id = _claim_batch(batch_size or app.config['WEBHOOK_BATCH_SIZE'])
+    if batch_id is None:
+        return Counter()
+    table = PaymentEvent.__table__
+    rows = db.session.execute(
+        select(table.c.id, table.c.provider, table.c.event_id, table.c.event_type, table.c.session_id,
+               table.c.occurred_at, table.c.received_at)
+        .where(table.c.batch_id == batch_id).order_by(table.c.id)
+    ).all()
+
+    # The first row stored for an event id is the one applied, in this
+    # batch or any other, so concurrent batches agree on which copy counts
+    first_rows = {}
+    for provider in {row.provider for row in rows}:
+        event_ids = {row.event_id for row in rows if row.provider == provider}
+        first_rows.update(((provider, event_id), first_id) for event_id, first_id in db.session.execute(
+            select(table.c.event_id, func.min(table.c.id))
+            .where(table.c.provider == provider, table.c.event_id.in_(event_ids))
+            .group_by(table.c.event_id)
+        ))
+
+    outcomes = {}
+    candidates = []
+    for row in rows:
+        if first_rows[(row.provider, row.event_id)] != row.id:
+            outcomes[row.id] = DUPLICATE
+        elif row.event_type not in EVENT_STATUSES or not row.session_id:
+            outcomes[row.id] = IGNORED
+        else:
+            candidates.append(row)
+
+    payments = {}
+    if candidates:
+        payments = {session_id: (payment_id, status, user_id) for payment_id, session_id, status, user_id in
+                    db.session.execute(
+                        select(Payment.id, Payment.stripe_session_id, Payment.status, Payment.user_id)
+                        .where(Payment.stripe_session_id.in_({row.session_id for row in candidates}))
+                    )}
+
+    # Per payment, the event with the highest target status wins
+    event_payments = {}
+    winners = {}
+    for row in candidates:
+        match = payments.get(row.session_id)
+        if match is None:
+            outcomes[row.id] = UNMATCHED
+            continue
+        payment_id = event_payments[row.id] = match[0]
+        current = winners.get(payment_id)
+        if current is None or STATUS_RANK[EVENT_STATUSES[row.event_type]] > \
+                STATUS_RANK[EVENT_STATUSES[current.event_type]]:
+            winners[payment_id] = row
+
+    current_status = {payment_id: status for payment_id, status, _ in payments.values()}
+    owners = {payment_id: user_id for payment_id, _, user_id in payments.values()}
+    moves = defaultdict(dict)  # target status -> {payment id: event time}
+    for payment_id, row in winners.items():
+        target = EVENT_STATUSES[row.event_type]
+        if STATUS_RANK[target] > STATUS_RANK[current_status[payment_id]]:
+            moves[target][payment_id] = row.occurred_at or row.received_at
+            outcomes[row.id] = APPLIED
+    for row in candidates:
+        outcomes.setdefault(row.id, STALE)
+
+    move_payments(moves)
+
+    now = datetime.utcnow()
+    by_outcome = defaultdict(list)
+    for event_row_id, outcome in outcomes.items():
+        by_outcome[outcome].append(event_row_id)
+    for outcome, event_row_ids in by_outcome.items():
+        values = {'outcome': outcome, 'processed_at': now}
+        linked = {event_row_id: event_payments[event_row_id]
+                  for event_row_id in event_row_ids if event_row_id in event_payments}
+        if linked:
+            values['payment_id'] = case(linked, value=table.c.id, else_=None)
+        db.session.execute(
+            update(table).where(table.c.id.in_(event_row_ids), table.c.batch_id == batch_id).values(**values)
+        )
+    db.session.commit()
+
+    for row in rows:
+        request_metrics.observe('platform_webhook_lag_seconds', (now - row.received_at).total_seconds())
+    announce_moves(moves, owners)
+    counts = Counter(outcomes.values())
+    logger.info("Processed %d webhook events: %s", len(rows), dict(counts))
+    return counts
+
+
+def replay_events(since=None, until=None, outcomes=None, event_ids=None, dry_run=False):
+    """Put stored events back in the queue so the processor applies them again.
+
+    Filters combine; with none, every event is replayed. Returns how many
+    events were (or with `dry_run`, would be) requeued. Replaying is safe:
+    duplicates are still skipped and statuses still only move forward.
+    """
+    table = PaymentEvent.__table__
+    criteria = [table.c.processed_at.isnot(None)]
+    if since is not None:
+        criteria.append(table.c.received_at >= since)
+    if until is not None:
+        criteria.append(table.c.received_at < until)
+    if outcomes:
+        criteria.append(table.c.outcome.in_(outcomes))
+    if event_ids:
+        criteria.append(table.c.event_id.in_(event_ids))
+    if dry_run:
+        return db.session.execute(select(func.count()).select_from(table).where(*criteria)).scalar()
+    count = db.session.execute(
+        update(table).where(*criteria)
+        .values(batch_id=None, claimed_at=None, processed_at=None, outcome=None, payment_id=None)
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+class WebhookProcessor:
+    """Process stored webhook events in batches until stop() is called"""
+
+    def __init__(self, poll_interval=None, batch_size=None):
+        self.poll_interval = poll_interval or app.config['WEBHOOK_POLL_INTERVAL']
+        self.batch_size = batch_size or app.config['WEBHOOK_BATCH_SIZE']
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self, exit_when_idle=False):
+        """Process batches; returns the outcome counts of everything processed"""
+        totals = Counter()
+        with app.app_context():
+            while not self._stopped.is_set():
+                try:
+                    counts = process_events(self.batch_size)
+                except OperationalError as e:
+                    # e.g. SQLite busy; the batch is released after WEBHOOK_CLAIM_TIMEOUT
+                    db.session.rollback()
+                    logger.warning("Webhook batch failed: %s", e)
+                    counts = Counter()
+                except Exception:
+                    # A bad row or constraint violation must not stop the loop;
+                    # the batch is retried after WEBHOOK_CLAIM_TIMEOUT
+                    db.session.rollback()
+                    logger.exception("Webhook batch failed")
+                    counts = Counter()
+                totals.update(counts)
+                db.session.remove()
+                if not counts:
+                    if exit_when_idle:
+                        break
+                    self._stopped.wait(self.poll_interval)
+        return totals